@@ -228,29 +228,46 @@ async def _internal_transfer_to_telegram(
     response: BinaryIO,
     progress_callback: callable,
     file_name: str = None,
+    connection_count: Optional[int] = None,
 ) -> Tuple[TypeInputFile, int]:
     file_id = helpers.generate_random_long()
     file_size = os.path.getsize(response.name)
 
     hash_md5 = hashlib.md5()
     uploader = ParallelTransferrer(client)
-    part_size, part_count, is_large = await uploader.init_upload(file_id, file_size)
+    part_size, part_count, is_large = await uploader.init_upload(
+        file_id, file_size, connection_count=connection_count
+    )
+    pending_report = None
+
+    def report_progress() -> None:
+        # Called once per part. Async callbacks run beside the upload instead
+        # of in front of it, and frames are dropped while one is in flight.
+        nonlocal pending_report
+        if not progress_callback:
+            return
+        r = progress_callback(response.tell(), file_size)
+        if not inspect.isawaitable(r):
+            return
+        if pending_report is None or pending_report.done():
+            pending_report = asyncio.ensure_future(r)
+        elif inspect.iscoroutine(r):
+            r.close()
+
     buffer = bytearray()
     for data in stream_file(response):
-        if progress_callback:
-            r = progress_callback(response.tell(), file_size)
-            if inspect.isawaitable(r):
-                await r
         if not is_large:
             hash_md5.update(data)
         if len(buffer) == 0 and len(data) == part_size:
             await uploader.upload(data)
+            report_progress()
             continue
         new_len = len(buffer) + len(data)
         if new_len >= part_size:
             cutoff = part_size - len(buffer)
             buffer.extend(data[:cutoff])
             await uploader.upload(bytes(buffer))
+            report_progress()
             buffer.clear()
             buffer.extend(data[cutoff:])
         else:
@@ -258,6 +275,7 @@ async def _internal_transfer_to_telegram(
     if len(buffer) > 0:
         await uploader.upload(bytes(buffer))
     await uploader.finish_upload()
+    report_progress()
     if is_large:
         return (
             InputFileBig(file_id, part_count, file_name if file_name else "upload"),
@@ -280,8 +298,11 @@ async def upload_file(
     file: BinaryIO,
     progress_callback: callable = None,
     file_name: str = None,
+    connection_count: Optional[int] = None,
 ) -> TypeInputFile:
     res = (
-        await _internal_transfer_to_telegram(client, file, progress_callback, file_name)
+        await _internal_transfer_to_telegram(
+            client, file, progress_callback, file_name, connection_count
+        )
     )[0]
     return res
@@ -0,0 +1,155 @@
+"""
+Event loop lag while downloading, with disk writes on the loop or off it.
+
+    python -m benchmarks.bench_download_writes                       # 2 GB each way
+    python -m benchmarks.bench_download_writes --size-gb 4 --write-delay-ms 20
+
+A local server streams the file, so the network is never the bottleneck.
+`--write-delay-ms` sleeps in every write to stand in for a slow container
+disk. "inline" is the old `f.write` in the download loop, "writer" is the
+FileWriter used by tools.download_file.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from unittest import mock
+
+import aiohttp
+from aiohttp import web
+
+import file_writer
+from file_writer import FileWriter
+
+CHUNK = 1024 * 1024
+PROBE_INTERVAL = 0.005
+
+
+async def serve(size: int) -> tuple[web.AppRunner, str]:
+    block = os.urandom(CHUNK)
+
+    async def handler(request):
+        response = web.StreamResponse(headers={"Content-Length": str(size)})
+        await response.prepare(request)
+        remaining = size
+        while remaining:
+            part = block[: min(CHUNK, remaining)]
+            await response.write(part)
+            remaining -= len(part)
+        return response
+
+    app = web.Application()
+    app.router.add_get("/file", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/file"
+
+
+async def probe_lag(samples: list[float], stop: asyncio.Event) -> None:
+    """Record how late a short sleep wakes up, which is time the loop was blocked"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        samples.append(time.perf_counter() - started - PROBE_INTERVAL)
+
+
+async def download(url: str, path: str, mode: str, delay: float) -> int:
+    received = 0
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as response:
+            if mode == "inline":
+                with open(path, "wb") as f:
+                    async for chunk in response.content.iter_chunked(CHUNK):
+                        if delay:
+                            time.sleep(delay)
+                        f.write(chunk)
+                        received += len(chunk)
+            else:
+                open(path, "wb").close()
+                writer = FileWriter(path)
+                try:
+                    async for chunk in response.content.iter_chunked(CHUNK):
+                        await writer.write(received, chunk)
+                        received += len(chunk)
+                finally:
+                    await writer.close()
+    return received
+
+
+async def bench(url: str, path: str, mode: str, delay: float) -> dict:
+    samples: list[float] = []
+    stop = asyncio.Event()
+    prober = asyncio.create_task(probe_lag(samples, stop))
+    started = time.perf_counter()
+    received = await download(url, path, mode, delay)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await prober
+    os.unlink(path)
+    samples.sort()
+    return {
+        "mode": mode,
+        "size_mb": round(received / 1024 / 1024),
+        "seconds": round(elapsed, 2),
+        "mb_per_s": round(received / 1024 / 1024 / elapsed, 1),
+        "lag_p50_ms": round(statistics.median(samples) * 1000, 2),
+        "lag_p99_ms": round(samples[int(len(samples) * 0.99) - 1] * 1000, 2),
+        "lag_max_ms": round(samples[-1] * 1000, 2),
+    }
+
+
+async def run(args) -> list[dict]:
+    delay = args.write_delay_ms / 1000
+    with ExitStack() as patches:
+        if delay:
+            # Slow down the writer thread the same way as the inline writes,
+            # for this run only.
+            pwrite = os.pwrite
+
+            def slow_pwrite(fd, data, offset):
+                time.sleep(delay)
+                return pwrite(fd, data, offset)
+
+            patches.enter_context(mock.patch.object(file_writer.os, "pwrite", slow_pwrite))
+        runner, url = await serve(int(args.size_gb * 1024**3))
+        results = []
+        try:
+            with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+                for mode in ("inline", "writer"):
+                    results.append(await bench(url, os.path.join(tmp, f"{mode}.bin"), mode, delay))
+        finally:
+            await runner.cleanup()
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size-gb", type=float, default=2, help="bytes to download per run")
+    parser.add_argument("--write-delay-ms", type=float, default=0, help="added latency per 1MB write")
+    parser.add_argument("--dir", help="directory to download into, defaults to the system temp dir")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run(args))
+    for result in results:
+        print(
+            f"{result['mode']:<7} {result['size_mb']:>6} MB  {result['seconds']:>7}s  "
+            f"{result['mb_per_s']:>7} MB/s  lag p50 {result['lag_p50_ms']} ms  "
+            f"p99 {result['lag_p99_ms']} ms  max {result['lag_max_ms']} ms"
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
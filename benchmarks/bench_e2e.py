@@ -0,0 +1,190 @@
+"""
+End to end download mode throughput, offline.
+
+    python -m benchmarks.bench_e2e                                  # 48MB files, 1/4/8 at once
+    python -m benchmarks.bench_e2e --concurrency 1,16 --size-mb 200 --cdn-mbps 10
+    python -m benchmarks.bench_e2e --json e2e.json                  # report for regression tracking
+
+Every request goes through `bot.process_url` as a user in download mode:
+resolve against a local fake API, probe, download from a local Range
+capable CDN paced per connection, upload to a fake Telegram client and
+delivery. Latency is from the message arriving to the file send to the
+user starting. Redis is fakeredis, everything runs in a temp directory.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+MB = 1024 * 1024
+POLL_INTERVAL = 0.05
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+async def request(bot_module, client, code: str, user_id: int, timeout: float) -> dict:
+    from benchmarks.fakes import FakeMessage
+    from redis_db import db
+    from send_media import running_jobs
+
+    db.set(f"mode_{user_id}", "download")
+    message = FakeMessage(client, user_id, 1, f"https://www.terabox.com/s/1{code}", sender_id=user_id)
+    delivered = asyncio.get_running_loop().create_future()
+    client.waiting[(user_id, message.id)] = delivered
+    started = time.perf_counter()
+    handler = asyncio.create_task(bot_module.process_url(message))
+    try:
+        deadline = started + timeout
+        while not delivered.done() and time.perf_counter() < deadline:
+            # Without a delivery, the request is over once its handler and job are
+            if handler.done() and code not in running_jobs():
+                break
+            await asyncio.wait([delivered], timeout=POLL_INTERVAL)
+    finally:
+        client.waiting.pop((user_id, message.id), None)
+    latency = delivered.result() - started if delivered.done() else None
+    await handler
+    return {"ok": latency is not None, "latency": latency}
+
+
+async def run_level(bot_module, client, size: int, concurrency: int, count: int, level: int, timeout: float) -> dict:
+    codes = [f"bench{level}x{i}" for i in range(count)]
+    limiter = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> dict:
+        async with limiter:
+            return await request(bot_module, client, codes[i], 10_000 * level + i, timeout)
+
+    uploaded = client.uploaded
+    started = time.perf_counter()
+    results = await asyncio.gather(*[one(i) for i in range(count)])
+    elapsed = time.perf_counter() - started
+    latencies = [r["latency"] for r in results if r["ok"]]
+    return {
+        "concurrency": concurrency,
+        "requests": count,
+        "ok": len(latencies),
+        "failed": count - len(latencies),
+        "seconds": round(elapsed, 2),
+        "files_per_min": round(len(latencies) / elapsed * 60, 1),
+        "mb_per_s": round(len(latencies) * size / MB / elapsed, 1),
+        "uploaded_mb": round((client.uploaded - uploaded) / MB, 1),
+        "latency_p50_s": round(statistics.median(latencies), 2) if latencies else None,
+        "latency_p90_s": round(percentile(latencies, 0.9), 2) if latencies else None,
+        "latency_max_s": round(max(latencies), 2) if latencies else None,
+    }
+
+
+async def run(args, source: str) -> dict:
+    from benchmarks.fakes import FakeClient, FakeUpstream
+    import bot as bot_module
+    import terabox
+    from http_client import http
+    from loop_monitor import loop_monitor
+    from memory import memory_governor, rss
+    from outbox import outbox
+
+    levels = [int(level) for level in args.concurrency.split(",")]
+    codes = [
+        f"bench{level}x{i}"
+        for level, concurrency in enumerate(levels)
+        for i in range(args.requests or 2 * concurrency)
+    ]
+    upstream = FakeUpstream(source, codes, rate=args.cdn_mbps * MB, resolver_latency=args.resolver_ms / 1000)
+    terabox.API_URL = upstream.start()
+
+    client = FakeClient(upload_rate=args.upload_mbps * MB, rtt=args.rtt_ms / 1000)
+    client.waiting = {}
+
+    def on_send(chat, reply_to):
+        future = client.waiting.get((chat, reply_to))
+        if future and not future.done():
+            future.set_result(time.perf_counter())
+
+    client.on_send = on_send
+    bot_module.bot = client
+    outbox.attach(client)
+    monitor = asyncio.create_task(loop_monitor.run())
+    size = os.path.getsize(source)
+    results = []
+    peak_rss = rss()
+    try:
+        for level, concurrency in enumerate(levels):
+            result = await run_level(
+                bot_module, client, size, concurrency, args.requests or 2 * concurrency, level, args.timeout
+            )
+            result["loop_lag_p99_ms"] = round(loop_monitor.stats()["p99"] * 1000, 1)
+            peak_rss = max(peak_rss, rss())
+            results.append(result)
+            print(
+                f"x{concurrency:<3} {result['ok']}/{result['requests']} ok  {result['seconds']:>7}s  "
+                f"{result['mb_per_s']:>6} MB/s  latency p50 {result['latency_p50_s']}s  "
+                f"p90 {result['latency_p90_s']}s  max {result['latency_max_s']}s  "
+                f"loop lag p99 {result['loop_lag_p99_ms']} ms"
+            )
+            loop_monitor.samples.clear()
+    finally:
+        monitor.cancel()
+        upstream.close()
+        await http.close()
+    return {
+        "benchmark": "e2e",
+        "python": platform.python_version(),
+        "config": vars(args),
+        "file_mb": round(size / MB, 1),
+        "cdn_requests": upstream.requests,
+        "cdn_served_mb": round(upstream.served / MB, 1),
+        "peak_rss_mb": round(peak_rss / MB, 1),
+        "memory_shed": memory_governor.shed,
+        "results": results,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--concurrency", default="1,4,8", help="comma separated requests in flight per run")
+    parser.add_argument("--requests", type=int, help="requests per run, twice the concurrency by default")
+    parser.add_argument("--size-mb", type=float, default=48, help="size of the served file")
+    parser.add_argument("--moov-front", action="store_true", help="serve a file that needs no faststart rewrite")
+    parser.add_argument("--cdn-mbps", type=float, default=20, help="CDN pace per connection, MB/s")
+    parser.add_argument("--upload-mbps", type=float, default=40, help="fake Telegram upload pace per file, MB/s")
+    parser.add_argument("--resolver-ms", type=float, default=200, help="resolver API latency")
+    parser.add_argument("--rtt-ms", type=float, default=20, help="latency of every other Telegram request")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds before a request counts as failed")
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args(argv)
+    report_path = os.path.abspath(args.json) if args.json else None
+
+    from benchmarks.fakes import install_fake_redis
+    from benchmarks.sample_media import write_sample_mp4
+
+    install_fake_redis()
+    with tempfile.TemporaryDirectory() as tmp:
+        # Job dirs, the chunk store and the session file all go to the cwd
+        os.chdir(tmp)
+        source = write_sample_mp4(os.path.join(tmp, "source.mp4"), int(args.size_mb * MB), moov_at_end=not args.moov_front)
+        from tracing import setup_logging
+        import logging
+
+        setup_logging(logging.WARNING, fmt="text")
+        report = asyncio.run(run(args, source))
+        os.chdir(REPO)
+    if report_path:
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0 if all(result["failed"] == 0 for result in report["results"]) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""
+Added latency of the faststart rewrite.
+
+    python -m benchmarks.bench_faststart                 # synthetic files
+    python -m benchmarks.bench_faststart a.mp4 b.mp4     # copies of real samples
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.sample_media import write_sample_mp4
+from faststart import faststart
+
+SIZES_MB = [16, 128, 512]
+
+
+def bench_file(path: str) -> dict:
+    size = os.path.getsize(path)
+    tracemalloc.start()
+    started = time.perf_counter()
+    rewritten = faststart(path)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "file": os.path.basename(path),
+        "size_mb": round(size / 1024 / 1024, 1),
+        "rewritten": rewritten,
+        "seconds": round(elapsed, 3),
+        "mb_per_s": round(size / 1024 / 1024 / elapsed, 1) if elapsed else None,
+        "peak_python_mb": round(peak / 1024 / 1024, 2),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("files", nargs="*", help="MP4 samples, they are copied first")
+    parser.add_argument("--sizes", type=int, nargs="*", default=SIZES_MB, help="synthetic sizes in MB")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        jobs = []
+        for sample in args.files:
+            dest = os.path.join(tmp, os.path.basename(sample))
+            shutil.copyfile(sample, dest)
+            jobs.append(dest)
+        if not args.files:
+            for mb in args.sizes:
+                jobs.append(write_sample_mp4(os.path.join(tmp, f"synthetic_{mb}mb.mp4"), mb * 1024 * 1024))
+        for path in jobs:
+            result = bench_file(path)
+            results.append(result)
+            print(
+                f"{result['file']:<28} {result['size_mb']:>8} MB  "
+                f"{result['seconds']:>7}s  {result['mb_per_s']} MB/s  "
+                f"peak {result['peak_python_mb']} MB  rewritten={result['rewritten']}"
+            )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,267 @@
+"""
+FastTelethon upload costs against a fake MTProto sender.
+
+    python -m benchmarks.bench_fasttelethon                          # 5MB, 100MB and 1.5GB
+    python -m benchmarks.bench_fasttelethon --sizes-mb 2000 --latency-ms 80 --jitter-ms 40
+    python -m benchmarks.bench_fasttelethon --json fasttelethon.json
+
+`upload_file` runs unchanged, only MTProtoSender and the client calls it
+makes are replaced. Every part takes `--latency-ms` plus a normally
+distributed `--jitter-ms`, and `--connection-mbps` if set. Reports parts
+per second, CPU seconds per GB, bytes copied in Python per byte uploaded
+(file reads, buffer extends and bytes() conversions), peak traced memory,
+time to the first part and how evenly parts and time spread over the
+connections.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import FastTelethon  # noqa: E402
+
+MB = 1024 * 1024
+
+
+def jain(values: list[float]) -> float:
+    """Jain's fairness index, 1.0 when every value is the same"""
+    if not values or not any(values):
+        return 1.0
+    return sum(values) ** 2 / (len(values) * sum(v * v for v in values))
+
+
+class Copies:
+    """Bytes FastTelethon copies, counted where it reads, extends and converts"""
+
+    def __init__(self):
+        self.bytes = 0
+
+    def install(self):
+        copies = self
+
+        class CountingBytearray(bytearray):
+            def extend(self, data):
+                copies.bytes += len(data)
+                super().extend(data)
+
+        def counting_bytes(data=b"", *args):
+            copies.bytes += len(data) if not isinstance(data, int) else data
+            return bytes(data, *args)
+
+        FastTelethon.bytearray = CountingBytearray
+        FastTelethon.bytes = counting_bytes
+
+    @staticmethod
+    def uninstall():
+        for name in ("bytearray", "bytes"):
+            vars(FastTelethon).pop(name, None)
+
+
+class CountingFile:
+    def __init__(self, f, copies: Copies):
+        self._f = f
+        self._copies = copies
+        self.name = f.name
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._f.read(size)
+        self._copies.bytes += len(data)
+        return data
+
+    def tell(self) -> int:
+        return self._f.tell()
+
+
+class FakeSender:
+    """Stands in for MTProtoSender, each part costs latency, jitter and bandwidth"""
+
+    def __init__(self, auth_key=None, loggers=None):
+        self.auth_key = auth_key
+        self.parts = 0
+        self.bytes = 0
+        self.busy = 0.0
+
+    async def connect(self, connection) -> None:
+        await asyncio.sleep(self.config.connect)
+
+    async def send(self, request) -> bool:
+        started = time.perf_counter()
+        delay = max(0.0, random.gauss(self.config.latency, self.config.jitter))
+        if self.config.bandwidth:
+            delay += len(request.bytes) / self.config.bandwidth
+        await asyncio.sleep(delay)
+        self.parts += 1
+        self.bytes += len(request.bytes)
+        self.busy += time.perf_counter() - started
+        self.config.on_part()
+        return True
+
+    async def disconnect(self) -> None:
+        pass
+
+
+class FakeClient:
+    """The parts of TelegramClient ParallelTransferrer touches"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.session = SimpleNamespace(dc_id=2, auth_key=object())
+        self._log = None
+        self._proxy = None
+        self.senders: list[FakeSender] = []
+
+    async def _get_dc(self, dc_id):
+        return SimpleNamespace(ip_address="127.0.0.1", port=443, id=dc_id)
+
+    def _connection(self, *args, **kwargs):
+        return None
+
+    async def _call(self, sender: FakeSender, request):
+        if sender not in self.senders:
+            self.senders.append(sender)
+        return await sender.send(request)
+
+
+async def upload(path: str, args, instrumented: bool) -> tuple[FakeClient, dict]:
+    """
+    One upload of `path`. The instrumented run counts copies and traces
+    memory, which slows it down, so timings come from a plain run.
+    """
+    first_part = None
+
+    def on_part():
+        nonlocal first_part
+        if first_part is None:
+            first_part = time.perf_counter()
+
+    FakeSender.config = SimpleNamespace(
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        bandwidth=args.connection_mbps * MB if args.connection_mbps else 0,
+        connect=args.connect_ms / 1000,
+        on_part=on_part,
+    )
+    client = FakeClient(asyncio.get_running_loop())
+    copies = Copies()
+    reports = 0
+
+    def progress(current, total):
+        nonlocal reports
+        reports += 1
+
+    if instrumented:
+        copies.install()
+        tracemalloc.start()
+    cpu = time.process_time()
+    started = time.perf_counter()
+    try:
+        with open(path, "rb") as f:
+            await FastTelethon.upload_file(
+                client,
+                CountingFile(f, copies) if instrumented else f,
+                progress,
+                "bench",
+                connection_count=args.connections,
+            )
+        elapsed = time.perf_counter() - started
+        cpu = time.process_time() - cpu
+        peak = tracemalloc.get_traced_memory()[1] if instrumented else 0
+    finally:
+        if instrumented:
+            tracemalloc.stop()
+            Copies.uninstall()
+    return client, {
+        "elapsed": elapsed,
+        "cpu": cpu,
+        "first_part": first_part - started if first_part else None,
+        "copied": copies.bytes,
+        "peak": peak,
+        "reports": reports,
+    }
+
+
+async def bench(path: str, args) -> dict:
+    size = os.path.getsize(path)
+    client, timing = await upload(path, args, instrumented=False)
+    _, instrumented = await upload(path, args, instrumented=True)
+    elapsed, cpu = timing["elapsed"], timing["cpu"]
+    senders = client.senders
+    parts = sum(sender.parts for sender in senders)
+    uploaded = sum(sender.bytes for sender in senders)
+    return {
+        "size_mb": round(size / MB, 1),
+        "connections": len(senders),
+        "parts": parts,
+        "seconds": round(elapsed, 3),
+        "parts_per_s": round(parts / elapsed, 1),
+        "mb_per_s": round(uploaded / MB / elapsed, 1),
+        "cpu_s_per_gb": round(cpu / (uploaded / 1024**3), 2) if uploaded else None,
+        "copied_per_byte": round(instrumented["copied"] / uploaded, 2) if uploaded else None,
+        "peak_traced_mb": round(instrumented["peak"] / MB, 2),
+        "first_part_ms": round(timing["first_part"] * 1000, 1) if timing["first_part"] is not None else None,
+        "progress_reports": timing["reports"],
+        "fairness_parts": round(jain([sender.parts for sender in senders]), 3),
+        "fairness_busy": round(jain([sender.busy for sender in senders]), 3),
+        # Share of the wall time connections were waiting on the next part
+        "idle_share": round(1 - sum(sender.busy for sender in senders) / (elapsed * len(senders)), 3)
+        if senders
+        else None,
+    }
+
+
+async def run(args, paths: list[str]) -> list[dict]:
+    FastTelethon.MTProtoSender = FakeSender
+    return [await bench(path, args) for path in paths]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes-mb", default="5,100,1500", help="comma separated file sizes")
+    parser.add_argument("--connections", type=int, help="senders per upload, FastTelethon's choice by default")
+    parser.add_argument("--latency-ms", type=float, default=50, help="time each part takes")
+    parser.add_argument("--jitter-ms", type=float, default=15, help="standard deviation added to it")
+    parser.add_argument("--connection-mbps", type=float, default=0, help="bandwidth per connection, unlimited if 0")
+    parser.add_argument("--connect-ms", type=float, default=100, help="time to open a sender")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--dir", help="directory for the test files, defaults to the system temp dir")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args(argv)
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        paths = []
+        for size in args.sizes_mb.split(","):
+            path = os.path.join(tmp, f"{size}mb.bin")
+            # Sparse, reads cost CPU but no disk
+            with open(path, "wb") as f:
+                f.truncate(int(float(size) * MB))
+            paths.append(path)
+        results = asyncio.run(run(args, paths))
+
+    for result in results:
+        print(
+            f"{result['size_mb']:>7} MB  {result['connections']:>2} conns  {result['parts_per_s']:>7} parts/s  "
+            f"{result['mb_per_s']:>6} MB/s  {result['cpu_s_per_gb']} CPU s/GB  "
+            f"copied x{result['copied_per_byte']}  peak {result['peak_traced_mb']} MB  "
+            f"first part {result['first_part_ms']} ms  fairness {result['fairness_parts']}/{result['fairness_busy']}  "
+            f"idle {result['idle_share']:.0%}"
+        )
+    if args.json:
+        report = {"benchmark": "fasttelethon", "python": platform.python_version(), "config": vars(args), "results": results}
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
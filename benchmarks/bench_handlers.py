@@ -0,0 +1,356 @@
+"""
+Synthetic update load on the bot's handlers, offline.
+
+    python -m benchmarks.bench_handlers                              # 20 updates/s for 30s from 1000 users
+    python -m benchmarks.bench_handlers --rate 500 --users 50 --distribution zipf
+    python -m benchmarks.bench_handlers --mix link=1 --download-users 1 --fresh 0.05
+    python -m benchmarks.bench_handlers --json handlers.json
+
+Events go to the handlers registered on `bot.bot`, through the filters of
+their own builders, each update in its own task as telethon dispatches
+them. Updates arrive as a Poisson process at `--rate`, from users picked
+uniformly or by a Zipf law, and their kinds are drawn from `--mix`:
+
+    link      a share link, answered according to the user's mode with a
+              play button or the stored file; a `--fresh` share of them
+              are new files, resolved, downloaded and uploaded
+    token     /start <uuid> for a stored file
+    start     /start
+    callback  the Play Online or Download button, for the user's mode
+    text      a message without a link
+
+Reports handler latency percentiles overall and per kind, how evenly
+latency is spread over users and Redis round trips per update. Fairness
+is Jain's index of each user's mean slowdown, their latency over the
+median of the same kind, so a user sending mostly links doesn't count
+as treated worse than one pressing buttons. Handler time for a link
+includes the one second process_url waits after each link, and the
+edits it makes share the edit scheduler's global budget, which is what
+a link rate of a few per second runs into first.
+"""
+import argparse
+import asyncio
+import inspect
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter, defaultdict
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from telethon import events  # noqa: E402
+
+from benchmarks.bench_e2e import percentile  # noqa: E402
+from benchmarks.bench_fasttelethon import jain  # noqa: E402
+from benchmarks.fakes import FakeCallbackQuery, FakeMessage, FakeNewMessage, redis_tag  # noqa: E402
+
+log = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+KINDS = ("link", "token", "start", "callback", "text")
+FIRST_USER = 100_000
+FIRST_FILE = 500_000
+BUILDERS = {FakeNewMessage: events.NewMessage, FakeCallbackQuery: events.CallbackQuery}
+
+
+class Users:
+    """Who sends the next update, and the mode each user picked"""
+
+    def __init__(self, count: int, distribution: str, zipf_s: float, download_share: float, rng: random.Random):
+        self.rng = rng
+        self.ids = [FIRST_USER + i for i in range(count)]
+        if distribution == "zipf":
+            weights = [1 / (rank + 1) ** zipf_s for rank in range(count)]
+        else:
+            weights = [1.0] * count
+        self.cum_weights = list(itertools.accumulate(weights))
+        self.modes = {user: "download" if rng.random() < download_share else "play" for user in self.ids}
+
+    def pick(self) -> int:
+        return self.rng.choices(self.ids, cum_weights=self.cum_weights)[0]
+
+
+async def dispatch(handlers, client, event) -> tuple[int, bool]:
+    """
+    Run every handler whose builder accepts `event`, the way telethon's
+    `_dispatch_update` does. Returns how many ran and whether all succeeded.
+    """
+    matched, ok = 0, True
+    for callback, builder in handlers:
+        if type(builder) is not BUILDERS[type(event)]:
+            continue
+        if not builder.resolved:
+            await builder.resolve(client)
+        passed = builder.filter(event)
+        if inspect.isawaitable(passed):
+            passed = await passed
+        if not passed:
+            continue
+        matched += 1
+        try:
+            await callback(event)
+        except events.StopPropagation:
+            break
+        except Exception:
+            log.exception(f"Unhandled exception on {callback.__name__}")
+            ok = False
+    return matched, ok
+
+
+def summarize(latencies: list[float]) -> dict:
+    if not latencies:
+        return {"p50_ms": None, "p90_ms": None, "p99_ms": None, "max_ms": None}
+    return {
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p90_ms": round(percentile(latencies, 0.9) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "max_ms": round(max(latencies) * 1000, 1),
+    }
+
+
+async def run(args, redis_class, source: str) -> dict:
+    from benchmarks.fakes import FakeClient, FakeUpstream
+    import bot as bot_module
+    import terabox
+    from edit_scheduler import edit_scheduler
+    from http_client import http
+    from loop_monitor import loop_monitor
+    from outbox import outbox
+    from redis_db import db
+
+    rng = random.Random(args.seed)
+    mix = dict.fromkeys(KINDS, 0.0)
+    for entry in args.mix.split(","):
+        kind, _, weight = entry.partition("=")
+        if kind not in mix:
+            raise SystemExit(f"Unknown update kind {kind!r}, pick from {', '.join(KINDS)}")
+        mix[kind] = float(weight or 1)
+    kinds = [kind for kind in KINDS if mix[kind] > 0]
+    kind_weights = list(itertools.accumulate(mix[kind] for kind in kinds))
+    users = Users(args.users, args.distribution, args.zipf_s, args.download_users, rng)
+
+    # What the handlers expect to find: modes, active tokens and stored files
+    for user, mode in users.modes.items():
+        db.set(f"mode_{user}", mode)
+        db.set(f"active_{user}", "1")
+    stored, tokens = [], []
+    for i in range(args.stored):
+        code, file_id, token = f"stored{i}", FIRST_FILE + i, str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        db.set(code, file_id)
+        db.set(f"mid_{file_id}", token)
+        db.set(token, file_id)
+        stored.append(code)
+        tokens.append(token)
+
+    # Even with no fresh links, a lookup that misses must not leave the machine
+    upstream = FakeUpstream(source, [], rate=args.cdn_mbps * MB)
+    terabox.API_URL = upstream.start()
+    handlers = bot_module.bot.list_event_handlers()
+    client = FakeClient(upload_rate=args.upload_mbps * MB, rtt=args.rtt_ms / 1000)
+    bot_module.bot = client
+    outbox.attach(client)
+    ids = itertools.count(1)
+    fresh = itertools.count()
+
+    def make_update(kind: str, user: int):
+        if kind == "callback":
+            data = b"download_mode" if users.modes[user] == "download" else b"play_online"
+            return FakeCallbackQuery(client, user, next(ids), data)
+        if kind == "link":
+            if rng.random() < args.fresh:
+                code = f"fresh{next(fresh)}"
+                upstream.codes.add(code)
+            else:
+                code = rng.choice(stored)
+            text = f"https://www.terabox.com/s/1{code}"
+        elif kind == "token":
+            text = f"/start {rng.choice(tokens)}"
+        elif kind == "start":
+            text = "/start"
+        else:
+            text = "hello, is this thing on?"
+        return FakeNewMessage(FakeMessage(client, user, next(ids), text))
+
+    records = []
+
+    async def handle(kind: str, user: int, event) -> None:
+        redis_tag.set(kind)
+        started = time.perf_counter()
+        matched, ok = await dispatch(handlers, client, event)
+        records.append((kind, user, time.perf_counter() - started, matched, ok))
+
+    ops_before = redis_class.ops
+    tagged_before = Counter(redis_class.tagged)
+    monitor = asyncio.create_task(loop_monitor.run())
+    loop = asyncio.get_running_loop()
+    tasks = set()
+    offered = Counter()
+    peak_in_flight = peak_edits = 0
+    max_late = 0.0
+    started = due = loop.time()
+    try:
+        while True:
+            due += rng.expovariate(args.rate) if args.arrivals == "poisson" else 1 / args.rate
+            if due - started > args.duration:
+                break
+            delay = due - loop.time()
+            # Behind schedule, send right away but still let the handlers run
+            await asyncio.sleep(max(delay, 0))
+            max_late = max(max_late, -delay)
+            kind = rng.choices(kinds, cum_weights=kind_weights)[0]
+            user = users.pick()
+            offered[kind] += 1
+            task = asyncio.create_task(handle(kind, user, make_update(kind, user)))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            peak_in_flight = max(peak_in_flight, len(tasks))
+            peak_edits = max(peak_edits, edit_scheduler.pending)
+        sent_in = loop.time() - started
+        timed_out = 0
+        if tasks:
+            _, pending = await asyncio.wait(set(tasks), timeout=args.timeout)
+            timed_out = len(pending)
+            for task in pending:
+                task.cancel()
+        elapsed = loop.time() - started
+        lag = loop_monitor.stats()
+    finally:
+        monitor.cancel()
+        upstream.close()
+        await http.close()
+
+    ops = redis_class.ops - ops_before
+    tagged = Counter(redis_class.tagged)
+    tagged.subtract(tagged_before)
+    by_kind = defaultdict(list)
+    errors, unmatched = Counter(), Counter()
+    for kind, user, latency, matched, ok in records:
+        by_kind[kind].append(latency)
+        errors[kind] += not ok
+        unmatched[kind] += not matched
+    medians = {kind: statistics.median(latencies) for kind, latencies in by_kind.items()}
+    by_user = defaultdict(list)
+    for kind, user, latency, _, _ in records:
+        by_user[user].append(latency / medians[kind] if medians[kind] else 1.0)
+    kinds_report = {
+        kind: {
+            "updates": offered[kind],
+            "completed": len(by_kind[kind]),
+            "errors": errors[kind],
+            "unmatched": unmatched[kind],
+            "redis_ops_per_update": round(tagged[kind] / offered[kind], 2),
+            **summarize(by_kind[kind]),
+        }
+        for kind in kinds
+        if offered[kind]
+    }
+    user_slowdowns = [statistics.fmean(slowdowns) for slowdowns in by_user.values()]
+    heaviest = max((len(slowdowns) for slowdowns in by_user.values()), default=0)
+    updates = sum(offered.values())
+    return {
+        "benchmark": "handlers",
+        "python": platform.python_version(),
+        "config": vars(args),
+        "updates": updates,
+        "completed": len(records),
+        "timed_out": timed_out,
+        "offered_per_s": round(updates / sent_in, 1),
+        "handled_per_s": round(len(records) / elapsed, 1),
+        "peak_in_flight": peak_in_flight,
+        "peak_edits_pending": peak_edits,
+        "generator_late_max_ms": round(max_late * 1000, 1),
+        "latency": summarize([record[2] for record in records]),
+        "kinds": kinds_report,
+        "users_seen": len(by_user),
+        "heaviest_user_share": round(heaviest / len(records), 3) if records else None,
+        "fairness_users": round(jain(user_slowdowns), 3),
+        "worst_user_slowdown": round(max(user_slowdowns), 2) if user_slowdowns else None,
+        "redis_ops_per_update": round(ops / updates, 2) if updates else None,
+        "redis_ops_background": tagged[None],
+        "fresh_links": next(fresh),
+        "cdn_served_mb": round(upstream.served / MB, 1),
+        "loop_lag_p99_ms": round(lag["p99"] * 1000, 1),
+        "loop_lag_max_ms": round(lag["max_lag"] * 1000, 1),
+    }
+
+
+def print_report(report: dict) -> None:
+    print(
+        f"{report['completed']}/{report['updates']} updates  offered {report['offered_per_s']}/s  "
+        f"handled {report['handled_per_s']}/s  peak in flight {report['peak_in_flight']}  "
+        f"peak edits pending {report['peak_edits_pending']}  generator late max {report['generator_late_max_ms']} ms"
+    )
+    print(f"{'kind':<9} {'count':>6} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8} {'redis/upd':>9} {'errors':>6}")
+    rows = [*report["kinds"].items(), ("all", {"updates": report["updates"], **report["latency"],
+                                              "redis_ops_per_update": report["redis_ops_per_update"],
+                                              "errors": sum(k["errors"] for k in report["kinds"].values())})]
+    for kind, row in rows:
+        print(
+            f"{kind:<9} {row['updates']:>6} {row['p50_ms']!s:>8} {row['p90_ms']!s:>8} {row['p99_ms']!s:>8} "
+            f"{row['max_ms']!s:>8} {row['redis_ops_per_update']!s:>9} {row['errors']:>6}"
+        )
+    if report["fresh_links"]:
+        print(f"{report['fresh_links']} fresh links, {report['cdn_served_mb']} MB from the CDN")
+    for kind, row in report["kinds"].items():
+        if row["unmatched"]:
+            print(f"warning: {row['unmatched']} {kind} updates matched no handler")
+    print(
+        f"{report['users_seen']} users, heaviest sent {report['heaviest_user_share']:.1%}  "
+        f"fairness {report['fairness_users']}  worst user slowdown x{report['worst_user_slowdown']}  "
+        f"loop lag p99 {report['loop_lag_p99_ms']} ms, max {report['loop_lag_max_ms']} ms"
+    )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rate", type=float, default=20, help="updates per second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to send updates for")
+    parser.add_argument("--arrivals", choices=("poisson", "constant"), default="poisson")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--distribution", choices=("uniform", "zipf"), default="uniform", help="who sends the updates")
+    parser.add_argument("--zipf-s", type=float, default=1.1, help="Zipf exponent, higher puts more on the top users")
+    parser.add_argument("--mix", default="link=4,token=2,start=1,callback=2,text=1", help="update kinds and weights")
+    parser.add_argument("--download-users", type=float, default=0.3, help="share of users in download mode")
+    parser.add_argument("--stored", type=int, default=200, help="files already stored, behind links and tokens")
+    parser.add_argument("--fresh", type=float, default=0, help="share of links to files not stored yet")
+    parser.add_argument("--size-mb", type=float, default=8, help="size of a fresh file")
+    parser.add_argument("--cdn-mbps", type=float, default=20, help="CDN pace per connection, MB/s")
+    parser.add_argument("--upload-mbps", type=float, default=40, help="fake Telegram upload pace per file, MB/s")
+    parser.add_argument("--rtt-ms", type=float, default=20, help="latency of every Telegram request")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds to wait for handlers after the last update")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args(argv)
+    report_path = os.path.abspath(args.json) if args.json else None
+
+    from benchmarks.fakes import install_fake_redis
+    from benchmarks.sample_media import write_sample_mp4
+
+    redis_class = install_fake_redis()
+    with tempfile.TemporaryDirectory() as tmp:
+        # The session file, job dirs and the chunk store all go to the cwd
+        os.chdir(tmp)
+        source = write_sample_mp4(os.path.join(tmp, "source.mp4"), int(args.size_mb * MB))
+        from tracing import setup_logging
+
+        setup_logging(logging.WARNING, fmt="text")
+        report = asyncio.run(run(args, redis_class, source))
+        os.chdir(REPO)
+    print_report(report)
+    if report_path:
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0 if report["timed_out"] == 0 and not any(k["errors"] for k in report["kinds"].values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
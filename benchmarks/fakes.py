@@ -0,0 +1,374 @@
+"""
+Offline stand-ins for the bot's outside world: Redis, the resolver API, the
+CDN and Telegram. Benchmarks built on these need no network or credentials.
+
+`install_fake_redis` has to run before anything imports `redis_db`, which
+connects on import.
+"""
+import asyncio
+import hashlib
+import itertools
+import os
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from types import SimpleNamespace
+
+from aiohttp import web
+
+from http_client import http
+
+PART_SIZE = 512 * 1024
+SERVE_CHUNK = 64 * 1024
+
+# Redis commands are counted under the tag of the task that sent them.
+redis_tag: ContextVar[str | None] = ContextVar("redis_tag", default=None)
+
+
+def install_fake_redis():
+    """
+    Point `redis.Redis.from_url` at an in-process fakeredis server.
+
+    Returns:
+        type: The client class. `ops` counts round trips, a pipeline being
+            one, and `tagged` splits them by the `redis_tag` they ran under.
+    """
+    try:
+        import fakeredis
+    except ImportError:
+        raise SystemExit("The offline benchmarks need fakeredis: pip install fakeredis")
+    import redis
+
+    server = fakeredis.FakeServer()
+
+    class CountingRedis(fakeredis.FakeRedis):
+        ops = 0
+        tagged = Counter()
+
+        @staticmethod
+        def count():
+            CountingRedis.ops += 1
+            CountingRedis.tagged[redis_tag.get()] += 1
+
+        def execute_command(self, *args, **kwargs):
+            self.count()
+            return super().execute_command(*args, **kwargs)
+
+        def pipeline(self, *args, **kwargs):
+            pipe = super().pipeline(*args, **kwargs)
+            execute = pipe.execute
+
+            def counted(*args, **kwargs):
+                self.count()
+                return execute(*args, **kwargs)
+
+            pipe.execute = counted
+            return pipe
+
+    redis.Redis.from_url = classmethod(
+        lambda cls, url, **kwargs: CountingRedis(server=server, decode_responses=True)
+    )
+    return CountingRedis
+
+
+class FakeMedia:
+    def __init__(self, size: int):
+        self.size = size
+
+    @property
+    def document(self):
+        return self
+
+
+class FakeMessage:
+    """Enough of telethon's Message for the handlers and VideoSender"""
+
+    is_private = True
+    out = False
+    fwd_from = None
+
+    def __init__(self, client, chat_id: int, id: int, text: str = "", sender_id: int = None, media=None):
+        self.client = client
+        self.chat_id = chat_id
+        self.id = id
+        self.text = text
+        self.raw_text = text
+        self.message = text
+        self.sender_id = sender_id if sender_id is not None else chat_id
+        self.media = media
+        self.document = media
+        self.pattern_match = None
+        self.deleted = False
+
+    async def reply(self, message: str = "", **kwargs):
+        kwargs["reply_to"] = self.id
+        return await self.client.send_message(self.chat_id, message, **kwargs)
+
+    async def respond(self, message: str = "", **kwargs):
+        return await self.client.send_message(self.chat_id, message, **kwargs)
+
+    async def edit(self, text: str = "", **kwargs):
+        await asyncio.sleep(self.client.rtt)
+        self.client.edits += 1
+        self.text = text
+        return self
+
+    async def delete(self):
+        # No await before returning: delivery right after a delete stays in
+        # the same loop step, like the real call's request being queued.
+        self.deleted = True
+
+    async def get_sender(self):
+        return FakeUser(self.sender_id)
+
+
+class FakeNewMessage:
+    """A NewMessage event, which reads like the message it carries"""
+
+    def __init__(self, message: FakeMessage):
+        self.message = message
+        self.pattern_match = None
+
+    def __getattr__(self, name):
+        return getattr(self.message, name)
+
+
+class FakeCallbackQuery:
+    """A CallbackQuery event for an inline button pressed under a message"""
+
+    def __init__(self, client, chat_id: int, msg_id: int, data: bytes, sender_id: int = None):
+        self.client = client
+        self.chat_id = chat_id
+        self.message_id = msg_id
+        self.sender_id = sender_id if sender_id is not None else chat_id
+        self.data = data
+        self.query = SimpleNamespace(data=data, chat_instance=0)
+        self.pattern_match = self.data_match = None
+
+    async def answer(self, message: str = None, **kwargs):
+        await asyncio.sleep(self.client.rtt)
+
+    async def edit(self, text: str = "", **kwargs):
+        await asyncio.sleep(self.client.rtt)
+        self.client.edits += 1
+
+
+class FakeUser:
+    def __init__(self, id: int):
+        self.id = id
+        self.first_name = f"user{id}"
+        self.username = None
+        self.bot = False
+
+
+class FakeClient:
+    """
+    A TelegramClient that keeps everything in memory.
+
+    Uploads are read from disk in 512KB parts and paced to `upload_rate`
+    bytes per second, every other request takes `rtt` seconds. `on_send`
+    is called with (chat, reply_to) as a file send starts, which is when a
+    requester counts as served.
+    """
+
+    def __init__(self, upload_rate: float = 40 * 1024 * 1024, rtt: float = 0.02):
+        self.upload_rate = upload_rate
+        self.rtt = rtt
+        self.on_send = None
+        self.messages = 0
+        self.edits = 0
+        self.uploaded = 0
+        self._ids = itertools.count(1000)
+
+    def add_event_handler(self, callback, event=None):
+        pass
+
+    def remove_event_handler(self, callback, event=None):
+        pass
+
+    def is_connected(self) -> bool:
+        return True
+
+    async def __call__(self, request):
+        # Raw requests, which are only GetMessagesRequest for stored files
+        await asyncio.sleep(self.rtt)
+        ids = request.id if isinstance(request.id, list) else [request.id]
+        return SimpleNamespace(messages=[self._message(request.channel, media=FakeMedia(0)) for _ in ids])
+
+    def _message(self, chat, text: str = "", media=None) -> FakeMessage:
+        self.messages += 1
+        return FakeMessage(self, chat, next(self._ids), text or "", media=media)
+
+    async def send_message(self, chat, message: str = "", **kwargs):
+        await asyncio.sleep(self.rtt)
+        return self._message(chat, message)
+
+    async def get_permissions(self, chat, user):
+        await asyncio.sleep(self.rtt)
+        return True
+
+    async def get_messages(self, chat, ids=None, **kwargs):
+        await asyncio.sleep(self.rtt)
+        if isinstance(ids, list):
+            return [self._message(chat, media=FakeMedia(0)) for _ in ids]
+        return self._message(chat, media=FakeMedia(0))
+
+    async def _upload(self, path: str, progress_callback=None) -> FakeMedia:
+        size = os.path.getsize(path)
+        done = 0
+        started = time.monotonic()
+        with open(path, "rb") as f:
+            while part := f.read(PART_SIZE):
+                done += len(part)
+                delay = started + done / self.upload_rate - time.monotonic()
+                await asyncio.sleep(max(delay, 0))
+                if progress_callback:
+                    progress_callback(done, size)
+        self.uploaded += size
+        return FakeMedia(size)
+
+    async def _file_to_media(self, file, progress_callback=None, **kwargs):
+        if isinstance(file, str) and file.startswith("http"):
+            # Telegram fetching a URL itself, paced like an upload
+            async with http.session.get(file) as response:
+                if response.status != 200:
+                    raise Exception(f"Telegram could not fetch the URL: HTTP {response.status}")
+                size = 0
+                async for chunk in response.content.iter_chunked(PART_SIZE):
+                    size += len(chunk)
+            await asyncio.sleep(size / self.upload_rate)
+            return None, FakeMedia(size), False
+        if isinstance(file, str):
+            return None, await self._upload(file, progress_callback), False
+        return None, file, False
+
+    async def send_file(self, chat, file=None, caption=None, reply_to=None, progress_callback=None, **kwargs):
+        if self.on_send:
+            self.on_send(chat, reply_to)
+        if isinstance(file, list):
+            await asyncio.sleep(self.rtt)
+            return [self._message(chat, media=item) for item in file]
+        if isinstance(file, (str, os.PathLike)) and os.path.exists(file):
+            media = await self._upload(str(file), progress_callback)
+        else:
+            await asyncio.sleep(self.rtt)
+            media = file if isinstance(file, FakeMedia) else FakeMedia(0)
+        return self._message(chat, caption, media=media)
+
+
+class FakeUpstream:
+    """
+    A local resolver API and CDN on one aiohttp server, running on its own
+    thread and loop so serving doesn't show up as the bot's loop lag.
+
+    The resolver answers `terabox.API_URL` requests with two mirror links
+    for every share code it knows. The CDN serves `source` for every code
+    with a few bytes in the middle changed per code, so content
+    fingerprints differ, honours Range requests and paces each connection
+    to `rate` bytes per second.
+    """
+
+    def __init__(self, source: str, codes, rate: float = 20 * 1024 * 1024, resolver_latency: float = 0.2):
+        self.source = source
+        self.size = os.path.getsize(source)
+        self.codes = set(codes)
+        self.rate = rate
+        self.resolver_latency = resolver_latency
+        self.served = 0
+        self.requests = 0
+        self.base = None
+        self._runner = None
+        self._loop = None
+
+    def _patch(self, code: str) -> tuple[int, bytes]:
+        return self.size // 2, hashlib.sha1(code.encode()).digest()
+
+    async def resolve(self, request: web.Request) -> web.Response:
+        # tools imports redis_db, which must not happen before install_fake_redis
+        from tools import extract_code_from_url
+
+        await asyncio.sleep(self.resolver_latency)
+        payload = await request.json()
+        code = extract_code_from_url(payload.get("url", ""))
+        if code not in self.codes:
+            return web.json_response({"status": "error"})
+        links = {f"url_{i}": f"{self.base}/file/{code}?mirror={i}" for i in (1, 2)}
+        return web.json_response({"status": "success", "download_link": links})
+
+    async def file(self, request: web.Request) -> web.StreamResponse:
+        self.requests += 1
+        code = request.match_info["code"]
+        if code not in self.codes:
+            raise web.HTTPNotFound()
+        start, end, status = 0, self.size - 1, 200
+        if match := re.match(r"bytes=(\d+)-(\d*)", request.headers.get("Range", "")):
+            start = int(match.group(1))
+            end = min(int(match.group(2) or end), self.size - 1)
+            status = 206
+            if start > end:
+                raise web.HTTPRequestRangeNotSatisfiable()
+        headers = {
+            "Content-Type": "video/mp4",
+            "Content-Length": str(end - start + 1),
+            "Accept-Ranges": "bytes",
+            "ETag": f'"{code}-{self.size}"',
+        }
+        if status == 206:
+            headers["Content-Range"] = f"bytes {start}-{end}/{self.size}"
+        response = web.StreamResponse(status=status, headers=headers)
+        await response.prepare(request)
+        patch_at, patch = self._patch(code)
+        sent = 0
+        started = time.monotonic()
+        with open(self.source, "rb") as f:
+            f.seek(start)
+            position = start
+            while position <= end:
+                chunk = bytearray(f.read(min(SERVE_CHUNK, end - position + 1)))
+                # Splice in the code's bytes where they overlap this chunk
+                lo, hi = max(position, patch_at), min(position + len(chunk), patch_at + len(patch))
+                if lo < hi:
+                    chunk[lo - position : hi - position] = patch[lo - patch_at : hi - patch_at]
+                try:
+                    await response.write(bytes(chunk))
+                except ConnectionResetError:
+                    # Probes, mirror races and head reads hang up early
+                    return response
+                position += len(chunk)
+                sent += len(chunk)
+                self.served += len(chunk)
+                delay = started + sent / self.rate - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+        return response
+
+    async def _start(self) -> None:
+        app = web.Application()
+        app.router.add_post("/get_download", self.resolve)
+        app.router.add_get("/file/{code}", self.file)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.base = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+    def start(self) -> str:
+        """Start serving, returns the resolver URL to set as `terabox.API_URL`"""
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self._start())
+            ready.set()
+            self._loop.run_forever()
+
+        threading.Thread(target=run, name="fake-upstream", daemon=True).start()
+        ready.wait()
+        return f"{self.base}/get_download"
+
+    def close(self) -> None:
+        if self._loop:
+            asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
@@ -0,0 +1,63 @@
+"""Synthetic MP4 files for benchmarks, no real media or ffmpeg needed."""
+import os
+import struct
+
+
+def _box(kind: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", 8 + len(payload), kind) + payload
+
+
+def _full(kind: bytes, payload: bytes) -> bytes:
+    return _box(kind, b"\0\0\0\0" + payload)
+
+
+def _moov(chunk_offsets: list[int], duration: float, width: int, height: int) -> bytes:
+    mvhd = _full(b"mvhd", struct.pack(">IIII", 0, 0, 1000, int(duration * 1000)) + b"\0" * 80)
+    tkhd = _full(b"tkhd", b"\0" * 76 + struct.pack(">II", width << 16, height << 16))
+    hdlr = _full(b"hdlr", b"\0" * 4 + b"vide" + b"\0" * 12 + b"VideoHandler\0")
+    stco = _full(
+        b"stco",
+        struct.pack(f">I{len(chunk_offsets)}I", len(chunk_offsets), *chunk_offsets),
+    )
+    stbl = _box(b"stbl", stco)
+    trak = _box(b"trak", tkhd + _box(b"mdia", hdlr + _box(b"minf", stbl)))
+    return _box(b"moov", mvhd + trak)
+
+
+def write_sample_mp4(
+    path: str,
+    size: int,
+    moov_at_end: bool = True,
+    chunk_size: int = 512 * 1024,
+    duration: float = 600,
+    width: int = 1280,
+    height: int = 720,
+) -> str:
+    """
+    Write an MP4 shaped file of roughly `size` bytes.
+
+    The media data is random bytes, but the box layout and chunk offset table
+    are real, so the file exercises anything that parses or rewrites MP4s.
+    """
+    ftyp = _box(b"ftyp", b"isom\0\0\2\0isomiso2mp41")
+    chunks = max(1, size // chunk_size)
+    mdat_size = chunks * chunk_size
+
+    def offsets(mdat_offset: int) -> list[int]:
+        return [mdat_offset + 8 + i * chunk_size for i in range(chunks)]
+
+    if moov_at_end:
+        head = ftyp
+        tail = _moov(offsets(len(ftyp)), duration, width, height)
+    else:
+        moov_size = len(_moov(offsets(0), duration, width, height))
+        head = ftyp + _moov(offsets(len(ftyp) + moov_size), duration, width, height)
+        tail = b""
+    block = os.urandom(chunk_size)
+    with open(path, "wb") as f:
+        f.write(head)
+        f.write(struct.pack(">I4s", 8 + mdat_size, b"mdat"))
+        for _ in range(chunks):
+            f.write(block)
+        f.write(tail)
+    return path
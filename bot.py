@@ -1,8 +1,6 @@
 import logging
-import time
+import math
 import re
-import requests
-import os
 import asyncio
 from typing import List, Union
 from urllib.parse import urlparse
@@ -12,28 +10,33 @@ from telethon import Button, types
 from telethon.sync import TelegramClient, events
 from telethon.tl.custom.message import Message
 from telethon.types import UpdateNewMessage
-import aiohttp
 import platform
 import sys
 
 from config import (ADMINS, API_HASH, API_ID, BOT_TOKEN, BOT_USERNAME,
                     FORCE_LINK)
+from cache_verifier import cache_verifier
+from edit_scheduler import edit_scheduler
+from http_client import http
+from memory import memory_governor, memory_report, stop_tracing
+from fingerprint import get_stats as fingerprint_stats
+from outbox import outbox
+from rate_limit import rate_limiter
 from redis_db import db
 from send_media import VideoSender
-from tools import generate_shortenedUrl, is_user_on_chat, remove_all_videos, get_urls_from_string, extract_code_from_url, check_url_patterns
+from tools import generate_shortenedUrl, is_user_on_chat, get_formatted_size, get_urls_from_string, extract_code_from_url, check_url_patterns
+from workspace import workspace
+from popularity import prewarmer, record_request
+from probe import probe_data
 from terabox import get_data
-from http.server import HTTPServer, SimpleHTTPRequestHandler
-import threading
+from tracing import setup_logging, start_job
+from health import start_server
+from loop_monitor import loop_monitor
 log = logging.getLogger(__name__)
 
 bot = TelegramClient("bot", API_ID, API_HASH)
+outbox.attach(bot)
 
-def start_web_server():
-    port = int(os.environ.get('PORT', 8080))
-    server_address = ('', port)
-    httpd = HTTPServer(server_address, SimpleHTTPRequestHandler)
-    print(f"Serving on port {port}")
-    httpd.serve_forever()
 # url_queues = defaultdict(asyncio.Queue)  # Queue per user
 processing_tasks = {}  # Track processing tasks per user
 
@@ -159,8 +162,88 @@ async def remove(m: UpdateNewMessage):
     )
 )
 async def removeall(m: UpdateNewMessage):
-    remove_all_videos()
-    return await m.reply("Removed all videos from the list.")
+    freed = workspace.purge()
+    stats = workspace.stats()
+    return await m.reply(
+        f"Removed {get_formatted_size(freed)} of leftover files.\n"
+        f"{stats['jobs']} running jobs keep {get_formatted_size(stats['reserved'])} reserved."
+    )
+
+
+@bot.on(
+    events.NewMessage(
+        pattern="/fpstats$",
+        incoming=True,
+        outgoing=False,
+        from_users=ADMINS,
+    )
+)
+async def fpstats(m: UpdateNewMessage):
+    stats = fingerprint_stats()
+    return await m.reply(
+        f"Content fingerprint lookups\n"
+        f"Hits: {stats['hits']}\nMisses: {stats['misses']}\n"
+        f"Hit rate: {stats['hit_rate']:.1%}"
+    )
+
+
+@bot.on(
+    events.NewMessage(
+        pattern="/mem( stop)?$",
+        incoming=True,
+        outgoing=False,
+        from_users=ADMINS,
+    )
+)
+async def mem(m: UpdateNewMessage):
+    if m.pattern_match.group(1):
+        stop_tracing()
+        return await m.reply("Stopped tracing allocations.")
+    stats = memory_governor.stats()
+    # Snapshots walk every traced block, keep that off the loop
+    report = await asyncio.to_thread(memory_report)
+    return await m.reply(
+        f"RSS: {get_formatted_size(stats['rss'])} of {get_formatted_size(stats['limit'])}\n"
+        f"Reserved by {stats['jobs']} jobs: {get_formatted_size(stats['reserved'])}\n"
+        f"Queued: {stats['queued']}, shed so far: {stats['shed']}\n"
+        f"Redis cache: {db.cache_size()} keys\n\n"
+        f"{report}"
+    )
+
+
+@bot.on(
+    events.NewMessage(
+        pattern="/lag( on| off| reset)?$",
+        incoming=True,
+        outgoing=False,
+        from_users=ADMINS,
+    )
+)
+async def lag(m: UpdateNewMessage):
+    action = (m.pattern_match.group(1) or "").strip()
+    if action == "on":
+        loop_monitor.start_watchdog()
+    elif action == "off":
+        loop_monitor.stop_watchdog()
+    elif action == "reset":
+        loop_monitor.reset()
+    stats = loop_monitor.stats()
+    lines = [
+        f"Loop lag: {stats['lag'] * 1000:.1f}ms now, p50 {stats['p50'] * 1000:.1f}ms, "
+        f"p99 {stats['p99'] * 1000:.1f}ms, max {stats['max_lag'] * 1000:.0f}ms",
+        f"Watchdog: {'on' if loop_monitor.watching else 'off'} "
+        f"(threshold {loop_monitor.threshold * 1000:.0f}ms)",
+    ]
+    top = loop_monitor.top()
+    if top:
+        lines.append("\nBlocking call sites:")
+    for site, entry in top:
+        lines.append(
+            f"`{site}` {entry.count}x, {entry.total:.2f}s total, {entry.max * 1000:.0f}ms worst"
+        )
+    if top:
+        lines.append(f"\nWorst stack:\n```\n{top[0][1].stack[-3000:]}```")
+    return await m.reply("\n".join(lines), parse_mode="markdown")
 
 
 @bot.on(
@@ -190,6 +273,7 @@ async def help_command(m: Message):
 async def process_single_url(url: str, m: Message, hm: Message) -> Union[bool, str]:
     """Process a single URL with improved error handling and performance"""
     try:
+        start_job()
         log.info(f"Processing URL: {url}")
         
         # Check user's preferred mode
@@ -198,8 +282,9 @@ async def process_single_url(url: str, m: Message, hm: Message) -> Union[bool, s
         # Get URL code for play online functionality
         url_code = extract_code_from_url(url)
         if not url_code:
-            await hm.edit("❌ Invalid Terabox URL format")
+            await edit_scheduler.edit(hm, "❌ Invalid Terabox URL format")
             return False
+        record_request(url_code, url, m.sender_id, user_mode)
             
         if user_mode == "play":
             # Simply return the play online button
@@ -211,28 +296,33 @@ async def process_single_url(url: str, m: Message, hm: Message) -> Union[bool, s
                 Button.url("Support Chat", url="https://t.me/+3r_itVbkKHpjYTFh")
             ]]
             
-            # Forward to FORCE_LINK channel with same format
-            await bot.send_message(
-                FORCE_LINK,
-                message_text,
-                buttons=buttons
-            )
+            # Forward to FORCE_LINK channel with same format, in the background
+            outbox.post(FORCE_LINK, message_text, buttons=buttons)
             
             # Send to user (without the User ID and URL info)
-            await hm.edit(
+            await edit_scheduler.edit(
+                hm,
                 "🎥 Here's your play online link:",
                 buttons=buttons
             )
             return "play_button_shown"
             
-        # Continue with download mode
+        # Continue with download mode, stored (or pre-warmed) files are forwarded
+        if fileid := db.get(url_code):
+            if await VideoSender.forward_file(
+                client=bot, file_id=fileid, message=m, edit_message=hm,
+                uid=db.get(f"mid_{fileid}"),
+            ):
+                return True
+
         try:
-            await hm.edit("🔍 Fetching file information...")
+            await edit_scheduler.edit(hm, "🔍 Fetching file information...")
         except Exception as e:
             hm = await m.reply("🔍 Fetching file information...")
         
-        file_data = get_data(url)
-        log.info(f"data1234: {file_data.get('direct_link')}")
+        file_data = await get_data(url)
+        if file_data:
+            file_data = await probe_data(file_data)
         
         if not file_data or not file_data.get('direct_link'):
             error_msg = "❌ Failed to fetch valid file information"
@@ -248,17 +338,13 @@ async def process_single_url(url: str, m: Message, hm: Message) -> Union[bool, s
                     Button.url("Support Chat", url="https://t.me/+3r_itVbkKHpjYTFh")
                 ]]
             
+            outbox.report_error(f"User ID: {m.sender_id}\nError: {error_msg}\nURL: {url}")
             try:
-                await bot.send_message(
-                    FORCE_LINK,
-                    f"Error Report:\nUser ID: {m.sender_id}\nError: {error_msg}\nURL: {url}"
-                )
-                await hm.edit(f"{error_msg}\nYou can still try to play this online or report this in our support chat.", buttons=support_buttons)
+                await edit_scheduler.edit(hm, f"{error_msg}\nYou can still try to play this online or report this in our support chat.", buttons=support_buttons)
             except:
-                await m.reply(f"{error_msg}\nYou can still try to play this online or report this in our support chat.", buttons=support_buttons)
+                await outbox.send(m.chat_id, f"{error_msg}\nYou can still try to play this online or report this in our support chat.", buttons=support_buttons, reply_to=m.id)
             return "play_button_shown"  # Return special flag instead of False
 
-        # Since we don't have size information from new API, we'll skip size checks
         # Initialize VideoSender
         video_sender = VideoSender(
             client=bot,
@@ -275,7 +361,7 @@ async def process_single_url(url: str, m: Message, hm: Message) -> Union[bool, s
         except Exception as e:
             log.error(f"Video sending error: {str(e)}")
             try:
-                await hm.edit(f"❌ Error sending video: {str(e)}")
+                await edit_scheduler.edit(hm, f"❌ Error sending video: {str(e)}")
             except:
                 await m.reply(f"❌ Error sending video: {str(e)}")
             return False
@@ -301,21 +387,21 @@ async def process_single_url(url: str, m: Message, hm: Message) -> Union[bool, s
                 Button.url("💬 Support Chat", url="https://t.me/+3r_itVbkKHpjYTFh")
             ]]
         
+        # Send error report to channel with the next digest
+        outbox.report_error(f"User ID: {m.sender_id}\nError: {str(e)}\nURL: {url}")
         try:
-            # Send error report to channel
-            await bot.send_message(
-                FORCE_LINK,
-                f"Error Report:\nUser ID: {m.sender_id}\nError: {str(e)}\nURL: {url}"
-            )
             # Send error message to user
-            await hm.edit(
+            await edit_scheduler.edit(
+                hm,
                 f"{error_msg}\nYou can still try to play this online or report the issue in our support chat.",
                 buttons=support_buttons
             )
         except:
-            await m.reply(
+            await outbox.send(
+                m.chat_id,
                 f"{error_msg}\nYou can still try to play this online or report the issue in our support chat.",
-                buttons=support_buttons
+                buttons=support_buttons,
+                reply_to=m.id,
             )
         return False
 
@@ -359,29 +445,21 @@ async def process_url(m: Message):
         log.info(f"Found URLs: {urls}")
         hm = await m.reply("🔍 Processing your request...")
         
-        # Check spam protection only for non-admins
-        if m.sender_id not in ADMINS:
-            # Check spam protection
-            spam_key = f"spam_{m.sender_id}"
-            spam_status = db.get(spam_key)
-            
-            if spam_status:
-                ttl = db.redis.ttl(spam_key)
-                if ttl > 0:  # Ensure TTL is greater than zero
-                    t = hr.Time(str(ttl), default_unit=hr.Time.Unit.SECOND)
-                    try:
-                        return await hm.edit(
-                            f"⚠️ Please wait {t.to_humanreadable()} before sending another link",
-                            parse_mode="markdown"
-                        )
-                    except:
-                        return await m.reply(
-                            f"⚠️ Please wait {t.to_humanreadable()} before sending another link",
-                            parse_mode="markdown"
-                        )
-
-            # Set spam protection timer (60 seconds)
-            db.set(spam_key, "1", ex=60)
+        # Check spam protection (limits per role are in config.RATE_LIMITS)
+        wait = rate_limiter.hit(m.sender_id)
+        if wait > 0:
+            t = hr.Time(str(math.ceil(wait)), default_unit=hr.Time.Unit.SECOND)
+            try:
+                return await edit_scheduler.edit(
+                    hm,
+                    f"⚠️ Please wait {t.to_humanreadable()} before sending another link",
+                    parse_mode="markdown"
+                )
+            except:
+                return await m.reply(
+                    f"⚠️ Please wait {t.to_humanreadable()} before sending another link",
+                    parse_mode="markdown"
+                )
 
         total_urls = len(urls)
         successful = 0
@@ -392,16 +470,15 @@ async def process_url(m: Message):
             try:
                 if not large_file_processed and not play_button_shown:
                     try:
-                        await hm.edit(f"🔄 Processing link {idx}/{total_urls}: {url}")
+                        await edit_scheduler.edit(hm, f"🔄 Processing link {idx}/{total_urls}: {url}")
                     except:
                         hm = await m.reply(f"🔄 Processing link {idx}/{total_urls}: {url}")
                 
                 result = await process_single_url(url, m, hm)
                 
-                # If there was an error and user isn't admin, remove spam protection
-                if not result and m.sender_id not in ADMINS:
-                    spam_key = f"spam_{m.sender_id}"
-                    db.redis.delete(spam_key)
+                # If there was an error, give the user their token back
+                if not result:
+                    rate_limiter.refund(m.sender_id)
                 
                 if result == "large_file":
                     large_file_processed = True
@@ -412,7 +489,7 @@ async def process_url(m: Message):
 
                 if not large_file_processed and not play_button_shown:
                     try:
-                        await hm.edit(f"✅ Successfully processed link {idx}/{total_urls}")
+                        await edit_scheduler.edit(hm, f"✅ Successfully processed link {idx}/{total_urls}")
                     except:
                         await m.reply(f"✅ Successfully processed link {idx}/{total_urls}")
                 
@@ -422,7 +499,7 @@ async def process_url(m: Message):
                 log.error(f"Error processing URL {url}: {str(e)}")
                 if not large_file_processed and not play_button_shown:
                     try:
-                        await hm.edit(f"❌ Error processing link {idx}/{total_urls}: {str(e)}")
+                        await edit_scheduler.edit(hm, f"❌ Error processing link {idx}/{total_urls}: {str(e)}")
                     except:
                         await m.reply(f"❌ Error processing link {idx}/{total_urls}: {str(e)}")
                 continue
@@ -430,7 +507,7 @@ async def process_url(m: Message):
         if not large_file_processed and not play_button_shown:
             final_message = "✅ All links processed successfully!" if successful == total_urls else f"⚠️ Completed: {successful}/{total_urls} links processed successfully"
             try:
-                await hm.edit(final_message)
+                await edit_scheduler.edit(hm, final_message)
             except:
                 await m.reply(final_message)
 
@@ -442,11 +519,7 @@ async def process_url(m: Message):
 if __name__ == "__main__":
     try:
         # Configure logging first
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            datefmt='%Y-%m-%d %H:%M:%S'
-        )
+        setup_logging()
         
         log = logging.getLogger("bot")
         
@@ -460,15 +533,20 @@ if __name__ == "__main__":
             
         # Start the bot
         log.info("=== Bot starting ===")
-        print("Bot is starting...")
-        port = int(os.environ.get('PORT', 8080))
-        web_thread = threading.Thread(target=start_web_server)
-        web_thread.start()
+        workspace.reap()
         bot.start(bot_token=BOT_TOKEN)
-        print("Bot is running...")
-        bot.run_until_disconnected()
+        bot.loop.run_until_complete(http.start())
+        web_runner = bot.loop.run_until_complete(start_server(bot))
+        bot.loop.create_task(loop_monitor.run())
+        bot.loop.create_task(cache_verifier.run(bot))
+        bot.loop.create_task(prewarmer.run(bot))
+        log.info("Bot is running")
+        try:
+            bot.run_until_disconnected()
+        finally:
+            bot.loop.run_until_complete(web_runner.cleanup())
+            bot.loop.run_until_complete(http.close())
         
     except Exception as e:
-        print(f"Error starting bot: {e}")
         log.error(f"Startup error: {str(e)}", exc_info=True)
         sys.exit(1)
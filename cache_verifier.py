@@ -0,0 +1,162 @@
+import asyncio
+import json
+import logging
+import time
+
+from telethon import TelegramClient
+from telethon.errors import FloodWaitError
+from telethon.tl.functions.channels import GetMessagesRequest
+from telethon.tl.types import InputDocument
+
+from config import PRIVATE_CHAT_ID
+from edit_scheduler import edit_scheduler
+from outbox import USER, outbox
+from redis_db import db
+
+log = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+# Background budget: at most this many GetMessages calls a minute, and none
+# while users are waiting on status edits or replies.
+CALLS_PER_MINUTE = 10
+VERIFY_INTERVAL = 6 * 60 * 60
+IDLE_POLL = 5
+# Longest a call waits for users to be served, busy hours need checking most.
+MAX_DEFER = 60
+
+
+def get_document(msg_id) -> tuple[InputDocument, str] | None:
+    """The stored document of a message and its caption, as refreshed by the verifier"""
+    value = db.get(f"doc_{msg_id}")
+    if not value:
+        return None
+    try:
+        ref = json.loads(value)
+        document = InputDocument(
+            id=ref["id"],
+            access_hash=ref["access_hash"],
+            file_reference=bytes.fromhex(ref["file_reference"]),
+        )
+        return document, ref.get("caption", "")
+    except Exception:
+        return None
+
+
+def forget_document(msg_id) -> None:
+    db.delete(f"doc_{msg_id}")
+
+
+def _remember_document(msg) -> None:
+    document = msg.media.document
+    db.set(
+        f"doc_{msg.id}",
+        json.dumps(
+            {
+                "id": document.id,
+                "access_hash": document.access_hash,
+                "file_reference": document.file_reference.hex(),
+                "caption": msg.message or "",
+            }
+        ),
+    )
+
+
+def purge(msg_id: int) -> None:
+    """Drop every record pointing at a storage message that no longer exists"""
+    uid = db.get(f"mid_{msg_id}")
+    if uid:
+        db.delete(uid)
+    code = db.get(f"code_{msg_id}")
+    if code and str(db.get(code)) == str(msg_id):
+        for key in (code, f"private_forward_{code}", f"parts_{code}"):
+            db.delete(key)
+    for key in (f"mid_{msg_id}", f"code_{msg_id}", f"parts_{msg_id}", f"doc_{msg_id}"):
+        db.delete(key)
+
+
+class CacheVerifier:
+    """
+    Walks the file cache in the background and checks that every stored
+    message still exists, so users don't find out on a cache hit.
+    """
+
+    def __init__(self, calls_per_minute: int = CALLS_PER_MINUTE, interval: float = VERIFY_INTERVAL):
+        self.min_gap = 60 / calls_per_minute
+        self.interval = interval
+        self.checked = 0
+        self.purged = 0
+        self.refreshed = 0
+        self._last_call = 0.0
+
+    async def _budget(self) -> None:
+        """Wait for the call budget and, up to MAX_DEFER, for interactive traffic to drain"""
+        deferred_until = None
+        while True:
+            wait = self._last_call + self.min_gap - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            # Progress frames are queued whenever a transfer runs, so only
+            # status edits and replies count as users waiting
+            if not (edit_scheduler.urgent_pending or outbox.depth(USER)):
+                break
+            deferred_until = deferred_until or time.monotonic() + MAX_DEFER
+            if time.monotonic() >= deferred_until:
+                break
+            await asyncio.sleep(IDLE_POLL)
+        self._last_call = time.monotonic()
+
+    def _stored_ids(self):
+        for key in db.redis.scan_iter(match="mid_*", count=500):
+            try:
+                yield int(key[4:])
+            except ValueError:
+                continue
+
+    async def check(self, client: TelegramClient, ids: list[int]) -> None:
+        await self._budget()
+        try:
+            result = await client(GetMessagesRequest(channel=PRIVATE_CHAT_ID, id=ids))
+        except FloodWaitError as e:
+            log.warning(f"Cache verifier hit a flood wait of {e.seconds}s")
+            await asyncio.sleep(e.seconds)
+            return await self.check(client, ids)
+        found = {m.id: m for m in result.messages}
+        for msg_id in ids:
+            self.checked += 1
+            msg = found.get(msg_id)
+            if msg is None or not getattr(getattr(msg, "media", None), "document", None):
+                log.info(f"Stored message {msg_id} is gone, purging its cache entries")
+                purge(msg_id)
+                self.purged += 1
+            else:
+                _remember_document(msg)
+                self.refreshed += 1
+
+    async def verify(self, client: TelegramClient) -> None:
+        """One pass over the whole cache"""
+        started = time.monotonic()
+        batch = []
+        for msg_id in self._stored_ids():
+            batch.append(msg_id)
+            if len(batch) == BATCH_SIZE:
+                await self.check(client, batch)
+                batch = []
+        if batch:
+            await self.check(client, batch)
+        log.info(
+            f"Cache verified in {time.monotonic() - started:.0f}s: "
+            f"{self.checked} checked, {self.purged} purged, {self.refreshed} refreshed"
+        )
+
+    async def run(self, client: TelegramClient) -> None:
+        """Verify the cache every `interval` seconds for as long as the bot runs"""
+        while True:
+            try:
+                await self.verify(client)
+            except Exception as e:
+                log.error(f"Cache verification failed: {e}")
+            await asyncio.sleep(self.interval)
+
+
+cache_verifier = CacheVerifier()
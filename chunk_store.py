@@ -0,0 +1,184 @@
+import hashlib
+import logging
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from config import CHUNK_STORE_BYTES, CHUNK_STORE_MIN_FREE
+
+log = logging.getLogger(__name__)
+
+STORE_DIR = os.path.join(".cache", "chunks")
+PARTIAL = ".part"
+
+
+def link_or_copy(src: str, dst: str) -> None:
+    """Make `dst` a hard link of `src`, or a copy across file systems"""
+    try:
+        os.unlink(dst)
+    except FileNotFoundError:
+        pass
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class ChunkStore:
+    """
+    Byte budgeted on-disk LRU of fetched source files, so retries and
+    re-requests read locally instead of going back to the CDN.
+
+    Entries are named after a hash of their key (a link validator or a
+    content fingerprint). A complete entry only ever appears through
+    os.replace, and partial downloads live next to it as `<name>.part`
+    with the segment `.state` the downloader keeps. The index is rebuilt
+    from the directory on start, with mtimes as recency, so a crash
+    leaves nothing to repair but stray temp files.
+    """
+
+    def __init__(self, root: str = STORE_DIR, budget: int = CHUNK_STORE_BYTES, min_free: int = CHUNK_STORE_MIN_FREE):
+        self.root = root
+        self.budget = budget
+        self.min_free = min_free
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._pinned: set[str] = set()
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    @staticmethod
+    def _name(key: str) -> str:
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def _load(self) -> None:
+        if self._loaded:
+            return
+        os.makedirs(self.root, exist_ok=True)
+        found = []
+        for entry in os.scandir(self.root):
+            if entry.name.endswith(".tmp"):
+                os.unlink(entry.path)
+            elif not entry.name.endswith(".state"):
+                stat = entry.stat()
+                found.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+        self._loaded = True
+        log.info(f"Chunk store has {len(self._entries)} entries, {self.used / 1024**2:.0f}MB")
+
+    @property
+    def used(self) -> int:
+        return sum(self._entries.values())
+
+    def fits(self, size: int) -> bool:
+        return 0 < size <= self.budget
+
+    def get(self, key: str) -> str | None:
+        """Path of the complete file stored under `key`, marked as recently used"""
+        with self._lock:
+            self._load()
+            name = self._name(key)
+            path = self._path(name)
+            if name not in self._entries or not os.path.exists(path):
+                self._entries.pop(name, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(name)
+            self.hits += 1
+        os.utime(path)
+        return path
+
+    def partial(self, key: str) -> str:
+        """Where to download `key` to, a previous attempt's bytes are kept there"""
+        with self._lock:
+            self._load()
+        return self._path(self._name(key) + PARTIAL)
+
+    @contextmanager
+    def using(self, key: str):
+        """Keep `key` and its partial download from being evicted meanwhile"""
+        name = self._name(key)
+        with self._lock:
+            self._pinned.update((name, name + PARTIAL))
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._pinned.difference_update((name, name + PARTIAL))
+
+    def commit(self, key: str) -> str:
+        """Turn the finished partial download of `key` into a stored entry"""
+        name = self._name(key)
+        partial, path = self._path(name + PARTIAL), self._path(name)
+        os.replace(partial, path)
+        try:
+            os.unlink(partial + ".state")
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self._entries.pop(name + PARTIAL, None)
+            self._entries[name] = os.path.getsize(path)
+            self._entries.move_to_end(name)
+        self.evict()
+        return path
+
+    def track_partial(self, key: str) -> None:
+        """Count a partial download against the budget once it is worth keeping"""
+        name = self._name(key) + PARTIAL
+        path = self._path(name)
+        if os.path.exists(path):
+            with self._lock:
+                self._entries[name] = os.path.getsize(path)
+                self._entries.move_to_end(name)
+            self.evict()
+
+    def discard(self, key: str) -> None:
+        name = self._name(key)
+        with self._lock:
+            for n in (name, name + PARTIAL):
+                self._entries.pop(n, None)
+                self._remove(n)
+
+    def _remove(self, name: str) -> None:
+        for path in (self._path(name), self._path(name) + ".state"):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def _low_on_disk(self) -> bool:
+        try:
+            return shutil.disk_usage(self.root).free < self.min_free
+        except OSError:
+            return False
+
+    def evict(self) -> None:
+        """Drop least recently used entries until under budget and above the free disk watermark"""
+        with self._lock:
+            self._load()
+            while self._entries and (self.used > self.budget or self._low_on_disk()):
+                victim = next((n for n in self._entries if n not in self._pinned), None)
+                if victim is None:
+                    break
+                size = self._entries.pop(victim)
+                self._remove(victim)
+                log.info(f"Evicted {victim} ({size / 1024**2:.0f}MB) from the chunk store")
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "used": self.used,
+            "budget": self.budget,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+chunk_store = ChunkStore()
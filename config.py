@@ -19,3 +19,39 @@ PRIVATE_CHAT_ID = 2045707861  # CHAT WHERE YOU WANT TO STORE VIDEOS
 COOKIE = ""
 
 PUBLIC_EARN_API = ""  # Leave empty if not using publicearn.com
+
+# ANTI SPAM
+# Token bucket per role: (burst, seconds to refill one token). None disables the limit.
+RATE_LIMITS = {
+    "admin": None,
+    "user": (1, 60),
+}
+
+# Move the moov atom of downloaded MP4s to the front before uploading, so
+# Telegram can start streaming them right away.
+FASTSTART = True
+
+# Files above this are split and sent as an album (2000MB for bots).
+TELEGRAM_FILE_LIMIT = 2000 * 1024 * 1024
+
+# Disk budget of the chunk store of fetched source files, and the free
+# space it always leaves on the disk.
+CHUNK_STORE_BYTES = 4 * 1024 * 1024 * 1024
+CHUNK_STORE_MIN_FREE = 2 * 1024 * 1024 * 1024
+
+# "json" for one log object per line, "text" for plain log lines.
+LOG_FORMAT = "json"
+
+# Record the stack of anything holding the event loop longer than
+# BLOCKING_THRESHOLD seconds (admins can also turn it on with /lag on).
+LOOP_WATCHDOG = False
+BLOCKING_THRESHOLD = 0.1
+
+# Disk quota shared by all running jobs.
+WORKSPACE_QUOTA = 8 * 1024 * 1024 * 1024
+
+# Memory of the container (see railway.toml), jobs are admitted against it.
+MEMORY_LIMIT = 512 * 1024 * 1024
+
+# Keys the in-process Redis cache keeps before dropping the least recent.
+REDIS_CACHE_SIZE = 10000
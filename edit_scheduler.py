@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from telethon.errors import FloodWaitError, MessageNotModifiedError
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class PendingEdit:
+    message: object
+    text: str
+    kwargs: dict
+    urgent: bool = False
+    waiters: list = field(default_factory=list)
+
+
+class EditScheduler:
+    """
+    Single outbound path for message edits.
+
+    Edits are keyed by (chat_id, message_id) and only the latest text of a
+    message is kept, so intermediate progress frames are dropped instead of
+    queued. A global and a per chat budget decide when the next edit may go
+    out; FloodWait blocks the chat and slows the global pace down until
+    edits start succeeding again.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 8.0,
+        chat_interval: float = 1.0,
+        frame_interval: float = 5.0,
+        max_global_interval: float = 5.0,
+    ):
+        self.base_global_interval = 1 / global_rate
+        self.global_interval = self.base_global_interval
+        self.max_global_interval = max_global_interval
+        self.chat_interval = chat_interval
+        self.frame_interval = frame_interval
+        self.flood_waits = 0
+        self._urgent: "OrderedDict[tuple, PendingEdit]" = OrderedDict()
+        self._frames: "OrderedDict[tuple, PendingEdit]" = OrderedDict()
+        self._chat_ready: dict = {}
+        self._last_edit: dict = {}
+        self._global_ready = 0.0
+        self._wakeup = None
+        self._runner = None
+        self._inflight = set()
+
+    @staticmethod
+    def _key(message) -> tuple:
+        return (message.chat_id, message.id)
+
+    def _ensure_runner(self):
+        if self._runner is None or self._runner.done():
+            self._wakeup = asyncio.Event()
+            self._runner = asyncio.get_running_loop().create_task(self._run())
+        self._wakeup.set()
+
+    def _queue(self, message, text: str, kwargs: dict, urgent: bool) -> PendingEdit:
+        key = self._key(message)
+        item = self._urgent.get(key) or self._frames.get(key)
+        if item and item.urgent and not urgent:
+            # A status edit someone waits for outranks any progress frame
+            return item
+        if item:
+            # Coalesce: newer text replaces the pending one in place so the
+            # message keeps its turn.
+            item.message, item.text, item.kwargs = message, text, kwargs
+            if urgent and not item.urgent:
+                del self._frames[key]
+                item.urgent = True
+                self._urgent[key] = item
+        else:
+            item = PendingEdit(message, text, kwargs, urgent)
+            (self._urgent if urgent else self._frames)[key] = item
+        self._ensure_runner()
+        return item
+
+    def submit(self, message, text: str, **kwargs) -> None:
+        """Queue a progress frame, superseded frames are silently dropped"""
+        self._queue(message, text, kwargs, urgent=False)
+
+    async def edit(self, message, text: str, **kwargs):
+        """Queue a status edit ahead of progress frames and wait until it is sent"""
+        future = asyncio.get_running_loop().create_future()
+        self._queue(message, text, kwargs, urgent=True).waiters.append(future)
+        return await future
+
+    def discard(self, message) -> None:
+        """Drop pending edits of a message, e.g. before deleting it"""
+        key = self._key(message)
+        item = self._urgent.pop(key, None) or self._frames.pop(key, None)
+        if item:
+            self._resolve(item, None)
+        self._last_edit.pop(key, None)
+
+    @property
+    def pending(self) -> int:
+        return len(self._urgent) + len(self._frames)
+
+    @property
+    def urgent_pending(self) -> int:
+        """Status edits someone is waiting on, progress frames not counted"""
+        return len(self._urgent)
+
+    @staticmethod
+    def _resolve(item: PendingEdit, result=None, error: Exception = None):
+        for future in item.waiters:
+            if future.done():
+                continue
+            if error:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        item.waiters.clear()
+
+    def _next_due(self, now: float):
+        """Return (key, item) of the next edit allowed to go out, or the time to wait"""
+        wait = None
+        for queue, urgent in ((self._urgent, True), (self._frames, False)):
+            for key, item in queue.items():
+                ready = self._chat_ready.get(key[0], 0)
+                if not urgent:
+                    ready = max(ready, self._last_edit.get(key, 0) + self.frame_interval)
+                if ready <= now:
+                    return key, item, None
+                wait = ready - now if wait is None else min(wait, ready - now)
+        return None, None, wait
+
+    async def _run(self):
+        while True:
+            if not self.pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            now = time.monotonic()
+            if now < self._global_ready:
+                await asyncio.sleep(self._global_ready - now)
+                continue
+            key, item, wait = self._next_due(now)
+            if item is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            (self._urgent if item.urgent else self._frames).pop(key)
+            self._global_ready = now + self.global_interval
+            self._chat_ready[key[0]] = now + self.chat_interval
+            self._last_edit[key] = now
+            task = asyncio.create_task(self._send(key, item))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+            self._prune(now)
+
+    def _prune(self, now: float):
+        if len(self._last_edit) < 1000:
+            return
+        horizon = now - max(self.frame_interval, self.chat_interval) * 2
+        self._last_edit = {k: v for k, v in self._last_edit.items() if v > horizon}
+        self._chat_ready = {k: v for k, v in self._chat_ready.items() if v > horizon}
+
+    async def _send(self, key: tuple, item: PendingEdit):
+        try:
+            result = await item.message.edit(item.text, **item.kwargs)
+        except MessageNotModifiedError:
+            self._resolve(item, None)
+        except FloodWaitError as e:
+            self.flood_waits += 1
+            log.warning(f"FloodWait of {e.seconds}s while editing {key}")
+            now = time.monotonic()
+            self._chat_ready[key[0]] = now + e.seconds
+            self.global_interval = min(
+                self.max_global_interval, self.global_interval * 2
+            )
+            # Put it back unless a newer text was queued in the meantime.
+            queue = self._urgent if item.urgent else self._frames
+            newer = self._urgent.get(key) or self._frames.get(key)
+            if newer:
+                newer.waiters.extend(item.waiters)
+            else:
+                queue[key] = item
+            self._wakeup.set()
+        except Exception as e:
+            log.debug(f"Edit of {key} failed: {e}")
+            self._resolve(item, error=e)
+        else:
+            self.global_interval = max(
+                self.base_global_interval, self.global_interval * 0.9
+            )
+            self._resolve(item, result)
+
+
+edit_scheduler = EditScheduler()
@@ -0,0 +1,160 @@
+import logging
+import os
+import struct
+
+log = logging.getLogger(__name__)
+
+# Boxes that only hold other boxes on the way down to the chunk offset tables.
+CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl"}
+MAX_MOOV_BYTES = 64 * 1024 * 1024
+COPY_CHUNK = 1024 * 1024
+
+
+def _top_level_boxes(f, file_size: int) -> list[tuple[bytes, int, int]]:
+    """Return (type, offset, size) of every top level box of an open MP4"""
+    boxes = []
+    offset = 0
+    while offset + 8 <= file_size:
+        f.seek(offset)
+        header = f.read(16)
+        size, kind = struct.unpack(">I4s", header[:8])
+        if size == 1:
+            size = struct.unpack(">Q", header[8:16])[0]
+        elif size == 0:
+            size = file_size - offset
+        if size < 8:
+            raise ValueError(f"Invalid box size {size} at {offset}")
+        boxes.append((kind, offset, size))
+        offset += size
+    return boxes
+
+
+def _box(kind: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", 8 + len(payload), kind) + payload
+
+
+def _patch(data: bytes, delta: int, to_co64: bool, start: int) -> tuple[bytes, bool]:
+    """
+    Rebuild the children in `data` with the chunk offsets at or past `start` moved by `delta`.
+
+    Returns the new bytes and whether a 32 bit offset would overflow, in which
+    case the caller has to try again with `to_co64`.
+    """
+    out = bytearray()
+    overflow = False
+    offset = 0
+    while offset + 8 <= len(data):
+        size, kind = struct.unpack(">I4s", data[offset : offset + 8])
+        header = 8
+        if size == 1:
+            size = struct.unpack(">Q", data[offset + 8 : offset + 16])[0]
+            header = 16
+        elif size == 0:
+            size = len(data) - offset
+        payload = data[offset + header : offset + size]
+        if kind in CONTAINERS:
+            children, child_overflow = _patch(payload, delta, to_co64, start)
+            overflow |= child_overflow
+            out += _box(kind, children)
+        elif kind == b"stco":
+            count = struct.unpack(">I", payload[4:8])[0]
+            offsets = struct.unpack(f">{count}I", payload[8 : 8 + count * 4])
+            entries = [o + delta if o >= start else o for o in offsets]
+            if to_co64:
+                out += _box(b"co64", payload[:8] + struct.pack(f">{count}Q", *entries))
+            elif entries and max(entries) > 0xFFFFFFFF:
+                overflow = True
+                out += data[offset : offset + size]
+            else:
+                out += _box(b"stco", payload[:8] + struct.pack(f">{count}I", *entries))
+        elif kind == b"co64":
+            count = struct.unpack(">I", payload[4:8])[0]
+            offsets = struct.unpack(f">{count}Q", payload[8 : 8 + count * 8])
+            entries = [o + delta if o >= start else o for o in offsets]
+            out += _box(b"co64", payload[:8] + struct.pack(f">{count}Q", *entries))
+        else:
+            out += data[offset : offset + size]
+        offset += size
+    return bytes(out), overflow
+
+
+def relocate_moov(moov_payload: bytes, start: int) -> bytes:
+    """Return the complete moov box to be inserted at `start`, in front of the media data"""
+    to_co64 = False
+    delta = 8 + len(moov_payload)
+    while True:
+        patched, overflow = _patch(moov_payload, delta, to_co64, start)
+        if overflow:
+            to_co64 = True
+            continue
+        moov = _box(b"moov", patched)
+        if len(moov) == delta:
+            return moov
+        # Converting stco to co64 grew the moov, so the data moves further.
+        delta = len(moov)
+
+
+def faststart(path: str) -> bool:
+    """
+    Rewrite an MP4 so its moov box comes right after ftyp.
+
+    The media data is streamed through in COPY_CHUNK pieces, so memory stays
+    at the size of the moov. The result replaces `path` atomically.
+
+    Args:
+        path (str): The MP4 file to rewrite.
+
+    Returns:
+        bool: True if the file was rewritten, False if it was already faststart
+            or isn't an MP4 this can handle.
+    """
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        boxes = _top_level_boxes(f, file_size)
+        kinds = [kind for kind, _, _ in boxes]
+        if b"moov" not in kinds or b"mdat" not in kinds:
+            return False
+        if kinds.index(b"moov") < kinds.index(b"mdat"):
+            return False
+        if kinds.count(b"moov") != 1 or kinds[0] != b"ftyp":
+            return False
+        # Data behind the moov would move by a different amount
+        if b"mdat" in kinds[kinds.index(b"moov") :]:
+            return False
+        _, moov_offset, moov_size = boxes[kinds.index(b"moov")]
+        if moov_size > MAX_MOOV_BYTES:
+            log.warning(f"moov of {path} is {moov_size} bytes, not rewriting")
+            return False
+        f.seek(moov_offset)
+        header = f.read(16)
+        header_size = 16 if struct.unpack(">I", header[:4])[0] == 1 else 8
+        f.seek(moov_offset + header_size)
+        _, ftyp_offset, ftyp_size = boxes[0]
+        moov = relocate_moov(f.read(moov_size - header_size), ftyp_offset + ftyp_size)
+
+        tmp = f"{path}.faststart"
+        try:
+            with open(tmp, "wb") as out:
+                f.seek(ftyp_offset)
+                out.write(f.read(ftyp_size))
+                out.write(moov)
+                # Every box after ftyp keeps its order, shifted by the moov.
+                for kind, offset, size in boxes[1:]:
+                    if kind == b"moov":
+                        continue
+                    f.seek(offset)
+                    remaining = size
+                    while remaining:
+                        chunk = f.read(min(COPY_CHUNK, remaining))
+                        if not chunk:
+                            raise ValueError(f"File ended inside {kind!r} box")
+                        out.write(chunk)
+                        remaining -= len(chunk)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+    os.replace(tmp, path)
+    return True
@@ -0,0 +1,99 @@
+import asyncio
+import os
+import queue
+import threading
+
+# Chunks that may wait for the disk before writers have to.
+MAX_PENDING = 8
+
+_FSYNC = object()
+_CLOSE = object()
+
+
+class FileWriter:
+    """
+    Writes to a file from a dedicated thread with `os.pwrite`, so slow disks
+    never block the event loop.
+
+    At most `max_pending` chunks are queued, after that `write` waits, which
+    pushes back on the download instead of buffering it in memory. Offsets
+    make it safe to share one writer between concurrent segments. A write
+    error is raised from the next `write`, `sync` or `close`.
+    """
+
+    def __init__(self, path: str, max_pending: int = MAX_PENDING):
+        self.path = path
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+        self._loop = asyncio.get_running_loop()
+        self._slots = asyncio.Semaphore(max_pending)
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._error: OSError | None = None
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name=f"writer-{os.path.basename(path)}", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            offset, data, future = self._queue.get()
+            try:
+                if data is _CLOSE:
+                    os.close(self.fd)
+                elif self._error is not None:
+                    pass
+                elif data is _FSYNC:
+                    os.fsync(self.fd)
+                else:
+                    view = memoryview(data)
+                    while view:
+                        written = os.pwrite(self.fd, view, offset)
+                        view = view[written:]
+                        offset += written
+            except OSError as e:
+                self._error = e
+            try:
+                self._loop.call_soon_threadsafe(self._done, future, data is not _CLOSE)
+            except RuntimeError:
+                # The loop is gone, nobody is waiting anymore
+                pass
+            if data is _CLOSE:
+                return
+
+    def _done(self, future: asyncio.Future | None, release: bool) -> None:
+        if release:
+            self._slots.release()
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    def _raise(self) -> None:
+        if self._error is not None:
+            raise self._error
+
+    async def _submit(self, offset: int, data, wait: bool = False) -> None:
+        await self._slots.acquire()
+        future = self._loop.create_future() if wait else None
+        self._queue.put((offset, data, future))
+        if future is not None:
+            await future
+
+    async def write(self, offset: int, data: bytes) -> None:
+        """Queue `data` to be written at `offset`"""
+        self._raise()
+        await self._submit(offset, data)
+
+    async def sync(self) -> None:
+        """Wait until everything queued so far is written and on disk"""
+        await self._submit(0, _FSYNC, wait=True)
+        self._raise()
+
+    async def close(self) -> None:
+        """Wait for the queued writes, then stop the thread and close the file"""
+        if self._closed:
+            return
+        self._closed = True
+        # The thread closes the file after the queue, even if we get cancelled.
+        future = self._loop.create_future()
+        self._queue.put((0, _CLOSE, future))
+        await asyncio.shield(future)
+        self._raise()
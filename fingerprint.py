@@ -0,0 +1,111 @@
+import asyncio
+import hashlib
+import logging
+import os
+
+import aiohttp
+
+from http_client import http
+from redis_db import db
+
+log = logging.getLogger(__name__)
+
+SAMPLE_BYTES = 1024 * 1024
+STATS_KEY = "fp_stats"
+
+
+def _offsets(size: int) -> list[int]:
+    """Start of the first, middle and last MiB, small files are hashed whole"""
+    if size <= 3 * SAMPLE_BYTES:
+        return [0]
+    return [0, (size - SAMPLE_BYTES) // 2, size - SAMPLE_BYTES]
+
+
+def _digest(size: int, samples: list[bytes]) -> str:
+    h = hashlib.sha1(str(size).encode())
+    for sample in samples:
+        h.update(sample)
+    return h.hexdigest()
+
+
+async def _fetch(session: aiohttp.ClientSession, url: str, offset: int, length: int) -> bytes:
+    async with session.get(
+        url,
+        headers={"Range": f"bytes={offset}-{offset + length - 1}"},
+        timeout=http.timeout("range"),
+    ) as response:
+        if response.status != 206:
+            raise Exception(f"HTTP {response.status}: Range request not honoured")
+        return await response.read()
+
+
+async def fingerprint_url(url: str, size: int) -> str | None:
+    """
+    Fingerprint a remote file from three Range requests, without downloading it.
+
+    Args:
+        url (str): Direct link that honours Range requests.
+        size (int): The probed file size.
+
+    Returns:
+        str: The hex fingerprint, or None if it could not be fetched.
+    """
+    if not size:
+        return None
+    length = min(size, SAMPLE_BYTES) if size > 3 * SAMPLE_BYTES else size
+    try:
+        samples = await asyncio.gather(
+            *[_fetch(http.session, url, offset, length) for offset in _offsets(size)]
+        )
+    except Exception as e:
+        log.warning(f"Could not fingerprint {url}: {e}")
+        return None
+    if any(len(sample) != length for sample in samples):
+        return None
+    return _digest(size, samples)
+
+
+def fingerprint_file(path: str) -> str:
+    """Fingerprint a local file the same way `fingerprint_url` does"""
+    size = os.path.getsize(path)
+    length = min(size, SAMPLE_BYTES) if size > 3 * SAMPLE_BYTES else size
+    samples = []
+    with open(path, "rb") as f:
+        for offset in _offsets(size):
+            f.seek(offset)
+            samples.append(f.read(length))
+    return _digest(size, samples)
+
+
+async def fingerprint_data(data: dict) -> str | None:
+    """Fingerprint the file of a probed `get_data` result"""
+    if not data.get("accept_ranges"):
+        return None
+    return await fingerprint_url(data["direct_link"], int(data.get("sizebytes") or 0))
+
+
+def lookup(fingerprint: str) -> int | None:
+    """Storage message id of known content, counted in the hit rate"""
+    try:
+        msg_id = db.get(f"fp_{fingerprint}")
+        db.redis.hincrby(STATS_KEY, "hits" if msg_id else "misses", 1)
+    except Exception as e:
+        log.error(f"Error looking up fingerprint: {e}")
+        return None
+    return int(msg_id) if msg_id else None
+
+
+def remember(fingerprint: str, msg_id: int) -> None:
+    db.set_key(f"fp_{fingerprint}", msg_id)
+
+
+def forget(fingerprint: str) -> None:
+    db.delete(f"fp_{fingerprint}")
+
+
+def get_stats() -> dict:
+    """Hits, misses and hit rate of fingerprint lookups"""
+    stats = db.redis.hgetall(STATS_KEY) or {}
+    hits, misses = int(stats.get("hits", 0)), int(stats.get("misses", 0))
+    total = hits + misses
+    return {"hits": hits, "misses": misses, "hit_rate": hits / total if total else 0.0}
@@ -1,10 +1,141 @@
+import asyncio
+import logging
+import os
+
 from aiohttp import web
+from telethon import TelegramClient
+
+from chunk_store import chunk_store
+from edit_scheduler import edit_scheduler
+from fingerprint import get_stats as fingerprint_stats
+from http_client import http
+from loop_monitor import loop_monitor
+from memory import memory_governor
+from metrics import registry
+from outbox import BACKGROUND, USER, outbox
+from redis_db import db
+from send_media import running_jobs
+from workspace import workspace
+
+log = logging.getLogger(__name__)
+
+READY_TIMEOUT = 5
+
+QUEUE_DEPTH = registry.gauge("terabox_queue_depth", "Items waiting in each queue", ["queue"])
+RUNNING_JOBS = registry.gauge("terabox_running_jobs", "Downloads in progress")
+CACHE_HITS = registry.gauge("terabox_cache_hits", "Lookups answered by each cache", ["cache"])
+CACHE_MISSES = registry.gauge("terabox_cache_misses", "Lookups each cache could not answer", ["cache"])
+CACHE_HIT_RATIO = registry.gauge("terabox_cache_hit_ratio", "Share of lookups each cache answered", ["cache"])
+FLOOD_WAITS = registry.gauge("terabox_flood_waits", "FloodWait errors Telegram returned", ["source"])
+LOOP_LAG_LAST = registry.gauge("terabox_event_loop_lag_last_seconds", "Lag of the latest loop sample")
+LOOP_LAG_MAX = registry.gauge("terabox_event_loop_lag_max_seconds", "Worst loop lag since start")
+LOOP_LAG_RECENT = registry.gauge("terabox_event_loop_lag_recent_seconds", "Loop lag percentiles of the last minutes", ["quantile"])
+HTTP_POOL = registry.gauge("terabox_http", "Shared HTTP pool counters and connections", ["stat"])
+DISK = registry.gauge("terabox_disk_bytes", "Disk used and allowed by the chunk store and jobs", ["area", "stat"])
+MEMORY = registry.gauge("terabox_memory_bytes", "Process memory and job reservations", ["stat"])
+MEMORY_ADMISSION = registry.gauge("terabox_memory_admission", "Jobs waiting for or turned away by the memory governor", ["stat"])
+
+
+def _cache(name: str, hits: int, misses: int) -> None:
+    CACHE_HITS.set(hits, cache=name)
+    CACHE_MISSES.set(misses, cache=name)
+    CACHE_HIT_RATIO.set(hits / (hits + misses) if hits + misses else 0.0, cache=name)
+
+
+def _collect_redis() -> None:
+    """Gauges kept in Redis, which blocks, so this runs off the loop"""
+    fingerprints = fingerprint_stats()
+    _cache("fingerprint", fingerprints["hits"], fingerprints["misses"])
+
+
+@registry.collector
+def _collect() -> None:
+    QUEUE_DEPTH.set(outbox.depth(USER), queue="outbox_user")
+    QUEUE_DEPTH.set(outbox.depth(BACKGROUND), queue="outbox_background")
+    QUEUE_DEPTH.set(edit_scheduler.pending, queue="edits")
+    RUNNING_JOBS.set(len(running_jobs()))
+
+    _cache("redis", db.hits, db.misses)
+    _cache("chunk_store", chunk_store.hits, chunk_store.misses)
+
+    FLOOD_WAITS.set(outbox.flood_waits, source="outbox")
+    FLOOD_WAITS.set(edit_scheduler.flood_waits, source="edits")
+
+    lag = loop_monitor.stats()
+    LOOP_LAG_LAST.set(lag["lag"])
+    LOOP_LAG_MAX.set(lag["max_lag"])
+    LOOP_LAG_RECENT.set(lag["p50"], quantile="0.5")
+    LOOP_LAG_RECENT.set(lag["p99"], quantile="0.99")
+
+    for stat, value in http.stats().items():
+        HTTP_POOL.set(value, stat=stat)
+    store = chunk_store.stats()
+    DISK.set(store["used"], area="chunk_store", stat="used")
+    DISK.set(store["budget"], area="chunk_store", stat="budget")
+    jobs = workspace.stats()
+    DISK.set(jobs["reserved"], area="workspace", stat="reserved")
+    DISK.set(jobs["quota"], area="workspace", stat="quota")
+    memory = memory_governor.stats()
+    for stat in ("rss", "reserved", "limit"):
+        MEMORY.set(memory[stat], stat=stat)
+    for stat in ("queued", "shed"):
+        MEMORY_ADMISSION.set(memory[stat], stat=stat)
+
+
+async def healthz(request: web.Request) -> web.Response:
+    """Liveness: answering at all means the loop is turning"""
+    return web.json_response({"status": "ok", "loop_lag": loop_monitor.lag})
+
+
+async def readyz(request: web.Request) -> web.Response:
+    """Readiness: Redis answers and the Telegram connection is up"""
+    client: TelegramClient = request.app["client"]
+    checks = {"telegram": client.is_connected()}
+    try:
+        checks["redis"] = await asyncio.wait_for(asyncio.to_thread(db.redis.ping), READY_TIMEOUT)
+    except Exception as e:
+        log.warning(f"Readiness check of Redis failed: {e}")
+        checks["redis"] = False
+    ready = all(checks.values())
+    return web.json_response(
+        {"status": "ready" if ready else "unavailable", **checks},
+        status=200 if ready else 503,
+    )
+
+
+async def metrics(request: web.Request) -> web.Response:
+    # The collectors read state the loop changes, so they run here; Redis
+    # reads and formatting go to a thread
+    registry.collect()
+
+    def render() -> str:
+        _collect_redis()
+        return registry.render(collect=False)
+
+    text = await asyncio.to_thread(render)
+    return web.Response(text=text, content_type="text/plain", charset="utf-8")
+
 
-async def health_check(request):
-    return web.Response(text="OK", status=200)
+async def start_server(client: TelegramClient, port: int = None) -> web.AppRunner:
+    """
+    Serve health checks and metrics on the bot's loop.
 
-app = web.Application()
-app.router.add_get("/", health_check)
+    Args:
+        client (TelegramClient): The bot, whose connection readiness checks.
+        port (int): Port to listen on, PORT from the environment by default.
 
-if __name__ == "__main__":
-    web.run_app(app, port=8080)
\ No newline at end of file
+    Returns:
+        web.AppRunner: To pass to `cleanup` on shutdown.
+    """
+    port = port or int(os.environ.get("PORT", 8080))
+    app = web.Application()
+    app["client"] = client
+    app.router.add_get("/", healthz)
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/readyz", readyz)
+    app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, port=port).start()
+    log.info(f"Health and metrics on port {port}")
+    return runner
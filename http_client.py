@@ -0,0 +1,137 @@
+import asyncio
+import logging
+from collections import Counter
+
+import aiohttp
+
+log = logging.getLogger(__name__)
+
+try:
+    import aiodns  # noqa: F401
+
+    from aiohttp.resolver import AsyncResolver
+except ImportError:
+    AsyncResolver = None
+
+# Connections in total, and to any one CDN or API host.
+POOL_LIMIT = 100
+POOL_LIMIT_PER_HOST = 8
+# Whole-file transfers get a pool of their own: a segmented download holds
+# its connections for the whole file, and small requests with a total
+# timeout must not spend it waiting behind them.
+BULK_LIMIT_PER_HOST = 32
+DNS_CACHE_TTL = 300
+KEEPALIVE_TIMEOUT = 30
+
+TIMEOUTS = {
+    # Resolver and shortener APIs answer in seconds or not at all.
+    "api": aiohttp.ClientTimeout(total=30, connect=10),
+    # First byte probes and mirror races.
+    "probe": aiohttp.ClientTimeout(total=15, connect=10),
+    # Small Range reads: fingerprints, metadata, thumbnail heads.
+    "range": aiohttp.ClientTimeout(total=30, connect=10),
+    "image": aiohttp.ClientTimeout(total=20, connect=10),
+    # Whole files take as long as they take, as long as bytes keep coming.
+    "download": aiohttp.ClientTimeout(total=None, connect=15, sock_read=60),
+}
+
+
+class HttpClient:
+    """
+    The aiohttp sessions every module sends its requests through: `session`
+    for API calls, probes and small Range reads, `bulk` for downloading
+    whole files.
+
+    Connections are kept alive and limited per host, DNS answers are cached
+    (through aiodns when it is installed), and pool counters are kept for
+    the metrics endpoint.
+    """
+
+    def __init__(
+        self,
+        limit: int = POOL_LIMIT,
+        limit_per_host: int = POOL_LIMIT_PER_HOST,
+        bulk_limit_per_host: int = BULK_LIMIT_PER_HOST,
+    ):
+        self.limit = limit
+        self.limits_per_host = {"session": limit_per_host, "bulk": bulk_limit_per_host}
+        self.counters = Counter()
+        self._sessions: dict[str, aiohttp.ClientSession] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        trace = aiohttp.TraceConfig()
+
+        def count(name):
+            async def handler(session, context, params):
+                self.counters[name] += 1
+
+            return handler
+
+        trace.on_request_start.append(count("requests"))
+        trace.on_request_exception.append(count("request_errors"))
+        trace.on_connection_create_end.append(count("connections_created"))
+        trace.on_connection_reuseconn.append(count("connections_reused"))
+        trace.on_connection_queued_start.append(count("connections_queued"))
+        trace.on_dns_cache_hit.append(count("dns_cache_hits"))
+        trace.on_dns_cache_miss.append(count("dns_cache_misses"))
+        return trace
+
+    def _create(self, kind: str) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limits_per_host[kind],
+            ttl_dns_cache=DNS_CACHE_TTL,
+            keepalive_timeout=KEEPALIVE_TIMEOUT,
+            resolver=AsyncResolver() if AsyncResolver else None,
+        )
+        log.info(
+            f"HTTP {kind} pool ready ({self.limit} connections, {self.limits_per_host[kind]} per host, "
+            f"{'aiodns' if AsyncResolver else 'threaded'} DNS)"
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=TIMEOUTS["api"],
+            trace_configs=[self._trace_config()],
+        )
+
+    async def start(self) -> aiohttp.ClientSession:
+        """Create the session on the bot's loop, called once at startup"""
+        return self.session
+
+    def _get(self, kind: str) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # A session is bound to its loop, tests and benchmarks run several
+            self._sessions = {}
+            self._loop = loop
+        session = self._sessions.get(kind)
+        if session is None or session.closed:
+            session = self._sessions[kind] = self._create(kind)
+        return session
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """The shared session, created on first use if startup didn't"""
+        return self._get("session")
+
+    @property
+    def bulk(self) -> aiohttp.ClientSession:
+        """The session for whole-file downloads"""
+        return self._get("bulk")
+
+    @staticmethod
+    def timeout(kind: str) -> aiohttp.ClientTimeout:
+        return TIMEOUTS[kind]
+
+    async def close(self) -> None:
+        for session in self._sessions.values():
+            if not session.closed:
+                await session.close()
+
+    def stats(self) -> dict:
+        """Request and connection counters of both sessions"""
+        return dict(self.counters)
+
+
+http = HttpClient()
@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+from config import BLOCKING_THRESHOLD, LOOP_WATCHDOG
+from metrics import BLOCKING_CALLS, BLOCKING_SECONDS, LOOP_LAG
+
+log = logging.getLogger(__name__)
+
+SAMPLE_INTERVAL = 0.5
+# Lag worth a line in the log, anything above blocks every user at once.
+WARN_LAG = 0.5
+# Recent samples the percentiles are taken over, five minutes at 0.5s.
+WINDOW = 600
+STACK_DEPTH = 8
+
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def _call_site(frame) -> tuple[str, str]:
+    """
+    The innermost frame of our own code in a stack, which is the call that
+    blocked, and the end of the stack leading to it.
+    """
+    stack = traceback.extract_stack(frame)
+    ours = [
+        entry
+        for entry in stack
+        if entry.filename.startswith(_ROOT) and entry.filename != __file__
+    ]
+    entry = (ours or stack)[-1]
+    site = f"{os.path.relpath(entry.filename, _ROOT) if ours else entry.filename}:{entry.lineno} {entry.name}"
+    return site, "".join(traceback.format_list(stack[-STACK_DEPTH:]))
+
+
+class BlockingSite:
+    def __init__(self, stack: str):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.stack = stack
+
+
+class LoopMonitor:
+    """
+    Measures event loop lag: how much later than asked a short sleep wakes
+    up, which is the time something held the loop.
+
+    With the watchdog on, a thread also pings the loop and, when a ping
+    isn't answered within `threshold`, grabs the loop thread's stack. The
+    blocked time is added up by the call site that held the loop, so the
+    synchronous calls that hurt most come out on top.
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL, threshold: float = BLOCKING_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.samples: deque[float] = deque(maxlen=WINDOW)
+        self.sites: dict[str, BlockingSite] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread: int | None = None
+        self._lock = threading.Lock()
+        self._watching = threading.Event()
+        self._watchdog: threading.Thread | None = None
+
+    async def run(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        if LOOP_WATCHDOG:
+            self.start_watchdog()
+        while True:
+            started = self._loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(self._loop.time() - started - self.interval, 0.0)
+            self.lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self.samples.append(lag)
+            LOOP_LAG.observe(lag)
+            if lag >= WARN_LAG:
+                log.warning(f"Event loop was blocked for {lag * 1000:.0f}ms")
+
+    @property
+    def watching(self) -> bool:
+        return self._watching.is_set()
+
+    def start_watchdog(self) -> bool:
+        """Start recording what blocks the loop, returns False before `run`"""
+        if self._loop is None:
+            return False
+        if not self._watching.is_set():
+            self._watching.set()
+            # A watchdog stopped a moment ago may not have noticed yet
+            if self._watchdog is None or not self._watchdog.is_alive():
+                self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+                self._watchdog.start()
+            log.info(f"Loop watchdog on, recording calls blocking over {self.threshold * 1000:.0f}ms")
+        return True
+
+    def stop_watchdog(self) -> None:
+        self._watching.clear()
+
+    def _watch(self) -> None:
+        while self._watching.is_set():
+            answered = threading.Event()
+            sent = time.monotonic()
+            try:
+                self._loop.call_soon_threadsafe(answered.set)
+            except RuntimeError:
+                # The loop is closed
+                return
+            if answered.wait(self.threshold):
+                time.sleep(self.threshold)
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            site, stack = _call_site(frame)
+            del frame
+            while not answered.wait(1):
+                if not self._watching.is_set():
+                    return
+            self._record(site, stack, time.monotonic() - sent)
+
+    def _record(self, site: str, stack: str, blocked: float) -> None:
+        with self._lock:
+            entry = self.sites.setdefault(site, BlockingSite(stack))
+            entry.count += 1
+            entry.total += blocked
+            if blocked > entry.max:
+                entry.max = blocked
+                entry.stack = stack
+        BLOCKING_CALLS.inc(site=site)
+        BLOCKING_SECONDS.inc(blocked, site=site)
+        log.warning(f"Loop blocked for {blocked * 1000:.0f}ms in {site}")
+
+    def top(self, count: int = 5) -> list[tuple[str, BlockingSite]]:
+        """Call sites that held the loop longest in total"""
+        with self._lock:
+            return sorted(self.sites.items(), key=lambda item: -item[1].total)[:count]
+
+    def reset(self) -> None:
+        with self._lock:
+            self.sites.clear()
+        self.max_lag = 0.0
+
+    def stats(self) -> dict:
+        samples = sorted(self.samples)
+        return {
+            "lag": self.lag,
+            "max_lag": self.max_lag,
+            "p50": statistics.median(samples) if samples else 0.0,
+            "p99": samples[max(int(len(samples) * 0.99) - 1, 0)] if samples else 0.0,
+        }
+
+
+loop_monitor = LoopMonitor()
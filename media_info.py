@@ -0,0 +1,240 @@
+import asyncio
+import json
+import logging
+import os
+import struct
+from dataclasses import asdict, dataclass
+
+import aiohttp
+from telethon.tl.types import DocumentAttributeVideo
+
+from http_client import http
+from redis_db import db
+
+log = logging.getLogger(__name__)
+
+HEAD_BYTES = 1024 * 1024
+# A moov of a few hours of video is a handful of MB, anything bigger is broken.
+MAX_MOOV_BYTES = 32 * 1024 * 1024
+
+
+@dataclass
+class VideoMeta:
+    container: str = ""
+    duration: float = 0
+    width: int = 0
+    height: int = 0
+    moov_at_end: bool = False
+
+    def attributes(self) -> list:
+        """Telegram attributes for uploading the video"""
+        if not self.duration and not self.width:
+            return []
+        return [
+            DocumentAttributeVideo(
+                duration=self.duration,
+                w=self.width,
+                h=self.height,
+                supports_streaming=True,
+            )
+        ]
+
+
+class HttpReader:
+    """Random access to a remote file through Range requests"""
+
+    def __init__(self, url: str, size: int, session: aiohttp.ClientSession):
+        self.url = url
+        self.size = size
+        self.session = session
+
+    async def read(self, offset: int, length: int) -> bytes:
+        end = min(offset + length, self.size) - 1
+        if end < offset:
+            return b""
+        async with self.session.get(
+            self.url,
+            headers={"Range": f"bytes={offset}-{end}"},
+            timeout=http.timeout("range"),
+        ) as response:
+            if response.status != 206:
+                raise Exception(f"HTTP {response.status}: Range request not honoured")
+            return await response.read()
+
+
+class FileReader:
+    """Random access to a (possibly still growing) local file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.size = os.path.getsize(path)
+
+    async def read(self, offset: int, length: int) -> bytes:
+        def read():
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                return f.read(length)
+
+        return await asyncio.to_thread(read)
+
+
+def _boxes(data: bytes, start: int = 0, end: int = None):
+    """Yield (type, payload_start, box_end) of the MP4 boxes in data[start:end]"""
+    end = len(data) if end is None else end
+    offset = start
+    while offset + 8 <= end:
+        size, kind = struct.unpack(">I4s", data[offset : offset + 8])
+        header = 8
+        if size == 1:
+            size = struct.unpack(">Q", data[offset + 8 : offset + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header:
+            return
+        yield kind, offset + header, min(offset + size, end)
+        offset += size
+
+
+def _child(data: bytes, start: int, end: int, kind: bytes):
+    for k, payload, box_end in _boxes(data, start, end):
+        if k == kind:
+            return payload, box_end
+    return None
+
+
+def parse_moov(moov: bytes, meta: VideoMeta) -> VideoMeta:
+    """Fill duration and video dimensions from the payload of a moov box"""
+    mvhd = _child(moov, 0, len(moov), b"mvhd")
+    if mvhd:
+        p = mvhd[0]
+        if moov[p] == 1:
+            timescale, duration = struct.unpack(">IQ", moov[p + 20 : p + 32])
+        else:
+            timescale, duration = struct.unpack(">II", moov[p + 12 : p + 20])
+        if timescale:
+            meta.duration = duration / timescale
+    for kind, payload, box_end in _boxes(moov):
+        if kind != b"trak":
+            continue
+        mdia = _child(moov, payload, box_end, b"mdia")
+        hdlr = mdia and _child(moov, mdia[0], mdia[1], b"hdlr")
+        if not hdlr or moov[hdlr[0] + 8 : hdlr[0] + 12] != b"vide":
+            continue
+        tkhd = _child(moov, payload, box_end, b"tkhd")
+        if tkhd:
+            # width/height are the last 8 bytes, 16.16 fixed point
+            width, height = struct.unpack(">II", moov[tkhd[1] - 8 : tkhd[1]])
+            meta.width, meta.height = width >> 16, height >> 16
+            break
+    return meta
+
+
+async def read_mp4(reader, head: bytes) -> VideoMeta | None:
+    """
+    Walk the top level boxes of an MP4 reading only headers and the moov.
+    None if it is no MP4 or its moov couldn't be read.
+    """
+    if head[4:8] != b"ftyp":
+        return None
+    meta = VideoMeta(container="mp4")
+    offset, seen_mdat = 0, False
+    while offset + 8 <= reader.size:
+        if offset + 16 <= len(head):
+            header = head[offset : offset + 16]
+        else:
+            header = await reader.read(offset, 16)
+        if len(header) < 8:
+            break
+        size, kind = struct.unpack(">I4s", header[:8])
+        header_size = 8
+        if size == 1:
+            size = struct.unpack(">Q", header[8:16])[0]
+            header_size = 16
+        elif size == 0:
+            size = reader.size - offset
+        if size < header_size:
+            break
+        if kind == b"mdat":
+            seen_mdat = True
+        elif kind == b"moov":
+            if size > MAX_MOOV_BYTES:
+                break
+            if offset + size <= len(head):
+                moov = head[offset + header_size : offset + size]
+            else:
+                moov = await reader.read(offset + header_size, size - header_size)
+            meta.moov_at_end = seen_mdat
+            return parse_moov(moov, meta)
+        offset += size
+    return None
+
+
+def read_other(head: bytes) -> VideoMeta | None:
+    """Let hachoir have a go at the head of non MP4 containers (MKV, WebM...)"""
+    from hachoir.metadata import extractMetadata
+    from hachoir.parser import guessParser
+    from hachoir.stream import StringInputStream
+
+    parser = guessParser(StringInputStream(head))
+    if not parser:
+        return None
+    with parser:
+        metadata = extractMetadata(parser)
+    if not metadata:
+        return None
+    meta = VideoMeta(container=parser.__class__.__name__.lower())
+    if metadata.has("duration"):
+        meta.duration = metadata.get("duration").total_seconds()
+    for group in [metadata, *getattr(metadata, "iterGroups", lambda: [])()]:
+        if group.has("width") and group.has("height"):
+            meta.width, meta.height = group.get("width"), group.get("height")
+            break
+    return meta
+
+
+async def read_metadata(reader) -> VideoMeta | None:
+    """Extract the metadata of a video through any reader with `size` and `read`"""
+    try:
+        head = await reader.read(0, HEAD_BYTES)
+        meta = await read_mp4(reader, head)
+        if meta is None and head[4:8] != b"ftyp":
+            meta = await asyncio.to_thread(read_other, head)
+        return meta
+    except Exception as e:
+        log.warning(f"Could not read video metadata: {e}")
+        return None
+
+
+def get_cached_metadata(shorturl: str) -> VideoMeta | None:
+    value = db.get(f"meta_{shorturl}")
+    if not value:
+        return None
+    try:
+        return VideoMeta(**json.loads(value))
+    except Exception:
+        return None
+
+
+def cache_metadata(shorturl: str, meta: VideoMeta) -> None:
+    db.set(f"meta_{shorturl}", json.dumps(asdict(meta)))
+
+
+async def get_metadata(shorturl: str, url: str = None, size: int = 0, path: str = None) -> VideoMeta | None:
+    """
+    Video metadata of a share code, cached with its file record.
+
+    Reads from the partial or finished local file at `path` if given,
+    otherwise from `url` by Range requests, which needs the probed `size`.
+    """
+    if meta := get_cached_metadata(shorturl):
+        return meta
+    if path and os.path.exists(path):
+        meta = await read_metadata(FileReader(path))
+    elif url and size:
+        meta = await read_metadata(HttpReader(url, size, http.session))
+    else:
+        return None
+    if meta and meta.duration:
+        cache_metadata(shorturl, meta)
+    return meta
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import os
+import resource
+import time
+import tracemalloc
+from collections import defaultdict
+
+from config import MEMORY_LIMIT
+
+log = logging.getLogger(__name__)
+
+# Past the soft watermark new jobs queue, past the hard one they are turned away.
+SOFT_WATERMARK = 0.75
+HARD_WATERMARK = 0.90
+QUEUE_TIMEOUT = 120
+POLL_INTERVAL = 1
+
+# What a transfer holds in memory besides the file, which goes to disk.
+JOB_BASE_FOOTPRINT = 16 * 1024 * 1024
+WRITER_QUEUE_BYTES = 8 * 1024 * 1024  # file_writer.MAX_PENDING chunks
+THUMBNAIL_HEAD_BYTES = 4 * 1024 * 1024
+UPLOAD_PART_BYTES = 512 * 1024
+UPLOAD_CONNECTIONS = 20
+
+
+def rss() -> int:
+    """Resident set size of this process in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # Peak rather than current, but better than nothing off Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def estimate_job(moov_bytes: int = 0) -> int:
+    """Memory a transfer is expected to need at its peak"""
+    return (
+        JOB_BASE_FOOTPRINT
+        + WRITER_QUEUE_BYTES
+        + THUMBNAIL_HEAD_BYTES
+        + UPLOAD_CONNECTIONS * UPLOAD_PART_BYTES
+        + moov_bytes
+    )
+
+
+class Reservation:
+    def __init__(self, nbytes: int):
+        self.nbytes = nbytes
+        self.since = time.monotonic()
+
+
+class MemoryGovernor:
+    """
+    Admission control against the container's memory limit.
+
+    Jobs reserve their estimated footprint before they start. A job is let
+    in while the reservations stay under the soft watermark, it waits in
+    line above it. RSS only counts against the hard watermark, above which
+    jobs are shed: the allocators rarely hand freed buffers back, so RSS
+    stays high long after the jobs that used it are gone.
+    """
+
+    def __init__(self, limit: int = MEMORY_LIMIT):
+        self.limit = limit
+        self.shed = 0
+        self.queued = 0
+        self._reservations: set[Reservation] = set()
+        self._baseline = rss()
+        self._released = asyncio.Event()
+
+    @property
+    def reserved(self) -> int:
+        return sum(r.nbytes for r in self._reservations)
+
+    def usage(self) -> int:
+        """Memory in use or promised, whichever is higher"""
+        return max(rss(), self._baseline + self.reserved)
+
+    def _fits(self, nbytes: int) -> bool:
+        if self._critical():
+            return False
+        return self._baseline + self.reserved + nbytes <= self.limit * SOFT_WATERMARK
+
+    def _critical(self) -> bool:
+        return rss() >= self.limit * HARD_WATERMARK
+
+    def try_acquire(self, nbytes: int) -> Reservation | None:
+        """Reserve `nbytes` if there is room right now"""
+        if not self._fits(nbytes):
+            return None
+        reservation = Reservation(nbytes)
+        self._reservations.add(reservation)
+        return reservation
+
+    async def acquire(self, nbytes: int, on_queued=None, timeout: float = QUEUE_TIMEOUT) -> Reservation | None:
+        """
+        Reserve `nbytes`, waiting in line while memory is tight.
+
+        Args:
+            nbytes (int): The job's estimated footprint.
+            on_queued (Callable): Awaited once if the job has to wait.
+            timeout (float): How long to wait before giving up.
+
+        Returns:
+            Reservation: To hand back to `release`, None if the job was shed.
+        """
+        if reservation := self.try_acquire(nbytes):
+            return reservation
+        if self._critical():
+            self.shed += 1
+            log.warning(f"Shedding a job, RSS {rss() / 1024**2:.0f}MB is past the hard watermark")
+            return None
+        self.queued += 1
+        if on_queued:
+            await on_queued()
+        deadline = time.monotonic() + timeout
+        try:
+            while time.monotonic() < deadline:
+                self._released.clear()
+                try:
+                    await asyncio.wait_for(self._released.wait(), POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                if reservation := self.try_acquire(nbytes):
+                    return reservation
+                if self._critical():
+                    break
+        finally:
+            self.queued -= 1
+        self.shed += 1
+        return None
+
+    def release(self, reservation: Reservation | None) -> None:
+        if reservation is not None and reservation in self._reservations:
+            self._reservations.discard(reservation)
+            self._released.set()
+
+    def stats(self) -> dict:
+        return {
+            "rss": rss(),
+            "reserved": self.reserved,
+            "jobs": len(self._reservations),
+            "limit": self.limit,
+            "queued": self.queued,
+            "shed": self.shed,
+        }
+
+
+def _subsystem(filename: str) -> str:
+    """Group an allocation by the package or bot module it came from"""
+    parts = filename.replace("\\", "/").split("/")
+    if "site-packages" in parts:
+        return parts[parts.index("site-packages") + 1].split(".")[0]
+    name = os.path.splitext(parts[-1])[0]
+    if "lib" in parts and "python" in "/".join(parts):
+        return f"stdlib:{name}"
+    return name
+
+
+def memory_report(top: int = 12) -> str:
+    """
+    Per subsystem Python allocations from a tracemalloc snapshot.
+
+    The first call starts tracing, only memory allocated after that is seen,
+    so the report gets useful from the second call on.
+    """
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(1)
+        return "Started tracing allocations, run this again in a while for a report."
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        [tracemalloc.Filter(False, tracemalloc.__file__)]
+    )
+    totals = defaultdict(int)
+    for stat in snapshot.statistics("filename"):
+        totals[_subsystem(stat.traceback[0].filename)] += stat.size
+    traced, peak = tracemalloc.get_traced_memory()
+    lines = [
+        f"Traced {traced / 1024**2:.1f}MB (peak {peak / 1024**2:.1f}MB)",
+        *(
+            f"{name}: {size / 1024**2:.2f}MB"
+            for name, size in sorted(totals.items(), key=lambda item: -item[1])[:top]
+        ),
+    ]
+    return "\n".join(lines)
+
+
+def stop_tracing() -> None:
+    tracemalloc.stop()
+
+
+memory_governor = MemoryGovernor()
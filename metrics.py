@@ -0,0 +1,180 @@
+import bisect
+import threading
+from typing import Callable, Iterable
+
+# Seconds, from a cached API answer to a resolver that is about to time out.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Bytes per second, from a stalled mirror to a fast CDN.
+THROUGHPUT_BUCKETS = tuple(int(mb * 1024 * 1024) for mb in (0.25, 0.5, 1, 2, 5, 10, 20, 50, 100))
+STAGE_BUCKETS = (0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.label_names)
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return self.header() + [
+            f"{self.name}{_labels(self.label_names, key)} {_number(value)}" for key, value in values
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        lines = self.header()
+        names = self.label_names + ("le",)
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(names, key + (_number(bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """
+    Metrics in the Prometheus text format, without the client library.
+
+    Event counters and histograms are updated where things happen. Gauges
+    of state other modules already keep are read by collectors at scrape
+    time, so those modules don't have to know about metrics.
+    """
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+        self._collectors: list[Callable[[], None]] = []
+
+    def _add(self, metric):
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labels: Iterable[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Iterable[str] = ()) -> Gauge:
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Iterable[str] = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def collector(self, func: Callable[[], None]) -> Callable[[], None]:
+        """Register `func` to refresh gauges before every scrape"""
+        self._collectors.append(func)
+        return func
+
+    def collect(self) -> None:
+        """Run the collectors, on the thread that owns the state they read"""
+        for collect in self._collectors:
+            collect()
+
+    def render(self, collect: bool = True) -> str:
+        """The text exposition, after running the collectors unless told not to"""
+        if collect:
+            self.collect()
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+RESOLVER_LATENCY = registry.histogram(
+    "terabox_resolver_seconds", "Time the resolver API took to answer", ["outcome"]
+)
+TRANSFER_BYTES = registry.counter(
+    "terabox_transfer_bytes_total", "Bytes moved by jobs", ["direction"]
+)
+TRANSFER_THROUGHPUT = registry.histogram(
+    "terabox_transfer_bytes_per_second",
+    "Throughput of single downloads and uploads",
+    ["direction"],
+    buckets=THROUGHPUT_BUCKETS,
+)
+STAGE_DURATION = registry.histogram(
+    "terabox_stage_seconds",
+    "Time jobs spent in each stage",
+    ["stage", "outcome"],
+    buckets=STAGE_BUCKETS,
+)
+LOOP_LAG = registry.histogram(
+    "terabox_event_loop_lag_seconds", "How late the event loop woke a sleeping task", buckets=LAG_BUCKETS
+)
+BLOCKING_CALLS = registry.counter(
+    "terabox_loop_blocking_calls_total", "Times a call site held the event loop past the threshold", ["site"]
+)
+BLOCKING_SECONDS = registry.counter(
+    "terabox_loop_blocking_seconds_total", "Time each call site held the event loop", ["site"]
+)
+
+
+def record_transfer(direction: str, nbytes: int, seconds: float) -> None:
+    """Count a finished download or upload and its throughput"""
+    if nbytes <= 0:
+        return
+    TRANSFER_BYTES.inc(nbytes, direction=direction)
+    TRANSFER_THROUGHPUT.observe(nbytes / max(seconds, 1e-6), direction=direction)
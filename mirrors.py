@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import time
+from urllib.parse import urlparse
+
+import aiohttp
+
+from http_client import http
+from probe import choose_strategy
+from redis_db import db
+
+log = logging.getLogger(__name__)
+
+HOST_SPEED_KEY = "host_speed"
+SAMPLE_BYTES = 256 * 1024
+RACE_TIMEOUT = 15
+# How much longer than the winner the others may take before they are dropped.
+GRACE_FACTOR = 1.5
+EWMA_ALPHA = 0.3
+
+# Folds a sample into a host's moving average in one round trip, so
+# concurrent downloads from the same host can't lose each other's update.
+#
+# KEYS[1] speed hash, ARGV[1] host, ARGV[2] bytes/s, ARGV[3] alpha
+EWMA_LUA = """
+local sample = tonumber(ARGV[2])
+local previous = tonumber(redis.call('HGET', KEYS[1], ARGV[1]))
+local alpha = tonumber(ARGV[3])
+local speed = sample
+if previous then
+    speed = alpha * sample + (1 - alpha) * previous
+end
+redis.call('HSET', KEYS[1], ARGV[1], string.format('%.0f', speed))
+return string.format('%.0f', speed)
+"""
+
+_ewma_script = None
+
+
+def host_of(url: str) -> str:
+    return urlparse(url).hostname or ""
+
+
+def get_host_speeds(hosts: list[str]) -> dict[str, float]:
+    """Return the remembered throughput in bytes/s of each known host"""
+    if not hosts:
+        return {}
+    try:
+        values = db.redis.hmget(HOST_SPEED_KEY, hosts)
+    except Exception as e:
+        log.error(f"Error reading host speeds: {e}")
+        return {}
+    return {host: float(v) for host, v in zip(hosts, values) if v}
+
+
+def record_throughput(host: str, bytes_per_second: float) -> None:
+    """
+    Fold the throughput of a completed download from `host` into its moving
+    average. Race samples are mostly time to first byte and are kept out of
+    it. Blocks on Redis, call it through asyncio.to_thread.
+    """
+    global _ewma_script
+    if not host or bytes_per_second <= 0:
+        return
+    try:
+        if _ewma_script is None:
+            _ewma_script = db.redis.register_script(EWMA_LUA)
+        _ewma_script(keys=[HOST_SPEED_KEY], args=[host, bytes_per_second, EWMA_ALPHA])
+    except Exception as e:
+        log.error(f"Error recording speed of {host}: {e}")
+
+
+def rank_by_history(urls: list[str]) -> list[str]:
+    """Order links by the remembered speed of their host, unknown hosts in the middle"""
+    speeds = get_host_speeds(list({host_of(url) for url in urls}))
+    if not speeds:
+        return list(urls)
+    neutral = sorted(speeds.values())[len(speeds) // 2]
+    return sorted(urls, key=lambda url: -speeds.get(host_of(url), neutral))
+
+
+async def _sample(session: aiohttp.ClientSession, url: str) -> float:
+    """Fetch the first SAMPLE_BYTES of `url`, returns the throughput in bytes/s"""
+    started = time.monotonic()
+    received = 0
+    async with session.get(
+        url,
+        headers={"Range": f"bytes=0-{SAMPLE_BYTES - 1}"},
+        timeout=aiohttp.ClientTimeout(total=RACE_TIMEOUT),
+    ) as response:
+        if response.status not in (200, 206):
+            raise Exception(f"HTTP {response.status}: {response.reason}")
+        async for chunk in response.content.iter_chunked(64 * 1024):
+            received += len(chunk)
+            if received >= SAMPLE_BYTES:
+                break
+    return received / max(time.monotonic() - started, 1e-6)
+
+
+async def race_mirrors(urls: list[str]) -> dict[str, float]:
+    """
+    Downloads the head of every mirror at the same time.
+
+    Mirrors still running when the fastest finished and the grace period ran
+    out are cancelled and count as slowest.
+
+    Args:
+        urls (list[str]): Links to the same file.
+
+    Returns:
+        dict[str, float]: Early throughput in bytes/s of the mirrors that finished.
+    """
+    results = {}
+    tasks = {asyncio.ensure_future(_sample(http.session, url)): url for url in urls}
+    started = time.monotonic()
+    deadline = started + RACE_TIMEOUT
+    pending = set(tasks)
+    have_winner = False
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending,
+                timeout=max(0, deadline - time.monotonic()),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
+                break
+            for task in done:
+                url = tasks[task]
+                if task.exception():
+                    log.warning(f"Mirror {host_of(url)} failed the race: {task.exception()}")
+                    continue
+                results[url] = task.result()
+            if results and not have_winner:
+                have_winner = True
+                deadline = started + (time.monotonic() - started) * GRACE_FACTOR
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    return results
+
+
+async def order_mirrors(data: dict) -> dict:
+    """
+    Puts the fastest mirror of a probed `get_data` result first. Links are
+    ranked by host history, then the head of each live link is raced.
+    """
+    probes = data.get("probes", {})
+    links = [data["direct_link"], *data.get("backup_links", [])]
+    live = [url for url in links if url and (url not in probes or probes[url].ok)]
+    if len(live) < 2:
+        return data
+    live = await asyncio.to_thread(rank_by_history, live)
+    speeds = await race_mirrors(live)
+    if speeds:
+        live.sort(key=lambda url: -speeds.get(url, 0))
+        log.info(
+            "Mirror race: "
+            + ", ".join(f"{host_of(u)}={speeds.get(u, 0) / 1024:.0f}KB/s" for u in live)
+        )
+    ordered = live + [url for url in links if url and url not in live]
+    data["direct_link"], data["backup_links"] = ordered[0], ordered[1:]
+    if ordered[0] in probes:
+        data["strategy"] = choose_strategy(probes[ordered[0]])
+    return data
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable
+
+from telethon import TelegramClient
+from telethon.errors import FloodWaitError
+
+from config import FORCE_LINK
+
+log = logging.getLogger(__name__)
+
+USER = "user"
+BACKGROUND = "background"
+
+MAX_MESSAGE_LENGTH = 4096
+
+
+class Outbox:
+    """
+    Outbound messages that don't have to happen inline with a handler.
+
+    Two lanes, each with its own worker: replies to users go on the user
+    lane, channel posts and reports on the background lane, which only sends
+    while the user lane is idle. A FloodWait parks the peer that caused it and
+    requeues its message for later, other peers keep flowing. Error reports
+    are collected and posted as one digest every `digest_interval` seconds.
+    """
+
+    def __init__(self, digest_peer=FORCE_LINK, digest_interval: float = 60.0):
+        self.client: TelegramClient = None
+        self.digest_peer = digest_peer
+        self.digest_interval = digest_interval
+        self.flood_waits = 0
+        self._lanes = {USER: deque(), BACKGROUND: deque()}
+        self._wakeup = {}
+        self._workers = {}
+        self._user_idle = None
+        self._blocked_until = {}
+        self._parked = {}
+        self._errors = []
+        self._digest_task = None
+
+    def attach(self, client: TelegramClient) -> None:
+        self.client = client
+
+    def _ensure_workers(self) -> None:
+        if self._user_idle is None:
+            self._user_idle = asyncio.Event()
+            self._user_idle.set()
+        for lane in self._lanes:
+            if lane not in self._workers or self._workers[lane].done():
+                self._wakeup[lane] = asyncio.Event()
+                self._workers[lane] = asyncio.create_task(self._run(lane))
+
+    def _enqueue(self, lane: str, peer, call: Callable[[], Awaitable], future=None):
+        self._ensure_workers()
+        self._lanes[lane].append((peer, call, future))
+        if lane == USER:
+            self._user_idle.clear()
+        self._wakeup[lane].set()
+
+    async def send(self, peer, text: str, **kwargs):
+        """Send a user facing message ahead of any background traffic"""
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(
+            USER, peer, lambda: self.client.send_message(peer, text, **kwargs), future
+        )
+        return await future
+
+    def post(self, peer, text: str, **kwargs) -> None:
+        """Send a message on the background lane without waiting for it"""
+        self._enqueue(
+            BACKGROUND, peer, lambda: self.client.send_message(peer, text, **kwargs)
+        )
+
+    def post_call(self, peer, call: Callable[[], Awaitable]) -> None:
+        """Run any request against `peer` on the background lane"""
+        self._enqueue(BACKGROUND, peer, call)
+
+    def report_error(self, text: str) -> None:
+        """Add an error report to the next digest"""
+        self._errors.append(text)
+        if self._digest_task is None or self._digest_task.done():
+            self._digest_task = asyncio.create_task(self._flush_digest_later())
+
+    async def _flush_digest_later(self) -> None:
+        await asyncio.sleep(self.digest_interval)
+        self.flush_digest()
+
+    def flush_digest(self) -> None:
+        """Post the collected error reports now"""
+        errors, self._errors = self._errors, []
+        if not errors:
+            return
+        header = f"Error Report ({len(errors)}):"
+        chunk = header
+        for error in errors:
+            entry = f"\n\n{error}"
+            if len(chunk) + len(entry) > MAX_MESSAGE_LENGTH:
+                self.post(self.digest_peer, chunk)
+                chunk = header
+            chunk += entry[: MAX_MESSAGE_LENGTH - len(header)]
+        self.post(self.digest_peer, chunk)
+
+    def depth(self, lane: str = None) -> int:
+        if lane:
+            return len(self._lanes[lane])
+        return sum(len(queue) for queue in self._lanes.values())
+
+    def _park(self, lane: str, peer, item: tuple, first: bool = False) -> None:
+        """Hold messages of a flood waited peer, in order, until it is unblocked"""
+        key = (lane, peer)
+        parked = self._parked.get(key)
+        if parked is None:
+            parked = self._parked[key] = deque()
+            delay = self._blocked_until[peer] - time.monotonic()
+            asyncio.get_running_loop().call_later(
+                max(0, delay), self._release, lane, peer
+            )
+        if first:
+            parked.appendleft(item)
+        else:
+            parked.append(item)
+
+    def _release(self, lane: str, peer) -> None:
+        parked = self._parked.pop((lane, peer), ())
+        self._lanes[lane].extendleft(reversed(parked))
+        if parked and lane == USER:
+            self._user_idle.clear()
+        self._wakeup[lane].set()
+
+    async def _run(self, lane: str) -> None:
+        queue = self._lanes[lane]
+        while True:
+            if not queue:
+                if lane == USER:
+                    self._user_idle.set()
+                self._wakeup[lane].clear()
+                await self._wakeup[lane].wait()
+                continue
+            if lane == BACKGROUND:
+                await self._user_idle.wait()
+            item = queue.popleft()
+            peer, call, future = item
+            if self._blocked_until.get(peer, 0) > time.monotonic():
+                self._park(lane, peer, item)
+                continue
+            self._blocked_until.pop(peer, None)
+            try:
+                result = await call()
+            except FloodWaitError as e:
+                self.flood_waits += 1
+                log.warning(f"FloodWait of {e.seconds}s for {peer}, holding its messages")
+                self._blocked_until[peer] = time.monotonic() + e.seconds
+                self._park(lane, peer, item, first=True)
+            except Exception as e:
+                log.error(f"Outbound message to {peer} failed: {e}")
+                if future and not future.done():
+                    future.set_exception(e)
+            else:
+                if future and not future.done():
+                    future.set_result(result)
+
+outbox = Outbox()
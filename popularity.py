@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+
+from telethon import TelegramClient
+
+from edit_scheduler import edit_scheduler
+from probe import probe_data
+from redis_db import db
+from send_media import VideoSender, running_jobs
+from terabox import get_data
+from tracing import start_job
+
+log = logging.getLogger(__name__)
+
+SCORE_KEY = "popularity"
+PLAY_SCORE_KEY = "popularity_play"
+URLS_KEY = "popularity_urls"
+EPOCH_KEY = "popularity_epoch"
+# A request counts half as much after a day.
+HALF_LIFE = 24 * 60 * 60
+# Scores are 2 ** (age / HALF_LIFE), rebased before they get near float limits.
+MAX_EXPONENT = 256
+HLL_TTL = 8 * 24 * 60 * 60
+
+PREWARM_INTERVAL = 60
+# Pre-warm only while fewer jobs than this are running.
+PREWARM_FREE_SLOTS = 2
+PREWARM_TOP = 20
+PREWARM_MAX_BYTES = 500 * 1024 * 1024
+PREWARM_RETRY_AFTER = 6 * 60 * 60
+
+
+def _epoch() -> float:
+    value = db.redis.get(EPOCH_KEY)
+    if value is None:
+        value = time.time()
+        db.redis.set(EPOCH_KEY, value)
+    return float(value)
+
+
+def _rebase(epoch: float, now: float) -> float:
+    """Move the epoch to now and scale every score down to match"""
+    factor = 2 ** (-(now - epoch) / HALF_LIFE)
+    pipe = db.redis.pipeline()
+    for key in (SCORE_KEY, PLAY_SCORE_KEY):
+        pipe.zunionstore(key, {key: factor})
+    pipe.set(EPOCH_KEY, now)
+    pipe.execute()
+    return now
+
+
+def _day(ts: float = None) -> str:
+    return datetime.fromtimestamp(ts or time.time(), timezone.utc).strftime("%Y%m%d")
+
+
+def record_request(code: str, url: str, user_id: int, mode: str) -> None:
+    """
+    Count a request for a share code.
+
+    Args:
+        code (str): The share code.
+        url (str): The link it was requested with, kept for pre-warming.
+        user_id (int): The requesting user, counted once per day.
+        mode (str): "play" or "download".
+    """
+    try:
+        now = time.time()
+        epoch = _epoch()
+        if (now - epoch) / HALF_LIFE > MAX_EXPONENT:
+            epoch = _rebase(epoch, now)
+        weight = 2 ** ((now - epoch) / HALF_LIFE)
+        day = _day(now)
+        pipe = db.redis.pipeline()
+        pipe.zincrby(SCORE_KEY, weight, code)
+        if mode == "play":
+            pipe.zincrby(PLAY_SCORE_KEY, weight, code)
+        pipe.hset(URLS_KEY, code, url)
+        pipe.pfadd(f"requesters_{code}_{day}", user_id)
+        pipe.expire(f"requesters_{code}_{day}", HLL_TTL)
+        pipe.pfadd(f"requesters_{day}", user_id)
+        pipe.expire(f"requesters_{day}", HLL_TTL)
+        pipe.execute()
+    except Exception as e:
+        log.error(f"Error recording request for {code}: {e}")
+
+
+def unique_requesters(code: str = None, day: str = None) -> int:
+    """Approximate distinct users of a share code, or of the bot, on a UTC day"""
+    key = f"requesters_{code}_{day or _day()}" if code else f"requesters_{day or _day()}"
+    return db.redis.pfcount(key)
+
+
+def top_codes(n: int = 10, play_only: bool = False) -> list[tuple[str, float]]:
+    """The hottest share codes with their score in requests as of now"""
+    key = PLAY_SCORE_KEY if play_only else SCORE_KEY
+    scale = 2 ** (-(time.time() - _epoch()) / HALF_LIFE)
+    return [(code, score * scale) for code, score in db.redis.zrevrange(key, 0, n - 1, withscores=True)]
+
+
+class Prewarmer:
+    """
+    Fetches and stores the hottest uncached play-mode codes while the bot
+    has free slots, so the first download-mode request is a cache hit.
+    """
+
+    def __init__(self, interval: float = PREWARM_INTERVAL, free_slots: int = PREWARM_FREE_SLOTS):
+        self.interval = interval
+        self.free_slots = free_slots
+        self.warmed = 0
+
+    def _candidates(self, running) -> list[str]:
+        codes = []
+        for code, _ in top_codes(PREWARM_TOP, play_only=True):
+            if code in running or db.get(code) or db.redis.exists(f"prewarm_failed_{code}"):
+                continue
+            codes.append(code)
+        return codes
+
+    async def warm(self, client: TelegramClient, code: str) -> bool:
+        start_job()
+        url = db.redis.hget(URLS_KEY, code)
+        data = url and await get_data(url)
+        if data:
+            data = await probe_data(data)
+        if not data or not data.get("direct_link"):
+            return False
+        if int(data.get("sizebytes") or 0) > PREWARM_MAX_BYTES:
+            return False
+        log.info(f"Pre-warming {code}")
+        return await VideoSender(client, None, None, url, data).prewarm(code)
+
+    async def run(self, client: TelegramClient) -> None:
+        """Pre-warm one code at a time for as long as the bot runs"""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                if len(running_jobs()) >= self.free_slots or edit_scheduler.pending:
+                    continue
+                candidates = self._candidates(running_jobs())
+                if not candidates:
+                    continue
+                code = candidates[0]
+            except Exception as e:
+                log.error(f"Error picking a code to pre-warm: {e}")
+                continue
+            try:
+                warmed = await self.warm(client, code)
+            except Exception as e:
+                log.error(f"Pre-warming {code} failed: {e}")
+                warmed = False
+            if warmed:
+                self.warmed += 1
+            else:
+                db.redis.set(f"prewarm_failed_{code}", 1, ex=PREWARM_RETRY_AFTER)
+
+
+prewarmer = Prewarmer()
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import aiohttp
+
+from http_client import http
+from tools import get_formatted_size
+from tracing import traced
+
+log = logging.getLogger(__name__)
+
+DIRECT = "direct"  # Telegram fetches the URL itself
+SEGMENTED = "segmented"  # parallel Range requests into a preallocated file
+STREAM = "stream"  # one sequential GET
+
+# Telegram only pulls small files from an URL on its own.
+DIRECT_SEND_LIMIT = 20 * 1024 * 1024
+# Below this a single stream is as fast as splitting it up.
+SEGMENTED_MIN_SIZE = 16 * 1024 * 1024
+
+CACHE_TTL = 600
+CACHE_SIZE = 512
+
+
+@dataclass
+class LinkInfo:
+    url: str
+    ok: bool = False
+    status: int = 0
+    size: int = 0
+    content_type: str = ""
+    etag: str = ""
+    last_modified: str = ""
+    accept_ranges: bool = False
+    error: str = ""
+    probed_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def validator(self) -> str:
+        """Strong enough identity of the remote file, if the server gave one"""
+        if self.etag:
+            return self.etag.strip('"')
+        if self.last_modified and self.size:
+            return f"{self.size}-{self.last_modified}"
+        return ""
+
+
+_cache: "OrderedDict[str, LinkInfo]" = OrderedDict()
+
+
+def _cached(url: str) -> LinkInfo | None:
+    info = _cache.get(url)
+    if info and time.monotonic() - info.probed_at < CACHE_TTL:
+        _cache.move_to_end(url)
+        return info
+    _cache.pop(url, None)
+    return None
+
+
+def _remember(info: LinkInfo) -> None:
+    _cache[info.url] = info
+    _cache.move_to_end(info.url)
+    while len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+
+
+async def probe_link(
+    url: str, session: aiohttp.ClientSession, timeout: float = 15
+) -> LinkInfo:
+    """
+    Asks for the first byte of `url` to learn its size, type and validators.
+
+    Args:
+        url (str): The download link.
+        session (aiohttp.ClientSession): Session to send the request with.
+        timeout (float): Seconds to wait for the response headers.
+
+    Returns:
+        LinkInfo: What the server told about the file, `ok` is False on failure.
+    """
+    if info := _cached(url):
+        return info
+    info = LinkInfo(url=url)
+    try:
+        async with session.get(
+            url,
+            headers={"Range": "bytes=0-0"},
+            timeout=aiohttp.ClientTimeout(total=timeout),
+        ) as response:
+            info.status = response.status
+            headers = response.headers
+            info.content_type = headers.get("Content-Type", "").split(";")[0].strip()
+            info.etag = headers.get("ETag", "")
+            info.last_modified = headers.get("Last-Modified", "")
+            if response.status == 206:
+                match = re.search(r"/(\d+)$", headers.get("Content-Range", ""))
+                info.size = int(match.group(1)) if match else 0
+                info.accept_ranges = True
+                info.ok = True
+            elif response.status == 200:
+                info.size = int(headers.get("Content-Length", 0))
+                info.accept_ranges = headers.get("Accept-Ranges", "") == "bytes"
+                info.ok = True
+            else:
+                info.error = f"HTTP {response.status}: {response.reason}"
+    except Exception as e:
+        info.error = str(e) or type(e).__name__
+    if info.ok:
+        _remember(info)
+    else:
+        # Not cached, a transient failure must not mark the link dead for retries
+        log.warning(f"Probe failed for {url[:80]}: {info.error}")
+    return info
+
+
+async def probe_links(urls: list[str]) -> list[LinkInfo]:
+    """Probe all links concurrently, results are in the order of `urls`"""
+    return await asyncio.gather(*[probe_link(url, http.session) for url in urls])
+
+
+def choose_strategy(info: LinkInfo) -> str:
+    """Pick how to move the file behind `info` into Telegram"""
+    if (
+        info.size
+        and info.size <= DIRECT_SEND_LIMIT
+        and info.content_type.startswith("video/")
+    ):
+        return DIRECT
+    if info.accept_ranges and info.size >= SEGMENTED_MIN_SIZE:
+        return SEGMENTED
+    return STREAM
+
+
+@traced("probe")
+async def probe_data(data: dict) -> dict:
+    """
+    Probes every candidate link of a `get_data` result and fills in the facts
+    the API doesn't return. Links that failed the probe are moved to the end.
+    """
+    links = [data["direct_link"], *data.get("backup_links", [])]
+    links = list(dict.fromkeys(link for link in links if link))
+    if not links:
+        return data
+    infos = await probe_links(links)
+    infos.sort(key=lambda info: not info.ok)
+    data["probes"] = {info.url: info for info in infos}
+    data["direct_link"] = infos[0].url
+    data["backup_links"] = [info.url for info in infos[1:]]
+    best = infos[0]
+    if best.ok:
+        data["sizebytes"] = best.size
+        data["size"] = get_formatted_size(best.size)
+        data["content_type"] = best.content_type
+        data["etag"] = best.etag
+        data["accept_ranges"] = best.accept_ranges
+    data["strategy"] = choose_strategy(best)
+    return data
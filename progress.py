@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class ProgressSnapshot:
+    current: int
+    total: int
+    state: str
+    speed: float
+    eta: float
+    elapsed: float
+
+
+class TransferProgress:
+    """
+    Counters written by the data path.
+
+    Updating is a couple of attribute stores so downloads and uploads can call
+    it on every chunk; nothing here awaits or touches the network.
+    """
+
+    __slots__ = ("current", "total", "state")
+
+    def __init__(self, state: str = "Sending"):
+        self.current = 0
+        self.total = 0
+        self.state = state
+
+    def update(self, current: int, total: int, state: str = None) -> None:
+        self.current = current
+        self.total = total
+        if state:
+            self.state = state
+
+    def callback(self, state: str) -> Callable[[int, int], None]:
+        """Return a `progress_callback(current, total)` that reports as `state`"""
+
+        def update(current: int, total: int) -> None:
+            self.update(current, total, state)
+
+        return update
+
+
+class ProgressTicker:
+    """
+    Samples a TransferProgress on its own task, smooths the speed with an
+    EWMA and hands snapshots to `publish`, so a slow publish never stalls the
+    transfer it reports on.
+    """
+
+    def __init__(
+        self,
+        progress: TransferProgress,
+        publish: Callable[[ProgressSnapshot], Awaitable[None]],
+        interval: float = 2.0,
+        alpha: float = 0.3,
+    ):
+        self.progress = progress
+        self.publish = publish
+        self.interval = interval
+        self.alpha = alpha
+        self.speed = 0.0
+        self._task = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        started = time.monotonic()
+        last_time, last_bytes, last_state = started, 0, self.progress.state
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            current, total, state = (
+                self.progress.current,
+                self.progress.total,
+                self.progress.state,
+            )
+            if state != last_state or current < last_bytes:
+                # A new stage restarts the counters, so does the smoothing.
+                self.speed, last_bytes, last_state = 0.0, 0, state
+            sample = (current - last_bytes) / (now - last_time)
+            self.speed = (
+                sample
+                if self.speed == 0
+                else self.alpha * sample + (1 - self.alpha) * self.speed
+            )
+            last_time, last_bytes = now, current
+            if not current:
+                continue
+            eta = (total - current) / self.speed if self.speed > 0 and total else 0
+            try:
+                await self.publish(
+                    ProgressSnapshot(
+                        current, total, state, self.speed, eta, now - started
+                    )
+                )
+            except Exception as e:
+                log.debug(f"Progress publish failed: {e}")
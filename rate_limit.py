@@ -0,0 +1,72 @@
+import logging
+
+from config import ADMINS, RATE_LIMITS
+from redis_db import db
+
+log = logging.getLogger(__name__)
+
+# Token bucket evaluated server side so that the read, refill and write happen
+# in a single round trip and concurrent requests can't race each other.
+#
+# KEYS[1] bucket key
+# ARGV[1] capacity (burst), ARGV[2] seconds to refill one token, ARGV[3] cost
+# Returns the seconds to wait before the cost can be paid, "0" when allowed.
+TOKEN_BUCKET_LUA = """
+local capacity = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) / interval)
+local wait = 0
+if tokens >= cost then
+    tokens = math.min(capacity, tokens - cost)
+else
+    wait = (cost - tokens) * interval
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity * interval) + 1)
+return tostring(wait)
+"""
+
+
+class RateLimiter:
+    def __init__(self, limits: dict = None, prefix: str = "ratelimit"):
+        self.limits = RATE_LIMITS if limits is None else limits
+        self.prefix = prefix
+        self._script = None
+
+    def role_of(self, user_id: int) -> str:
+        """Return the rate limit role of a user"""
+        return "admin" if user_id in ADMINS else "user"
+
+    def _run(self, user_id: int, role: str, cost: int) -> float:
+        limit = self.limits.get(role or self.role_of(user_id))
+        if not limit:
+            return 0.0
+        capacity, interval = limit
+        if self._script is None:
+            self._script = db.redis.register_script(TOKEN_BUCKET_LUA)
+        try:
+            wait = self._script(
+                keys=[f"{self.prefix}:{user_id}"], args=[capacity, interval, cost]
+            )
+            return float(wait)
+        except Exception as e:
+            # Fail open, a Redis hiccup shouldn't lock every user out.
+            log.error(f"Rate limit check failed for {user_id}: {e}")
+            return 0.0
+
+    def hit(self, user_id: int, role: str = None) -> float:
+        """Take one token for the user, returns seconds to wait or 0 when allowed"""
+        return self._run(user_id, role, 1)
+
+    def refund(self, user_id: int, role: str = None) -> None:
+        """Give a token back, used when a request failed through no fault of the user"""
+        self._run(user_id, role, -1)
+
+
+rate_limiter = RateLimiter()
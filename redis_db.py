@@ -5,7 +5,8 @@ import threading
 import typing
 from typing import Any
 import time
-from config import REDIS_PUBLIC_URL
+from collections import OrderedDict
+from config import REDIS_CACHE_SIZE, REDIS_PUBLIC_URL
 
 from redis import Redis as r
 
@@ -37,7 +38,9 @@ class RedisConnection:
                     raise ConnectionError("Redis ping failed")
                     
                 log.info("Redis connection successful!")
-                self._cache = {}
+                self._cache = OrderedDict()
+                self.hits = 0
+                self.misses = 0
                 
                 # Start cache initialization in background
                 self._cache_initialized = threading.Event()
@@ -60,22 +63,34 @@ class RedisConnection:
     def _init_cache(self):
         """Initialize cache in background thread"""
         try:
-            keys = self.redis.keys()
-            for key in keys:
-                self._cache[key] = self.redis.get(key)
+            # Only warm up to the cache size, the rest is read on demand
+            for key in self.redis.scan_iter(count=1000):
+                self._remember(key, self.redis.get(key))
+                if len(self._cache) >= REDIS_CACHE_SIZE:
+                    break
             log.info(f"Successfully cached {len(self._cache)} keys")
         except Exception as e:
             log.error(f"Error initializing cache: {e}")
         finally:
             self._cache_initialized.set()
 
+    def _remember(self, key: str, value: Any) -> None:
+        """Cache a value, dropping the least recently used key past the size"""
+        self._cache[key] = value
+        self._cache.move_to_end(key)
+        while len(self._cache) > REDIS_CACHE_SIZE:
+            self._cache.popitem(last=False)
+
     def get(self, key: str) -> Any:
         """Get a value from cache or Redis"""
         try:
             if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
                 return self._cache[key]
+            self.misses += 1
             value = self.redis.get(key)
-            self._cache[key] = value
+            self._remember(key, value)
             return value
         except Exception as e:
             log.error(f"Error getting key {key}: {e}")
@@ -84,7 +99,7 @@ class RedisConnection:
     def set(self, key: str, value: Any, ex: int = None) -> bool:
         """Set a value in both cache and Redis"""
         try:
-            self._cache[key] = value
+            self._remember(key, value)
             return self.redis.set(key, value, ex=ex)
         except Exception as e:
             log.error(f"Error setting key {key}: {e}")
@@ -100,6 +115,23 @@ class RedisConnection:
             log.error(f"Error deleting key {key}: {e}")
             return False
 
+    def incr(self, key: str, amount: int = 1) -> int:
+        """Increment a counter in Redis and keep the cache in step"""
+        try:
+            value = self.redis.incr(key, amount)
+            self._remember(key, str(value))
+            return value
+        except Exception as e:
+            log.error(f"Error incrementing key {key}: {e}")
+            return 0
+
+    def cache_size(self) -> int:
+        return len(self._cache)
+
+    def get_key(self, key: str) -> Any:
+        """Get a value (alias for get method)"""
+        return self.get(key)
+
     def set_key(self, key: str, value: Any) -> bool:
         """Set a key-value pair in Redis (alias for set method)"""
         return self.set(key, value)
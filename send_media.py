@@ -13,23 +13,77 @@ from telethon.events.newmessage import NewMessage
 from telethon.tl.functions.channels import GetMessagesRequest
 from telethon.tl.functions.messages import ForwardMessagesRequest
 from telethon.tl.patched import Message
-from telethon.tl.types import Document
+from telethon.tl.types import Document, DocumentAttributeFilename
 from telethon.types import UpdateEditMessage
 
-from cansend import CanSend
-from config import BOT_USERNAME, PRIVATE_CHAT_ID,FORCE_LINK
+from cache_verifier import forget_document, get_document
+from chunk_store import chunk_store, link_or_copy
+from config import (
+    BOT_USERNAME,
+    FASTSTART,
+    FORCE_LINK,
+    PRIVATE_CHAT_ID,
+    TELEGRAM_FILE_LIMIT,
+)
+from edit_scheduler import edit_scheduler
+import fingerprint
+from faststart import faststart
+from fingerprint import fingerprint_data, fingerprint_file
 from FastTelethon import upload_file
+from media_info import FileReader, get_metadata, read_metadata
+from memory import estimate_job, memory_governor
+from metrics import record_transfer
+from mirrors import host_of, order_mirrors, record_throughput
+from outbox import outbox
+from probe import DIRECT, SEGMENTED, choose_strategy
+from progress import ProgressSnapshot, ProgressTicker, TransferProgress
 from redis_db import db
+from splitter import remove_parts, split_file
+from thumbnail import get_thumbnail
+from tracing import span, traced
 from tools import (
     convert_seconds,
     download_file,
-    download_image_to_bytesio,
+    download_file_segmented,
     extract_code_from_url,
     get_formatted_size,
 )
+from workspace import workspace
 
 logger = logging.getLogger(__name__)
 
+# Parts of a split file uploaded at the same time, and Telegram's album limit
+SPLIT_UPLOAD_CONCURRENCY = 3
+ALBUM_SIZE = 10
+
+# Disk reserved for a job whose file size the probe couldn't tell
+UNKNOWN_SIZE_RESERVATION = 512 * 1024 * 1024
+
+# Share codes being fetched right now, with the (message, status message)
+# of every later request for the same code waiting on that upload
+_inflight: dict[str, list[tuple[Message, Message]]] = {}
+
+
+def running_jobs() -> set[str]:
+    """Share codes with a fetch in progress"""
+    return set(_inflight)
+
+
+async def send_album(client: TelegramClient, chat, stored: list, reply_to=None) -> list:
+    """Send the parts of a split file by reference, as the albums they were stored as"""
+    sent = []
+    for i in range(0, len(stored), ALBUM_SIZE):
+        batch = stored[i : i + ALBUM_SIZE]
+        result = await client.send_file(
+            chat,
+            file=[m.media for m in batch],
+            caption=[m.message for m in batch],
+            parse_mode=None,
+            reply_to=reply_to,
+        )
+        sent.extend(result if isinstance(result, list) else [result])
+    return sent
+
 class VideoSender:
 
     def __init__(
@@ -48,23 +102,33 @@ class VideoSender:
         self.uuid = str(uuid4())
         self.stop_sending = False
         self.thumbnail = None
-        self.can_send = CanSend()
+        self.thumb_task = None
+        self.meta = None
+        self.meta_task = None
+        self.attributes = None
+        self.fingerprint = None
+        self.job = None
+        self.path = None
+        self.reservation = None
         self.start_time = time.time()
         self.task = None
+        self.progress = TransferProgress()
+        self.ticker = ProgressTicker(self.progress, self.progress_bar)
         self.client.add_event_handler(
             self.stop, events.CallbackQuery(pattern=f"^stop{self.uuid}")
         )
         
         # Extract play URL once during initialization
         url_code = extract_code_from_url(self.url)
+        self.shorturl = url_code
         if url_code:
             self.play_url = f"https://t.me/MyTbox4ubot/mybotbest?startapp={url_code}"
         else:
             self.play_url = None
         
-        # Simplified caption since we don't have size information
+        size_line = f"\nSize: **{self.data['size']}**" if self.data.get("sizebytes") else ""
         self.caption = f"""
-File: `{self.data['file_name']}`
+File: `{self.data['file_name']}`{size_line}
 
 @itsurboydean
         """
@@ -74,31 +138,22 @@ Downloading `{self.data['file_name']}`
 @itsurboydean
         """
 
-    async def progress_bar(self, current_downloaded, total_downloaded, state="Sending"):
-        if not self.can_send.can_send():
+    async def progress_bar(self, snapshot: ProgressSnapshot):
+        if not self.edit_message:
             return
-
         bar_length = 20
-        percent = current_downloaded / total_downloaded
+        percent = snapshot.current / snapshot.total if snapshot.total else 0
         arrow = "█" * int(percent * bar_length)
         spaces = "░" * (bar_length - len(arrow))
 
-        elapsed_time = time.time() - self.start_time
-
-        head_text = f"{state} `{self.data['file_name']}`"
+        head_text = f"{snapshot.state} `{self.data['file_name']}`"
         progress_bar = f"[{arrow + spaces}] {percent:.2%}"
-        upload_speed = current_downloaded / elapsed_time if elapsed_time > 0 else 0
-        speed_line = f"Speed: **{get_formatted_size(upload_speed)}/s**"
-
-        time_remaining = (
-            (total_downloaded - current_downloaded) / upload_speed
-            if upload_speed > 0
-            else 0
-        )
-        time_line = f"Time Remaining: `{convert_seconds(time_remaining)}`"
-        size_line = f"Size: **{get_formatted_size(current_downloaded)}** / **{get_formatted_size(total_downloaded)}**"
+        speed_line = f"Speed: **{get_formatted_size(snapshot.speed)}/s**"
+        time_line = f"Time Remaining: `{convert_seconds(snapshot.eta)}`"
+        size_line = f"Size: **{get_formatted_size(snapshot.current)}** / **{get_formatted_size(snapshot.total)}**"
 
-        await self.edit_message.edit(
+        edit_scheduler.submit(
+            self.edit_message,
             f"{head_text}\n{progress_bar}\n{speed_line}\n{time_line}\n{size_line}",
             parse_mode="markdown",
             buttons=[
@@ -108,21 +163,49 @@ Downloading `{self.data['file_name']}`
         )
 
     async def send_media(self, shorturl):
+        self.ticker.start()
+        try:
+            return await self._send_media(shorturl)
+        finally:
+            with span("cleanup"):
+                await self.ticker.stop()
+                workspace.release(self.job)
+                memory_governor.release(self.reservation)
+                # Whoever is still waiting was not served by this job
+                for _, edit_message in _inflight.pop(shorturl, []):
+                    await self._notify_failed(edit_message)
+
+    async def _send_media(self, shorturl):
         max_retries = 3
         retry_count = 0
+
+        # Start on the mirror with the best early throughput
+        try:
+            await order_mirrors(self.data)
+        except Exception as e:
+            logger.warning(f"Mirror race failed, keeping link order: {e}")
+
+        # The same content reshared under another code is served from storage
+        self.fingerprint = await fingerprint_data(self.data)
+        if self.fingerprint and await self._forward_known(shorturl):
+            return
         
         while retry_count < max_retries:
             try:
                 logger.info(f"Attempt {retry_count + 1}/{max_retries} to send media: {self.data['file_name']}")
-                self.thumbnail.seek(0) if self.thumbnail else None
+                await self._thumbnail_ready()
+                await self._metadata_ready()
                 
-                # Try direct media send first
-                try:
-                    file = await self._try_direct_send()
-                    if file:
-                        return await self.save_forward_file(file, shorturl)
-                except Exception as e:
-                    logger.warning(f"Direct send failed: {e}")
+                # Try direct media send first when the probe says it can work,
+                # a file that needs the faststart rewrite has to go through us
+                needs_faststart = FASTSTART and self.meta and self.meta.moov_at_end
+                if self.data.get("strategy", DIRECT) == DIRECT and not needs_faststart:
+                    try:
+                        file = await self._try_direct_send()
+                        if file:
+                            return await self.save_forward_file(file, shorturl)
+                    except Exception as e:
+                        logger.warning(f"Direct send failed: {e}")
                     
                 # Fall back to download and upload
                 file = await self._try_download_and_upload()
@@ -138,6 +221,7 @@ Downloading `{self.data['file_name']}`
                 logger.warning(f"Attempt {retry_count} failed, retrying in 5 seconds...")
                 await asyncio.sleep(5)
 
+    @traced("upload")
     async def _try_direct_send(self):
         """Attempt to send media directly with fallback URLs"""
         errors = []
@@ -147,22 +231,21 @@ Downloading `{self.data['file_name']}`
             spoiler_media = await self.client._file_to_media(
                 self.data["direct_link"],
                 supports_streaming=True,
-                progress_callback=self.progress_bar,
+                progress_callback=self.progress.callback("Sending"),
                 thumb=self.thumbnail,
+                attributes=self.attributes,
             )
             
             file = await self.client.send_file(
-                self.message.chat.id,
+                PRIVATE_CHAT_ID,
                 file=spoiler_media[1],
                 caption=self.caption,
                 allow_cache=True,
                 force_document=False,
                 parse_mode="markdown",
-                reply_to=self.message.id,
                 supports_streaming=True,
                 background=True,
                 upload_timeout=3600,
-                buttons=self._get_buttons()
             )
             return file
         except Exception as e:
@@ -176,22 +259,21 @@ Downloading `{self.data['file_name']}`
                 spoiler_media = await self.client._file_to_media(
                     backup_url,
                     supports_streaming=True,
-                    progress_callback=self.progress_bar,
+                    progress_callback=self.progress.callback("Sending"),
                     thumb=self.thumbnail,
+                    attributes=self.attributes,
                 )
                 
                 file = await self.client.send_file(
-                    self.message.chat.id,
+                    PRIVATE_CHAT_ID,
                     file=spoiler_media[1],
                     caption=self.caption,
                     allow_cache=True,
                     force_document=False,
                     parse_mode="markdown",
-                    reply_to=self.message.id,
                     supports_streaming=True,
                     background=True,
                     upload_timeout=3600,
-                    buttons=self._get_buttons()
                 )
                 return file
             except Exception as e:
@@ -208,15 +290,11 @@ Downloading `{self.data['file_name']}`
         
         # Try primary URL first
         try:
-            path = Path(self.data["file_name"])
+            path = self.path
             if path.exists():
                 path.unlink()
                 
-            await download_file(
-                self.data["direct_link"],
-                self.data["file_name"],
-                self.progress_bar
-            )
+            await self._download(self.data["direct_link"])
             
             if path.exists() and path.stat().st_size > 0:
                 return await self._upload_file(path)
@@ -231,11 +309,7 @@ Downloading `{self.data['file_name']}`
                 if path.exists():
                     path.unlink()
                     
-                await download_file(
-                    backup_url,
-                    self.data["file_name"],
-                    self.progress_bar
-                )
+                await self._download(backup_url)
                 
                 if path.exists() and path.stat().st_size > 0:
                     return await self._upload_file(path)
@@ -247,22 +321,157 @@ Downloading `{self.data['file_name']}`
         # If all URLs failed, raise the last error
         raise Exception(f"All download attempts failed: {'; '.join(errors)}")
 
+    def _store_key(self, info) -> str | None:
+        """Chunk store key of a link: the content fingerprint, else the link's validator"""
+        if self.fingerprint:
+            return f"fp:{self.fingerprint}"
+        if info and info.ok and info.validator:
+            return f"v:{info.validator}"
+        return None
+
+    @traced("download")
+    async def _download(self, url: str):
+        """Download `url` to the job file, through the chunk store when the file has a stable key"""
+        info = self.data.get("probes", {}).get(url)
+        filename = str(self.path)
+        key = self._store_key(info)
+        if key and (stored := chunk_store.get(key)):
+            logger.info(f"Serving {filename} from the chunk store")
+            link_or_copy(stored, filename)
+            size = os.path.getsize(filename)
+            self.progress.update(size, size, "Downloading")
+            return filename
+        size = info.size if info and info.ok else int(self.data.get("sizebytes") or 0)
+        if not key or not chunk_store.fits(size):
+            return await self._fetch(url, info, filename)
+        with chunk_store.using(key):
+            try:
+                await self._fetch(url, info, chunk_store.partial(key), resume=True)
+            finally:
+                # Whatever was fetched stays for the next attempt
+                chunk_store.track_partial(key)
+            link_or_copy(chunk_store.commit(key), filename)
+        return filename
+
+    async def _fetch(self, url: str, info, filename: str, resume: bool = False):
+        """Fetch `url` into `filename`, in segments if the probe allows it"""
+        started = time.monotonic()
+        before = self.progress.current
+        if info and info.ok and choose_strategy(info) == SEGMENTED:
+            result = await download_file_segmented(
+                url, filename, info.size, self.progress, resume=resume
+            )
+        else:
+            if os.path.exists(f"{filename}.state"):
+                # A preallocated segmented partial can't be continued as a stream
+                os.unlink(filename)
+                os.unlink(f"{filename}.state")
+            result = await download_file(
+                url, filename, self.progress, resume=resume and bool(info and info.accept_ranges)
+            )
+        elapsed = time.monotonic() - started
+        await asyncio.to_thread(
+            record_throughput, host_of(url), (self.progress.current - before) / max(elapsed, 1e-6)
+        )
+        record_transfer("download", self.progress.current - before, elapsed)
+        return result
+
+    @traced("upload")
     async def _upload_file(self, path: Path):
         """Helper method to upload a file"""
-        return await self.client.send_file(
-            self.message.chat.id,
+        await self._metadata_ready(path)
+        if not self.fingerprint:
+            # Before faststart, so it matches what a Range fingerprint sees
+            self.fingerprint = await asyncio.to_thread(fingerprint_file, str(path))
+        size = path.stat().st_size
+        if size > TELEGRAM_FILE_LIMIT:
+            started = time.monotonic()
+            messages = await self._upload_split(path)
+            record_transfer("upload", size, time.monotonic() - started)
+            return messages
+        if FASTSTART and self.meta and self.meta.moov_at_end:
+            started = time.monotonic()
+            try:
+                if await asyncio.to_thread(faststart, str(path)):
+                    self.meta.moov_at_end = False
+                    logger.info(
+                        f"Faststart rewrite of {path} took {time.monotonic() - started:.2f}s"
+                    )
+            except Exception as e:
+                logger.warning(f"Faststart rewrite of {path} failed: {e}")
+        started = time.monotonic()
+        message = await self.client.send_file(
+            PRIVATE_CHAT_ID,
             file=str(path),
             caption=self.caption,
             thumb=self.thumbnail,
+            attributes=self.attributes,
             allow_cache=True,
             force_document=False,
             parse_mode="markdown",
-            reply_to=self.message.id,
             supports_streaming=True,
-            progress_callback=self.progress_bar,
+            progress_callback=self.progress.callback("Sending"),
             upload_timeout=3600,
-            buttons=self._get_buttons()
         )
+        record_transfer("upload", size, time.monotonic() - started)
+        return message
+
+    async def _upload_split(self, path: Path):
+        """Split a file over Telegram's limit, upload the parts in parallel and send them as albums"""
+        duration = self.meta.duration if self.meta else 0
+        parts, playable = await split_file(str(path), TELEGRAM_FILE_LIMIT, duration)
+        logger.info(f"Split {path} into {len(parts)} parts (playable={playable})")
+        try:
+            done = [0] * len(parts)
+            total = sum(os.path.getsize(part) for part in parts)
+            limiter = asyncio.Semaphore(SPLIT_UPLOAD_CONCURRENCY)
+
+            async def upload(index: int, part: str):
+                def report(current, _):
+                    done[index] = current
+                    self.progress.update(sum(done), total, "Sending")
+
+                name = os.path.basename(part)
+                async with limiter:
+                    with open(part, "rb") as f:
+                        input_file = await upload_file(
+                            self.client,
+                            f,
+                            report,
+                            name,
+                            connection_count=max(4, 20 // SPLIT_UPLOAD_CONCURRENCY),
+                        )
+                attributes = [DocumentAttributeFilename(name)]
+                if playable:
+                    meta = await read_metadata(FileReader(part))
+                    attributes += meta.attributes() if meta else []
+                _, media, _ = await self.client._file_to_media(
+                    input_file,
+                    attributes=attributes,
+                    force_document=not playable,
+                    supports_streaming=playable,
+                )
+                return media
+
+            media = await asyncio.gather(*[upload(i, p) for i, p in enumerate(parts)])
+        finally:
+            remove_parts(parts)
+
+        note = "" if playable else "\nJoin the parts in order to get the video."
+        captions = [
+            f"{self.caption}\nParts: **{len(parts)}**{note}" if i == 0 else f"Part {i + 1}/{len(parts)}"
+            for i in range(len(parts))
+        ]
+        messages = []
+        for i in range(0, len(media), ALBUM_SIZE):
+            sent = await self.client.send_file(
+                PRIVATE_CHAT_ID,
+                file=media[i : i + ALBUM_SIZE],
+                caption=captions[i : i + ALBUM_SIZE],
+                parse_mode="markdown",
+            )
+            messages.extend(sent if isinstance(sent, list) else [sent])
+        return messages
 
     def _get_buttons(self):
         """Return standard button layout with Play Online button"""
@@ -281,126 +490,283 @@ Downloading `{self.data['file_name']}`
         return buttons
 
     async def handle_failed_download(self):
+        await self._notify_failed(self.edit_message)
+
+    async def _notify_failed(self, edit_message: Message):
+        if not edit_message:
+            return
+        links = [self.data["direct_link"], *self.data.get("backup_links", [])]
+        here = " or ".join(f"[here]({link})" for link in links)
         try:
-            os.unlink(self.data["file_name"])
-        except Exception:
-            pass
-        try:
-            os.unlink(self.download)
-        except Exception:
-            pass
-        try:
-            await self.edit_message.edit(
-                f"Sorry! Download Failed but you can download it from [here]({self.data['direct_link']}) or [here]({self.data['link']}).",
+            await edit_scheduler.edit(
+                edit_message,
+                f"Sorry! Download Failed but you can download it from {here}.",
                 parse_mode="markdown",
-                buttons=[Button.url("Download", data=self.data["direct_link"])],
-                
+                buttons=[Button.url("Download", self.data["direct_link"])],
             )
-        except Exception:
-            pass
+        except Exception as e:
+            logger.warning(f"Could not tell {edit_message.chat_id} the download failed: {e}")
 
+    @traced("forward")
     async def save_forward_file(self, file, shorturl):
-        # Add keys for tracking forwards
-        private_forward_key = f"private_forward_{shorturl}"
-        force_link_key = f"force_link_{shorturl}"
-        
+        """Record the stored upload, deliver it to everyone waiting and mirror it in the background"""
+        # A split upload hands over all its part messages
+        stored = file if isinstance(file, list) else [file]
+        msg_id = stored[0].id
         try:
-            # Handle FORCE_LINK forward first
-            if not db.get(force_link_key):
-                logger.info(f"Forwarding to FORCE_LINK channel: {FORCE_LINK}")
-                force_forwarded = await self.client.forward_messages(
-                    FORCE_LINK,
-                    messages=[file],
-                    from_peer=self.message.chat.id,
-                    background=True
-                )
-                
-                if force_forwarded and force_forwarded[0].id:
-                    db.set(force_link_key, 1)  # Mark as forwarded
-                    logger.info(f"Successfully forwarded to FORCE_LINK channel")
-                else:
-                    logger.error("Failed to forward to FORCE_LINK channel")
-
-            # Handle private storage forward
-            if not db.get(private_forward_key):
-                forwarded_message = await self.client.forward_messages(
-                    PRIVATE_CHAT_ID,
-                    messages=[file],
-                    from_peer=self.message.chat.id,
-                    background=True
-                )
-                
-                if forwarded_message and forwarded_message[0].id:
-                    msg_id = forwarded_message[0].id
-                    # Set all necessary keys
-                    db.set_key(self.uuid, msg_id)
-                    db.set_key(f"mid_{msg_id}", self.uuid)
-                    db.set_key(shorturl, msg_id)
-                    db.set(private_forward_key, 1)
-                    logger.info(f"Successfully forwarded to private storage: {msg_id}")
-
+            db.set_key(self.uuid, msg_id)
+            db.set_key(f"mid_{msg_id}", self.uuid)
+            db.set_key(f"code_{msg_id}", shorturl)
+            db.set_key(shorturl, msg_id)
+            db.set(f"private_forward_{shorturl}", 1)
+            if self.fingerprint:
+                fingerprint.remember(self.fingerprint, msg_id)
+            if len(stored) > 1:
+                part_ids = ",".join(str(m.id) for m in stored)
+                db.set_key(f"parts_{shorturl}", part_ids)
+                db.set_key(f"parts_{msg_id}", part_ids)
+            logger.info(f"Stored {shorturl} as message {msg_id}")
         except Exception as e:
-            logger.error(f"Error in forwarding: {str(e)}\n{traceback.format_exc()}")
-        
+            logger.error(f"Error recording {shorturl}: {str(e)}\n{traceback.format_exc()}")
+
+        # The requester and everyone who asked meanwhile get the stored file at once
+        waiters = _inflight.pop(shorturl, [])
+        if self.message:
+            waiters.insert(0, (self.message, self.edit_message))
+        results = await asyncio.gather(
+            *[self._deliver(stored, m, hm) for m, hm in waiters], return_exceptions=True
+        )
+        for (m, _), result in zip(waiters, results):
+            if isinstance(result, Exception):
+                logger.error(f"Delivering {shorturl} to {m.chat_id} failed: {result}")
+
+        force_link_key = f"force_link_{shorturl}"
+        if not db.get(force_link_key):
+
+            async def mirror():
+                await self._send_stored(FORCE_LINK, stored)
+                db.set(force_link_key, 1)
+
+            outbox.post_call(FORCE_LINK, mirror)
+
         # Cleanup
         self.client.remove_event_handler(
             self.stop, events.CallbackQuery(pattern=f"^stop{self.uuid}")
         )
+
+    async def _send_stored(self, chat, stored: list, reply_to=None, buttons=None):
+        """Send stored messages by reference, no upload involved"""
+        if len(stored) > 1:
+            return await send_album(self.client, chat, stored, reply_to)
+        return await self.client.send_file(
+            chat,
+            file=stored[0].media,
+            caption=self.caption,
+            force_document=False,
+            parse_mode="markdown",
+            reply_to=reply_to,
+            supports_streaming=True,
+            buttons=buttons,
+        )
+
+    async def _deliver(self, stored: list, message: Message, edit_message: Message):
+        """Hand the stored file to one requester in place of their status message"""
+        edit_scheduler.discard(edit_message)
         try:
-            await self.edit_message.delete()
-        except Exception:
-            pass
-        try:
-            os.unlink(self.data["file_name"])
-        except Exception:
-            pass
-        try:
-            os.unlink(self.download)
+            await edit_message.delete()
         except Exception:
             pass
-        
-        db.set(self.message.sender_id, time.monotonic(), ex=60)
+        await self._send_stored(
+            message.chat_id, stored, reply_to=message.id, buttons=self._get_buttons()
+        )
+
+    async def _forward_known(self, shorturl) -> bool:
+        """Serve content already in storage under another code, mapping this code to it"""
+        msg_id = fingerprint.lookup(self.fingerprint)
+        if not msg_id:
+            return False
+        uid = db.get(f"mid_{msg_id}")
+        if self.message and not await self.forward_file(
+            self.client, msg_id, self.message, self.edit_message, uid
+        ):
+            # The stored message is gone, upload it again
+            fingerprint.forget(self.fingerprint)
+            return False
+        logger.info(f"{shorturl} matches stored message {msg_id} by content")
+        await asyncio.gather(
+            *[
+                self.forward_file(self.client, msg_id, m, hm, uid)
+                for m, hm in _inflight.pop(shorturl, [])
+            ]
+        )
+        db.set_key(shorturl, msg_id)
+        if part_ids := db.get(f"parts_{msg_id}"):
+            db.set_key(f"parts_{shorturl}", part_ids)
+        self.client.remove_event_handler(
+            self.stop, events.CallbackQuery(pattern=f"^stop{self.uuid}")
+        )
+        return True
 
     async def send_video(self):
-        self.thumbnail = download_image_to_bytesio(self.data["thumb"], "thumbnail.png")
         shorturl = extract_code_from_url(self.url)
         if not shorturl:
             return await self.edit_message.edit("Seems like your link is invalid.")
-
+        if shorturl in _inflight:
+            # Another request is fetching this file, it gets sent here when stored
+            _inflight[shorturl].append((self.message, self.edit_message))
+            self.client.remove_event_handler(
+                self.stop, events.CallbackQuery(pattern=f"^stop{self.uuid}")
+            )
+            try:
+                await edit_scheduler.edit(
+                    self.edit_message,
+                    f"`{self.data['file_name']}` is already being fetched, it will be sent here when ready.",
+                    parse_mode="markdown",
+                )
+            except Exception:
+                pass
+            return
+        _inflight[shorturl] = []
+        # Until send_media takes the job over, everything taken here is ours to give back
+        started = False
         try:
-            if self.edit_message:
-                await self.edit_message.delete()
-        except Exception as e:
-            pass
-        db.set(self.message.sender_id, time.monotonic(), ex=60)
-        self.edit_message = await self.message.reply(
-            self.caption2, file=self.thumbnail, parse_mode="markdown"
+            if not self._admit():
+                return await edit_scheduler.edit(
+                    self.edit_message,
+                    "The bot is busy with other downloads right now, please try again in a few minutes.",
+                )
+
+            async def queued():
+                await edit_scheduler.edit(
+                    self.edit_message,
+                    f"`{self.data['file_name']}` is queued, the bot is short on memory right now.",
+                    parse_mode="markdown",
+                )
+
+            self.reservation = await memory_governor.acquire(estimate_job(), on_queued=queued)
+            if not self.reservation:
+                return await edit_scheduler.edit(
+                    self.edit_message,
+                    "The bot is busy with other downloads right now, please try again in a few minutes.",
+                )
+            self.thumb_task = asyncio.create_task(get_thumbnail(shorturl, self.data))
+            self.meta_task = asyncio.create_task(
+                get_metadata(
+                    shorturl,
+                    url=self.data["direct_link"],
+                    size=self.data.get("sizebytes", 0),
+                )
+            )
+
+            try:
+                if self.edit_message:
+                    edit_scheduler.discard(self.edit_message)
+                    await self.edit_message.delete()
+            except Exception as e:
+                pass
+            self.edit_message = await self.message.reply(
+                self.caption2, file=self.thumbnail, parse_mode="markdown"
+            )
+            self.task = asyncio.create_task(self.send_media(shorturl))
+            started = True
+        finally:
+            if not started:
+                await self._abandon(shorturl)
+
+    async def _abandon(self, shorturl):
+        """Give back what send_video took for a job that never started"""
+        workspace.release(self.job)
+        memory_governor.release(self.reservation)
+        for task in (self.thumb_task, self.meta_task):
+            if task:
+                task.cancel()
+        self.client.remove_event_handler(
+            self.stop, events.CallbackQuery(pattern=f"^stop{self.uuid}")
+        )
+        for _, edit_message in _inflight.pop(shorturl, []):
+            await self._notify_failed(edit_message)
+
+    def _admit(self) -> bool:
+        """Get a job directory with room for the download and a rewritten copy of it"""
+        size = int(self.data.get("sizebytes") or 0) or UNKNOWN_SIZE_RESERVATION
+        self.job = workspace.admit(2 * size)
+        if not self.job:
+            logger.warning(f"No disk quota left for {self.data['file_name']} ({size} bytes)")
+            return False
+        self.path = Path(self.job.file(self.data["file_name"]))
+        return True
+
+    async def prewarm(self, shorturl) -> bool:
+        """Fetch and store a file before anyone asks for it in download mode"""
+        if shorturl in _inflight:
+            return False
+        self.client.remove_event_handler(
+            self.stop, events.CallbackQuery(pattern=f"^stop{self.uuid}")
+        )
+        # Prewarming only uses memory nobody is waiting for
+        self.reservation = memory_governor.try_acquire(estimate_job())
+        if not self.reservation:
+            return False
+        if not self._admit():
+            memory_governor.release(self.reservation)
+            return False
+        _inflight[shorturl] = []
+        self.thumb_task = asyncio.create_task(get_thumbnail(shorturl, self.data))
+        self.meta_task = asyncio.create_task(
+            get_metadata(
+                shorturl,
+                url=self.data["direct_link"],
+                size=self.data.get("sizebytes", 0),
+            )
         )
-        self.task = asyncio.create_task(self.send_media(shorturl))
+        await self.send_media(shorturl)
+        return bool(db.get(shorturl))
 
     async def stop(self, event):
         self.task.cancel()
+        if self.thumb_task:
+            self.thumb_task.cancel()
+        if self.meta_task:
+            self.meta_task.cancel()
         self.client.remove_event_handler(
             self.stop, events.CallbackQuery(pattern=f"^stop{self.uuid}")
         )
         await event.answer("Process stopped.")
-        try:
-            os.unlink(self.data["file_name"])
-        except Exception:
-            pass
-        try:
-            os.unlink(self.download)
-        except Exception:
-            pass
+        edit_scheduler.discard(self.edit_message)
         try:
             await self.edit_message.delete()
         except Exception:
             pass
 
-    def get_thumbnail(self):
-        return download_image_to_bytesio(self.data["thumb"], "thumbnail.png")
+    async def _thumbnail_ready(self, timeout: float = 10):
+        """Wait a bit for the thumbnail task, never hold the transfer for it"""
+        if self.thumbnail is None and self.thumb_task:
+            try:
+                self.thumbnail = await asyncio.wait_for(
+                    asyncio.shield(self.thumb_task), timeout
+                )
+            except Exception as e:
+                logger.warning(f"Thumbnail not ready: {e}")
+        if self.thumbnail:
+            self.thumbnail.seek(0)
+
+    async def _metadata_ready(self, path: Path = None, timeout: float = 10):
+        """Pick up the video attributes, from the local file if the CDN read failed"""
+        if self.meta is None and self.meta_task:
+            try:
+                self.meta = await asyncio.wait_for(asyncio.shield(self.meta_task), timeout)
+            except Exception as e:
+                logger.warning(f"Metadata not ready: {e}")
+        # A CDN read that found no moov knows neither duration nor size
+        if path and (self.meta is None or not self.meta.duration):
+            self.meta = await get_metadata(self.shorturl, path=str(path)) or self.meta
+        if self.meta:
+            self.attributes = self.meta.attributes() or None
+            if self.meta.moov_at_end:
+                logger.info(f"{self.data['file_name']} has its moov atom at the end")
 
     @staticmethod
+    @traced("forward")
     async def forward_file(
         client: TelegramClient,
         file_id: int,
@@ -409,22 +775,41 @@ Downloading `{self.data['file_name']}`
         uid: str = None,
     ):
         if edit_message:
+            edit_scheduler.discard(edit_message)
             try:
                 await edit_message.delete()
             except Exception:
                 pass
-        result = await client(
-            GetMessagesRequest(channel=PRIVATE_CHAT_ID, id=[int(file_id)])
-        )
-        msg: Message = result.messages[0] if result and result.messages else None
-        if not msg:
+        part_ids = db.get(f"parts_{file_id}")
+        # The verifier keeps a fresh reference, which saves fetching the message
+        ref = None if part_ids else get_document(file_id)
+        if ref:
+            media, text = ref
+            if await VideoSender._reply_stored(client, message, media, text, uid):
+                return True
+            forget_document(file_id)
+        ids = [int(i) for i in part_ids.split(",")] if part_ids else [int(file_id)]
+        result = await client(GetMessagesRequest(channel=PRIVATE_CHAT_ID, id=ids))
+        messages = [m for m in (result.messages if result else []) if getattr(m, "media", None)]
+        if not messages or len(messages) < len(ids):
             return False
+        if len(messages) > 1:
+            try:
+                await send_album(client, message.chat_id, messages, reply_to=message.id)
+                return True
+            except Exception:
+                return False
+        msg: Message = messages[0]
         media: Document = (
             msg.media.document if hasattr(msg, "media") and msg.media.document else None
         )
+        return await VideoSender._reply_stored(client, message, media, msg.message, uid)
+
+    @staticmethod
+    async def _reply_stored(client: TelegramClient, message: Message, media, text: str, uid: str):
         try:
             await message.reply(
-                message=msg.message,
+                message=text,
                 file=media,
                 # entity=msg.entities,
                 background=True,
@@ -444,7 +829,6 @@ Downloading `{self.data['file_name']}`
                 ],
                 parse_mode="markdown",
             )
-            db.set(message.sender_id, time.monotonic(), ex=60)
             db.incr(
                 f"check_{message.sender_id}",
                 1,
@@ -0,0 +1,88 @@
+import asyncio
+import glob
+import logging
+import math
+import os
+import shutil
+
+log = logging.getLogger(__name__)
+
+COPY_CHUNK = 1024 * 1024
+
+
+async def split_at_keyframes(path: str, part_size: int, duration: float) -> list[str] | None:
+    """
+    Cut a video into playable parts with ffmpeg's segment muxer, no re-encode.
+
+    Segment length is derived from the average bitrate with some headroom,
+    parts are checked afterwards and None is returned if ffmpeg is missing,
+    fails, or a part still came out too big.
+    """
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg or not duration:
+        return None
+    size = os.path.getsize(path)
+    segment_time = max(1, int(duration * part_size / size * 0.9))
+    base, ext = os.path.splitext(path)
+    pattern = f"{base}.part%03d{ext or '.mp4'}"
+    proc = await asyncio.create_subprocess_exec(
+        ffmpeg, "-v", "error", "-y", "-i", path,
+        "-map", "0", "-c", "copy",
+        "-f", "segment", "-segment_time", str(segment_time),
+        "-reset_timestamps", "1", "-segment_format_options", "movflags=+faststart",
+        pattern,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    _, err = await proc.communicate()
+    parts = sorted(glob.glob(glob.escape(base) + ".part[0-9][0-9][0-9]*"))
+    if proc.returncode != 0 or not parts or any(os.path.getsize(p) > part_size for p in parts):
+        log.warning(f"Keyframe split of {path} failed: {err.decode(errors='ignore')[-300:]}")
+        remove_parts(parts)
+        return None
+    return parts
+
+
+def split_bytes(path: str, part_size: int) -> list[str]:
+    """Cut a file into `part_size` pieces, named .001, .002... like 7z/HJSplit"""
+    size = os.path.getsize(path)
+    count = math.ceil(size / part_size)
+    parts = []
+    with open(path, "rb") as f:
+        for index in range(count):
+            part = f"{path}.{index + 1:03d}"
+            parts.append(part)
+            remaining = min(part_size, size - index * part_size)
+            with open(part, "wb") as out:
+                while remaining:
+                    chunk = f.read(min(COPY_CHUNK, remaining))
+                    out.write(chunk)
+                    remaining -= len(chunk)
+    return parts
+
+
+async def split_file(path: str, part_size: int, duration: float = 0) -> tuple[list[str], bool]:
+    """
+    Split a file that is too big for Telegram.
+
+    Args:
+        path (str): The file to split.
+        part_size (int): Largest allowed part in bytes.
+        duration (float): Video duration in seconds, enables the keyframe split.
+
+    Returns:
+        tuple[list[str], bool]: The part paths and whether each part is a
+            playable video on its own.
+    """
+    parts = await split_at_keyframes(path, part_size, duration)
+    if parts:
+        return parts, True
+    return await asyncio.to_thread(split_bytes, path, part_size), False
+
+
+def remove_parts(parts: list[str]) -> None:
+    for part in parts:
+        try:
+            os.unlink(part)
+        except OSError:
+            pass
@@ -1,11 +1,20 @@
+import json
+import logging
 import re
+import time
 from pprint import pp
 from urllib.parse import parse_qs, urlparse
 
-import requests
-
+from http_client import http
+from metrics import RESOLVER_LATENCY
+from tracing import span
 from tools import get_formatted_size, check_url_patterns
 
+log = logging.getLogger(__name__)
+
+# Resolver that turns a share link into download links.
+API_URL = "https://terabox-api-production.up.railway.app/get_download"
+
 
 # At the top of the file, add this array of API keys
 RAPIDAPI_KEYS = [  # Original key
@@ -82,27 +91,31 @@ def extract_surl_from_url(url: str) -> str | None:
         return False
 
 
-def get_data(url: str):
-    print(f"get_data function called with URL: {url}")
-    
-    # New API endpoint
-    api_url = "https://terabox-api-production.up.railway.app/get_download"
-    
+async def get_data(url: str):
+    started = time.monotonic()
+    with span("resolve"):
+        data = await _request_data(url)
+    RESOLVER_LATENCY.observe(time.monotonic() - started, outcome="ok" if data else "failed")
+    return data
+
+
+async def _request_data(url: str):
+    api_url = API_URL
+
     # Request payload
     payload = {"url": url}
 
     try:
-        print(f"Making request to API...")
-        response = requests.post(api_url, json=payload, timeout=20)
-        print(f"Response status: {response.status_code}")
-        print(f"Response content: {response.text[:200]}...")
-        
-        if response.status_code != 200:
-            print("Request failed")
+        async with http.session.post(api_url, json=payload, timeout=http.timeout("api")) as response:
+            text = await response.text()
+        log.debug(f"Resolver answered {response.status} ({len(text)} bytes) for {url}")
+
+        if response.status != 200:
+            log.warning(f"Resolver answered {response.status} for {url}")
             return False
             
         # Parse response JSON
-        response_data = response.json()
+        response_data = json.loads(text)
         
         # Check if response is successful
         if response_data.get("status") == "success":
@@ -114,23 +127,26 @@ def get_data(url: str):
             url_1 = download_links.get("url_1")
             
             if not any([url_1, url_2, url_3]):
-                print("No download links found in response")
+                log.warning(f"Resolver found no download links for {url}")
                 return False
                 
+            # Keep every mirror, the transfer races them to find the fastest
+            mirrors = list(dict.fromkeys(link for link in [url_3, url_2, url_1] if link))
+
             data = {
                 "file_name": url.split("/")[-1] + ".mp4",  # Default filename
-                "direct_link": url_3,  # Primary URL
-                "backup_links": [url_1],  # Backup URLs in order
+                "direct_link": mirrors[0],  # Primary URL
+                "backup_links": mirrors[1:],  # Backup URLs in order
                 "thumb": "",  # No thumbnail in new API
                 "size": "0 B",  # Size not provided in new API
                 "sizebytes": 0,  # Size not provided in new API
             }
-            print(f"Successfully gathered data: {data}")
+            log.info(f"Resolved {url} to {len(mirrors)} mirrors")
             return data
         
-        print("API response indicates failure")
+        log.warning(f"Resolver reported a failure for {url}")
         return False
 
     except Exception as e:
-        print(f"Error with API request: {e}")
+        log.warning(f"Resolver request for {url} failed: {e}")
         return False
@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import os
+import shutil
+import struct
+import tempfile
+from io import BytesIO
+
+import aiohttp
+from PIL import Image
+
+from http_client import http
+
+log = logging.getLogger(__name__)
+
+THUMB_DIR = os.path.join(".cache", "thumbs")
+HEAD_BYTES = 4 * 1024 * 1024
+# Telegram wants JPEG thumbnails of at most 320px per side and 200KB.
+THUMB_SIZE = 320
+THUMB_MAX_BYTES = 200 * 1024
+# At most this many cached thumbnails, about 400MB at the size limit.
+THUMB_CACHE_ENTRIES = 2000
+
+
+async def fetch_head(url: str, size: int = HEAD_BYTES, timeout: float = 20) -> bytes:
+    """Fetch the first `size` bytes of `url` with a Range request"""
+    async with http.session.get(
+        url,
+        headers={"Range": f"bytes=0-{size - 1}"},
+        timeout=aiohttp.ClientTimeout(total=timeout),
+    ) as response:
+        if response.status not in (200, 206):
+            raise Exception(f"HTTP {response.status}: {response.reason}")
+        data = bytearray()
+        async for chunk in response.content.iter_chunked(256 * 1024):
+            data.extend(chunk)
+            if len(data) >= size:
+                break
+        return bytes(data[:size])
+
+
+def _iter_boxes(data: bytes, start: int = 0, end: int = None):
+    """Yield (type, payload_start, box_end) of the MP4 boxes in data[start:end]"""
+    end = len(data) if end is None else end
+    offset = start
+    while offset + 8 <= end:
+        size, kind = struct.unpack(">I4s", data[offset : offset + 8])
+        header = 8
+        if size == 1 and offset + 16 <= end:
+            size = struct.unpack(">Q", data[offset + 8 : offset + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header:
+            return
+        yield kind, offset + header, min(offset + size, end)
+        offset += size
+
+
+def find_cover(data: bytes) -> bytes | None:
+    """
+    Look for embedded cover art in the head of a video.
+
+    Handles the iTunes style `moov/udta/meta/ilst/covr` atom of MP4 files and
+    falls back to a JPEG attached next to a `cover` file name, which is how
+    Matroska files carry theirs.
+    """
+    path = (b"moov", b"udta", b"meta", b"ilst", b"covr", b"data")
+    start, end = 0, len(data)
+    for depth, name in enumerate(path):
+        for kind, payload, box_end in _iter_boxes(data, start, end):
+            if kind == name:
+                # `meta` is a full box, its children start after version/flags.
+                start, end = (payload + 4 if name == b"meta" else payload), box_end
+                break
+        else:
+            break
+    else:
+        # `data` payload: 4 bytes type, 4 bytes locale, then the image.
+        return data[start + 8 : end] or None
+
+    index = data.find(b"cover")
+    if index != -1:
+        jpeg = data.find(b"\xff\xd8\xff", index, index + 512)
+        if jpeg != -1:
+            stop = data.find(b"\xff\xd9", jpeg)
+            if stop != -1:
+                return data[jpeg : stop + 2]
+    return None
+
+
+async def extract_frame(head: bytes) -> bytes | None:
+    """Decode the first keyframe of a partial video with ffmpeg, if it is installed"""
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        return None
+    with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as f:
+        f.write(head)
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            ffmpeg, "-v", "error", "-i", f.name,
+            "-frames:v", "1", "-f", "image2pipe", "-vcodec", "mjpeg", "-",
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        try:
+            out, _ = await asyncio.wait_for(proc.communicate(), timeout=20)
+        except asyncio.TimeoutError:
+            proc.kill()
+            return None
+        return out or None
+    finally:
+        os.unlink(f.name)
+
+
+def make_thumbnail(image: bytes) -> bytes:
+    """Turn any image Pillow can read into a Telegram compliant JPEG thumbnail"""
+    with Image.open(BytesIO(image)) as img:
+        img = img.convert("RGB")
+        img.thumbnail((THUMB_SIZE, THUMB_SIZE))
+        for quality in (85, 70, 50, 30):
+            out = BytesIO()
+            img.save(out, "JPEG", quality=quality, optimize=True)
+            if out.tell() <= THUMB_MAX_BYTES:
+                break
+        return out.getvalue()
+
+
+def _cache_path(code: str) -> str:
+    return os.path.join(THUMB_DIR, f"{code}.jpg")
+
+
+def _store(path: str, thumb: bytes) -> None:
+    """Cache a thumbnail and drop the least recently used ones past the cap"""
+    os.makedirs(THUMB_DIR, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(thumb)
+    os.replace(tmp, path)
+    entries = [entry for entry in os.scandir(THUMB_DIR) if entry.name.endswith(".jpg")]
+    if len(entries) <= THUMB_CACHE_ENTRIES:
+        return
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    for entry in entries[: len(entries) - THUMB_CACHE_ENTRIES]:
+        try:
+            os.unlink(entry.path)
+        except OSError:
+            pass
+
+
+def _as_file(data: bytes) -> BytesIO:
+    content = BytesIO(data)
+    content.name = "thumbnail.jpg"
+    return content
+
+
+async def get_thumbnail(code: str, data: dict) -> BytesIO | None:
+    """
+    Build the thumbnail of a `get_data` result, cached per share code.
+
+    Uses the API's thumbnail when there is one, otherwise the cover art or the
+    first keyframe found in the head of the video.
+
+    Args:
+        code (str): The share code the file is cached under.
+        data (dict): The `get_data` result.
+
+    Returns:
+        BytesIO: The JPEG thumbnail, or None if none could be made.
+    """
+    path = _cache_path(code)
+    try:
+        with open(path, "rb") as f:
+            content = _as_file(f.read())
+        # mtime orders the cache for eviction
+        os.utime(path)
+        return content
+    except FileNotFoundError:
+        pass
+    try:
+        image = None
+        if data.get("thumb"):
+            image = await fetch_head(data["thumb"], size=THUMB_MAX_BYTES * 10)
+        else:
+            head = await fetch_head(data["direct_link"])
+            image = await asyncio.to_thread(find_cover, head) or await extract_frame(head)
+        if not image:
+            return None
+        thumb = await asyncio.to_thread(make_thumbnail, image)
+    except Exception as e:
+        log.warning(f"Thumbnail for {code} failed: {e}")
+        return None
+    await asyncio.to_thread(_store, path, thumb)
+    return _as_file(thumb)
@@ -1,3 +1,5 @@
+import json
+import logging
 import os
 import re
 import traceback
@@ -6,14 +8,18 @@ from contextlib import suppress
 from io import BytesIO
 from urllib.parse import parse_qs, urlparse
 
-import requests
 from PIL import Image
 from telethon import TelegramClient
 import aiohttp
 import asyncio
 
 from config import BOT_USERNAME, PUBLIC_EARN_API
+from file_writer import FileWriter
+from http_client import http
 from redis_db import db
+from workspace import preallocate
+
+log = logging.getLogger(__name__)
 
 
 def check_url_patterns(url: str) -> bool:
@@ -192,60 +198,189 @@ async def is_user_on_chat(bot: TelegramClient, chat_id: int, user_id: int) -> bo
         return False
 
 
-async def download_file(url: str, filename: str, callback=None) -> str | bool:
+async def download_file(url: str, filename: str, progress=None, resume: bool = False) -> str | bool:
     try:
-        print(f"Starting download from {url} to {filename}")
+        log.info(f"Starting download from {url} to {filename}")
+        # Continue a partial file if asked to, the server decides if it can
+        offset = os.path.getsize(filename) if resume and os.path.exists(filename) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
         
-        # Use aiohttp instead of requests for async operations
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, timeout=aiohttp.ClientTimeout(total=3600)) as response:
-                if response.status != 200:
-                    raise Exception(f"HTTP {response.status}: {response.reason}")
+        # Through the pool kept for whole-file transfers
+        async with http.bulk.get(url, headers=headers, timeout=http.timeout("download")) as response:
+            if offset and response.status == 416:
+                # Nothing left past the partial file: it is whole if the
+                # server's size agrees, otherwise start over
+                if response.headers.get("Content-Range", "") == f"bytes */{offset}":
+                    log.info(f"{filename} was already complete")
+                    return filename
+                log.info(f"Server refused to resume {filename} at {offset}, starting over")
+                os.remove(filename)
+                return await download_file(url, filename, progress)
+            if response.status == 200:
+                offset = 0
+            elif not (offset and response.status == 206):
+                raise Exception(f"HTTP {response.status}: {response.reason}")
                 
-                total_size = int(response.headers.get('content-length', 0))
-                print(f"Content length: {total_size} bytes")
+            total_size = int(response.headers.get('content-length', 0))
+            if total_size:
+                total_size += offset
+            log.debug(f"Content length: {total_size} bytes" + (f", resuming at {offset}" if offset else ""))
                 
-                # Ensure directory exists
-                os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+            # Ensure directory exists
+            os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
                 
-                downloaded_size = 0
-                chunk_size = 1024 * 1024  # 1MB chunks
+            downloaded_size = offset
+            chunk_size = 1024 * 1024  # 1MB chunks
                 
-                with open(filename, 'wb') as f:
-                    async for chunk in response.content.iter_chunked(chunk_size):
-                        if not chunk:
-                            continue
+            if not offset:
+                open(filename, 'wb').close()
+            # Disk writes happen on the writer's thread, not the event loop
+            writer = FileWriter(filename)
+            try:
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    if not chunk:
+                        continue
                             
-                        f.write(chunk)
-                        downloaded_size += len(chunk)
+                    await writer.write(downloaded_size, chunk)
+                    downloaded_size += len(chunk)
                         
-                        if callback:
-                            try:
-                                await callback(downloaded_size, total_size, "Downloading")
-                            except Exception as e:
-                                print(f"Callback error: {e}")
+                    if progress:
+                        progress.update(downloaded_size, total_size, "Downloading")
+            finally:
+                await writer.close()
                 
-                # Verify download
-                if os.path.exists(filename):
-                    actual_size = os.path.getsize(filename)
-                    if total_size > 0 and actual_size != total_size:
-                        raise Exception(f"Download incomplete. Expected {total_size} bytes, got {actual_size} bytes")
-                    print(f"File saved successfully: {filename}")
-                    return filename
+            # Verify download
+            if os.path.exists(filename):
+                actual_size = os.path.getsize(filename)
+                if total_size > 0 and actual_size != total_size:
+                    raise Exception(f"Download incomplete. Expected {total_size} bytes, got {actual_size} bytes")
+                log.info(f"File saved successfully: {filename}")
+                return filename
                     
-                raise Exception("File not found after download")
+            raise Exception("File not found after download")
                 
     except asyncio.TimeoutError:
-        print("Download timed out")
+        log.warning(f"Download of {url} timed out")
         raise
     except aiohttp.ClientError as e:
-        print(f"Network error: {e}")
+        log.warning(f"Network error downloading {url}: {e}")
         raise
     except Exception as e:
-        print(f"Download error: {e}")
+        log.warning(f"Download of {url} failed: {e}")
         raise
 
 
+def _load_segments(filename: str, total_size: int, segments: int) -> list[int] | None:
+    """Bytes already fetched per segment of a resumable download, if they can be trusted"""
+    try:
+        with open(f"{filename}.state") as f:
+            state = json.load(f)
+        if state["size"] != total_size or len(state["done"]) != segments:
+            return None
+        if os.path.getsize(filename) != total_size:
+            return None
+        return state["done"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _save_segments(filename: str, total_size: int, done: list[int]) -> None:
+    tmp = f"{filename}.state.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"size": total_size, "done": done}, f)
+    os.replace(tmp, f"{filename}.state")
+
+
+async def download_file_segmented(
+    url: str, filename: str, total_size: int, progress=None, segments: int = 4, resume: bool = False
+) -> str:
+    """
+    Downloads a file with parallel Range requests into a preallocated file.
+
+    Args:
+        url (str): The download link, the server must support Range requests.
+        filename (str): Where to write the file.
+        total_size (int): Size of the file as reported by the probe.
+        progress (TransferProgress): Optional counters to update.
+        segments (int): Number of concurrent Range requests.
+        resume (bool): Keep a `.state` file next to `filename` and continue
+            from it, so an interrupted download keeps the bytes it fetched.
+
+    Returns:
+        str: The filename.
+    """
+    log.info(f"Starting segmented download ({segments}) from {url} to {filename}")
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    downloaded = _load_segments(filename, total_size, segments) if resume else None
+    if downloaded:
+        log.info(f"Resuming at {sum(downloaded)} of {total_size} bytes")
+    else:
+        downloaded = [0] * segments
+        # fallocate may be emulated by writing zeros, keep that off the loop
+        await asyncio.to_thread(preallocate, filename, total_size)
+
+    chunk_size = 1024 * 1024  # 1MB chunks
+    segment_size = -(-total_size // segments)
+    # Progress is only recorded after the bytes behind it are on disk.
+    checkpoint = 8 * chunk_size
+    unsaved = [0] * segments
+
+    async def fetch(session: aiohttp.ClientSession, index: int):
+        segment_start = index * segment_size
+        end = min(segment_start + segment_size, total_size) - 1
+        start = segment_start + downloaded[index]
+        if start > end:
+            return
+        async with session.get(
+            url,
+            headers={"Range": f"bytes={start}-{end}"},
+            timeout=http.timeout("download"),
+        ) as response:
+            if response.status != 206:
+                raise Exception(f"HTTP {response.status}: Range request not honoured")
+
+            async def save():
+                await writer.sync()
+                downloaded[index] += unsaved[index]
+                unsaved[index] = 0
+                _save_segments(filename, total_size, downloaded)
+
+            try:
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    await writer.write(start + unsaved[index], chunk)
+                    unsaved[index] += len(chunk)
+                    if resume and unsaved[index] >= checkpoint:
+                        start += unsaved[index]
+                        await save()
+                    if progress:
+                        progress.update(sum(downloaded) + sum(unsaved), total_size, "Downloading")
+            finally:
+                # Also keeps what a failed or cancelled segment got
+                if resume:
+                    await save()
+        downloaded[index] += unsaved[index]
+        unsaved[index] = 0
+        if downloaded[index] != end - segment_start + 1:
+            raise Exception(
+                f"Segment {index} incomplete. Expected {end - segment_start + 1} bytes, got {downloaded[index]} bytes"
+            )
+
+    writer = FileWriter(filename)
+    try:
+        tasks = [asyncio.ensure_future(fetch(http.bulk, i)) for i in range(segments)]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+    finally:
+        await writer.close()
+    log.info(f"File saved successfully: {filename}")
+    return filename
+
+
 def save_image_from_bytesio(image_bytesio, filename):
     try:
         image_bytesio.seek(0)
@@ -256,11 +391,11 @@ def save_image_from_bytesio(image_bytesio, filename):
         return filename
 
     except Exception as e:
-        print(f"Error saving image: {e}")
+        log.warning(f"Error saving image: {e}")
         return False
 
 
-def download_image_to_bytesio(url: str, filename: str) -> BytesIO | None:
+async def download_image_to_bytesio(url: str, filename: str) -> BytesIO | None:
     """
     Downloads an image from a URL and returns it as a BytesIO object.
 
@@ -272,51 +407,32 @@ def download_image_to_bytesio(url: str, filename: str) -> BytesIO | None:
         BytesIO: The image data as a BytesIO object, or None if the download failed.
     """
     try:
-        response = requests.get(url)
-        content = BytesIO()
+        async with http.session.get(url, timeout=http.timeout("image")) as response:
+            if response.status != 200:
+                return None
+            content = BytesIO(await response.read())
         content.name = filename
-        if response.status_code == 200:
-            for chunk in response.iter_content(chunk_size=1024):
-                content.write(chunk)
-        else:
-            return None
-        content.seek(0)
         return content
     except Exception:
         return None
 
 
-def remove_all_videos():
-    current_directory = os.getcwd()
-
-    video_extensions = [".mp4", ".mkv", ".webm"]
-
-    try:
-        for file_name in os.listdir(current_directory):
-            if any(file_name.lower().endswith(ext) for ext in video_extensions):
-                file_path = os.path.join(current_directory, file_name)
-
-                os.remove(file_path)
-
-    except Exception as e:
-        print(f"Error: {e}")
-
-
-def generate_shortenedUrl(
+async def generate_shortenedUrl(
     sender_id: int,
 ):
     try:
         uid = str(uuid.uuid4())
-        data = requests.get(
+        async with http.session.get(
             "https://publicearn.com/api",
             params={
                 "api": PUBLIC_EARN_API,
                 "url": f"https://t.me/{BOT_USERNAME}?start=token_{uid}",
                 "alias": uid.split("-", maxsplit=2)[0],
             },
-        )
-        data.raise_for_status()
-        data_json = data.json()
+            timeout=http.timeout("api"),
+        ) as data:
+            data.raise_for_status()
+            data_json = await data.json(content_type=None)
         if data_json.get("status") == "success":
             url = data_json.get("shortenedUrl")
             db.set(f"token_{uid}", f"{sender_id}|{url}", ex=21600)
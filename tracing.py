@@ -0,0 +1,180 @@
+import asyncio
+import atexit
+import functools
+import json
+import logging
+import os
+import queue
+import sys
+import time
+import uuid
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from config import LOG_FORMAT
+from metrics import STAGE_DURATION
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+log = logging.getLogger(__name__)
+
+job_id: ContextVar[str | None] = ContextVar("job_id", default=None)
+stage: ContextVar[str | None] = ContextVar("stage", default=None)
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(job_id)s] %(message)s"
+
+# Attributes every LogRecord has, anything else came in through `extra`.
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+_listener: QueueListener | None = None
+
+
+def start_job(existing: str = None) -> str:
+    """
+    Give the current task (and the tasks it creates) a job ID.
+
+    Args:
+        existing (str): Continue under this ID instead of a new one.
+
+    Returns:
+        str: The job ID every log line and span of the job carries.
+    """
+    current = existing or uuid.uuid4().hex[:12]
+    job_id.set(current)
+    return current
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Time one stage of a job: resolve, probe, download, upload, forward or
+    cleanup. Logs the outcome and duration, feeds the stage histogram and
+    opens an OpenTelemetry span when the API is installed.
+    """
+    token = stage.set(name)
+    started = time.perf_counter()
+    outcome = "ok"
+    with ExitStack() as stack:
+        if otel_trace is not None:
+            otel_span = stack.enter_context(
+                otel_trace.get_tracer(__name__).start_as_current_span(name)
+            )
+            otel_span.set_attribute("job_id", job_id.get() or "")
+            for key, value in attributes.items():
+                otel_span.set_attribute(key, value)
+        try:
+            yield
+        except BaseException as e:
+            outcome = "cancelled" if isinstance(e, asyncio.CancelledError) else "error"
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            STAGE_DURATION.observe(elapsed, stage=name, outcome=outcome)
+            log.info(
+                f"{name} {outcome} in {elapsed * 1000:.0f}ms",
+                extra={"duration_ms": round(elapsed * 1000, 1), "outcome": outcome, **attributes},
+            )
+            stage.reset(token)
+
+
+def traced(name: str):
+    """Run a coroutine function as a span named `name`"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the job and stage the record came from"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and value is not None:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class JobQueueHandler(QueueHandler):
+    """
+    Hands records to the listener thread, stamped with the job context of
+    the task that logged them, since that is gone by the time they're written.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.job_id = job_id.get()
+        record.stage = stage.get()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+def setup_logging(level: int = logging.INFO, fmt: str = LOG_FORMAT) -> None:
+    """
+    Send all logging through a queue to a writer thread, so a slow stdout
+    never stalls the event loop.
+
+    Args:
+        level (int): Root log level.
+        fmt (str): "json" for one object per line, "text" for the classic format.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(sys.stdout)
+    if fmt == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter(TEXT_FORMAT, datefmt="%Y-%m-%d %H:%M:%S"))
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers = [JobQueueHandler(records)]
+    root.setLevel(level)
+    _listener = QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    setup_tracing()
+
+
+def setup_tracing() -> bool:
+    """
+    Export spans over OTLP when OTEL_EXPORTER_OTLP_ENDPOINT is set and the
+    OpenTelemetry SDK and exporter are installed. Returns whether it did.
+    """
+    if otel_trace is None or not os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT"):
+        return False
+    try:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError:
+        log.warning("OTEL_EXPORTER_OTLP_ENDPOINT is set but the OpenTelemetry SDK is not installed")
+        return False
+    provider = TracerProvider(resource=Resource.create({"service.name": "terabox-bot"}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    otel_trace.set_tracer_provider(provider)
+    log.info("Exporting traces over OTLP")
+    return True
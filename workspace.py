@@ -0,0 +1,166 @@
+import logging
+import os
+import shutil
+import sys
+import threading
+import uuid
+
+from config import WORKSPACE_QUOTA
+
+log = logging.getLogger(__name__)
+
+WORKSPACE_DIR = os.path.join(".cache", "jobs")
+# Free disk admission always leaves for everything else.
+DISK_HEADROOM = 512 * 1024 * 1024
+VIDEO_EXTENSIONS = (".mp4", ".mkv", ".webm")
+
+
+def preallocate(path: str, size: int) -> None:
+    """Reserve `size` bytes for `path` up front, so parallel writes don't fragment it"""
+    with open(path, "wb") as f:
+        if size and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+                return
+            except OSError:
+                pass
+        f.truncate(size)
+
+
+def _pid_alive(pid: int) -> bool:
+    if sys.platform == "win32":
+        # os.kill would terminate the process here
+        import ctypes
+
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)
+        if not handle:
+            return False
+        code = ctypes.c_ulong()
+        ctypes.windll.kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+        ctypes.windll.kernel32.CloseHandle(handle)
+        return code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class Job:
+    """A job's private directory and the disk space it was admitted with"""
+
+    def __init__(self, path: str, reserved: int):
+        self.path = path
+        self.reserved = reserved
+
+    def file(self, name: str) -> str:
+        return os.path.join(self.path, os.path.basename(name) or "file")
+
+
+class Workspace:
+    """
+    Job directories under WORKSPACE_DIR with a total disk quota.
+
+    Jobs are admitted with the space they expect to need, and their directory
+    is removed as a whole when they end. Directories are named after the
+    process that made them; those of processes that have exited are orphans
+    and are reaped on start, while another live process keeps its own.
+    """
+
+    def __init__(self, root: str = WORKSPACE_DIR, quota: int = WORKSPACE_QUOTA):
+        self.root = root
+        self.quota = quota
+        self._jobs: dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def reserved(self) -> int:
+        return sum(job.reserved for job in self._jobs.values())
+
+    def admit(self, size: int) -> Job | None:
+        """
+        Create a job directory if `size` bytes fit the quota and the disk.
+
+        Args:
+            size (int): Disk space the job may use at its peak.
+
+        Returns:
+            Job: The new job, or None if there is no room for it right now.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        with self._lock:
+            if self.reserved + size > self.quota:
+                return None
+            if shutil.disk_usage(self.root).free < size + DISK_HEADROOM:
+                return None
+            path = os.path.join(self.root, f"{os.getpid()}-{uuid.uuid4().hex}")
+            os.makedirs(path)
+            job = Job(path, size)
+            self._jobs[path] = job
+        return job
+
+    def release(self, job: Job | None) -> None:
+        """Delete a job's directory and give back its reservation"""
+        if not job:
+            return
+        with self._lock:
+            self._jobs.pop(job.path, None)
+        shutil.rmtree(job.path, ignore_errors=True)
+
+    def _orphans(self) -> list[str]:
+        if not os.path.isdir(self.root):
+            return []
+        with self._lock:
+            active = set(self._jobs)
+        orphans = []
+        for entry in os.scandir(self.root):
+            if not entry.is_dir() or entry.path in active:
+                continue
+            pid, _, _ = entry.name.partition("-")
+            # A restarted container often gets the same pid, so our own pid
+            # only marks our running jobs, which are in `active`
+            if pid.isdigit() and int(pid) != os.getpid() and _pid_alive(int(pid)):
+                continue
+            orphans.append(entry.path)
+        return orphans
+
+    def reap(self) -> int:
+        """Remove directories no running job owns, returns the bytes freed"""
+        freed = 0
+        for path in self._orphans():
+            freed += _dir_size(path)
+            shutil.rmtree(path, ignore_errors=True)
+        if freed:
+            log.info(f"Reaped {freed / 1024**2:.0f}MB of orphaned job files")
+        return freed
+
+    def purge(self) -> int:
+        """
+        Reap orphans and the loose videos jobs used to leave in the working
+        directory, without touching running jobs. Returns the bytes freed.
+        """
+        freed = self.reap()
+        for name in os.listdir(os.getcwd()):
+            if name.lower().endswith(VIDEO_EXTENSIONS) and os.path.isfile(name):
+                freed += os.path.getsize(name)
+                os.remove(name)
+        return freed
+
+    def stats(self) -> dict:
+        return {"jobs": len(self._jobs), "reserved": self.reserved, "quota": self.quota}
+
+
+workspace = Workspace()